@@ -7,19 +7,97 @@ The purpose of this library is to be able to populate KiCAD libraries with
 components using only Digi-Key part numbers
 
 USAGE:
-Currently, this only works as a Python script in Python 3.6 with Digi-Key. To run the script,
-add in either one or a group of Digi-Key part numbers to the list "partNum".
-Only capacitors, inductors, and resistors are supported at this time.
+Currently, this only works with Digi-Key. Give the script files of Digi-Key part numbers
+(plain text with one per line, or CSV/TSV such as BOMs made by bom2csvSFUsat.xsl), or
+pipe them in on stdin:
+
+python kicadLibPop.py import parts.txt bom.csv
+python kicadLibPop.py import -p 490-1524-1-ND -p 311-10.0KHRCT-ND
+cat parts.txt | python kicadLibPop.py import
+python kicadLibPop.py import -m GRM188R71E104KA01D --catalog parts.csv
+
+Parts are read and written in chunks, so part lists of any size can be imported.
+Requests that time out or fail are retried; parts that still can't be fetched are
+skipped, and the import stops if the supplier keeps failing. Running the same command
+again carries on from where it stopped and retries the skipped parts (--restart to
+start over).
+
+Manufacturer part numbers (-m) are looked up too. Parts can also come from local CSV or
+SQLite catalogs (--catalog, one row per part and a column per field), which are checked
+before Digi-Key; with --cache-mode offline a BOM is resolved without the network (see
+kicadLibPopSupplier.py).
+
+Each import writes a report to .cache/import-report.json: time per stage, counters and
+what happened to each part (see kicadLibPopStats.py). --profile adds a cProfile of every
+thread and --trace-memory the peak memory use.
+
+python kicadLibPop.py regenerate [--dry-run] [--keep-names]
+
+re-renders every part in the libraries that has a supplier part number with the current
+naming rules, attribute configs and symbol shapes (from the attribute store, or the
+attributes saved in the symbols). Symbols in SFUSat.lib keep their hand-made drawings, and
+symbols whose names were edited by hand (e.g. a HIQ added to a capacitor) keep their names.
+
+python kicadLibPop.py store adopt|refresh|sync|list|remove
+
+keeps every part in a SQLite part store (.cache/parts.sqlite, see kicadLibPopStore.py) with
+its attributes, name, footprint, library and a revision stamp. Imports record the parts they
+add; adopt records the parts already in the libraries. refresh works every part out again
+with the current rules and sync writes only the parts that changed since the last sync,
+without reading the libraries when nothing else has touched them.
+
+python kicadLibPop.py diff [OLD NEW] [--update]
+python kicadLibPop.py merge OURS THEIRS [--base BASE] [-o OUTPUT]
+
+diff lists the symbols that changed between two .lib/.dcm files, or with no files, in each
+library since the script last regenerated or merged it (see kicadLibPopManifest.py). merge
+merges another version of a library symbol by symbol and works as a git merge driver.
+
+python kicadLibPop.py check [FILE ...] [--jobs N] [--json]
+
+checks every library (or the .lib/.dcm files given) for footprints that don't exist,
+duplicate symbols, symbols without descriptions, [FIX_THIS] names and pin/pad count
+mismatches (see kicadLibPopCheck.py), and fails if it finds an error, so it can be used
+as a pre-commit hook.
+
+python kicadLibPop.py footprints [SFUSat-cap:C_0603 ...] [--mismatches] [--json]
+
+shows the pads, courtyard size and 3D models of footprints, or with --mismatches, the
+symbols whose pin count doesn't match their footprint's pad count. Footprints are only
+parsed again after they change (see kicadLibPopFootprint.py).
+
+python kicadLibPop.py bom netlist.xml [-o bom.csv] [--group] [--join]
+
+writes the same CSV BOM as bom2csvSFUsat.xsl from an EESCHEMA XML netlist, without xsltproc
+and in time linear in the netlist (see kicadLibPopBom.py). --group puts identical parts on
+one row with a quantity, and --join fills in supplier part numbers that components are
+missing from their symbols in the libraries. As a KiCAD BOM plugin:
+python "path/to/kicadLibPop.py" bom "%I" -o "%O.csv"
+
+python kicadLibPop.py symgen TMS570LS0432.csv [--footprint SFUSat:...] [--replace] [--print]
+
+draws a multi-unit symbol from a pin table (a CSV/TSV row per pin with its number, name, type
+and optionally group) with the pins grouped by bank or function, and adds it to SFUSat.lib
+(see kicadLibPopSymgen.py). Any number of tables can be given at once. Imported parts that
+would get an empty symbol are drawn the same way if pintables/<MPN>.csv exists.
+
+python kicadLibPop.py search [--lib cap] "package=0603" "capacitance>=10u" "voltage>=16V"
+
+finds parts in the libraries by their parameters (see kicadLibPopSearch.py). When a part is
+imported, parts already in its library with the same value and package that are at least as
+good are listed, so a duplicate under another part number is easy to spot.
+
+The same thing can be done from Python with kicadLibPop.main(["import", ...]).
+Capacitors, inductors, ferrite beads and resistors get generated symbols; everything
+else gets an empty symbol in SFUSat.lib, unless it has a pin table.
 
 Created: Wed 20180131-0007
 Last updated: Wed 20180321-
 Author: Alex Naylor
 
 FUTURE ADDITIONS:
--Ability to find DK PN based on MPN
 -Ability to add more components to other libraries (i.e. diodes, connectors, 
  etc.)
--Make the script runnable from the CLI
 -Add Mouser support
 
 CHANGELOG (V0.0.5):
@@ -28,13 +106,38 @@ AN:
 -Added automatic ferrite bead parsing
 """
 
-import bs4
+import argparse
+import csv
+import glob
+import hashlib
+import inspect
+import itertools
+import json
+import kicadLibPopParse
 import os
 import re
 import sys
 
+from kicadLibPopBom import writeBom
+from kicadLibPopCheck import checkScan, formatViolation, scanLibrary, severities
+from kicadLibPopCache import AttrStore, CacheMiss, Checkpoint, PageCache
 from kicadLibPopConst import *
-from urllib.request import urlopen
+from kicadLibPopFetch import CircuitBreaker, FetchError, HttpSession, RateLimiter, RetryPolicy, fetchAll, fetchUrl, inOrder
+from kicadLibPopFootprint import FootprintGeometry, FootprintIndex, resolveModel
+from concurrent.futures import ProcessPoolExecutor
+from kicadLibPopLib import LibPartTemplate, LibSymbol, appendBlocks, descHeader, descName, descTrailer, getLibrary, joinBlocks
+from kicadLibPopLib import Library, libHeader, libTrailer
+from kicadLibPopLib import parseLib, readText, renameLibLine, renameSymbols, splitDcm, splitLib, unloadLibrary, writeText
+from kicadLibPopManifest import Manifest, currentManifest, diffManifests, fileFormat, mergeBlocks, splitFile, updateManifest
+from kicadLibPopParse import PageParseError, getTableRows
+from kicadLibPopRules import RuleSet
+from kicadLibPopSearch import SearchIndex, parseCondition, symbolFields
+from kicadLibPopStats import RunStats
+from kicadLibPopStore import PartStore, StoredPart
+from kicadLibPopSymgen import findPinTable, generateSymbol, readPinTable, symbolAttrConfig
+from kicadLibPopSupplier import DigiKeySupplier, LocalCatalog, Suppliers, strategies
+from kicadLibPopUnits import canonicalizeNames, makeValueStr, parseUnit
+from xml.etree.ElementTree import ParseError
 
 fieldsToIgnore = ["Detailed Description",
                   "Moisture Sensitivity Level (MSL)",
@@ -70,47 +173,88 @@ indDescFilePath = dirName+pathDelim+indDescFile
 resDescFilePath = dirName+pathDelim+resDescFile
 otherDescFilePath = dirName+pathDelim+otherDescFile
 
-capLibContents = None
-indLibContents = None
-resLibContents = None
-otherLibContents = None
-
-capDescContents = None
-indDescContents = None
-resDescContents = None
-otherDescContents = None
-
-#To hold all of the parts for the library file
-capParts = []
-indParts = []
-resParts = []
-otherParts = []
-
-#To hold all of the descriptions for the description file
-capDesc = []
-indDesc = []
-resDesc = []
-otherDesc = []
-
-productList = {} #For processing multiple parts
-productAttrDict = {} #Product attributes that are not required for a KiCAD part
-fixedAttrDict = {} #Fixed attributes in KiCAD
-
-partDict = {"capParts":[],#list of all of the parts to be written to various libraries
-            "indParts":[],
-            "resParts":[],
-            "otherParts":[]} 
-libDict = {"capLib":{capLibFile:capLibContents},#list of all of the libraries to be written to
-           "indLib":{indLibFile:indLibContents},
-           "resLib":{resLibFile:resLibContents},
-           "otherLib":{otherLibFile:otherLibContents}}
-
-dataToWrite = [] #data to write to the library file
-
-#Part numbers to add to the library
-partNums = ["74LVC1G14SE-7CT-ND"]
-partNums = list(set(partNums)) #Ensures no duplicates
-partNums = [partNum.strip() for partNum in partNums] #Removes beginning and trailing whitespace
+#Library files for each library key: (library path, description path, name used in messages)
+libraryFiles = {"cap":(capLibFilePath,capDescFilePath,"capacitor library"),
+                "ind":(indLibFilePath,indDescFilePath,"inductor library"),
+                "res":(resLibFilePath,resDescFilePath,"resistor library"),
+                "other":(otherLibFilePath,otherDescFilePath,"library")}
+
+#Part numbers are read and processed this many at a time
+chunkSize = 100
+
+#Column names that hold Digi-Key part numbers in CSV/TSV part lists (e.g. BOMs from bom2csvSFUsat.xsl)
+partNumColumns = ["Supplier Part Number 1",
+                  "Digi-Key Part Number",
+                  "Digi-Key Part #",
+                  "Digi-Key PN",
+                  "DK PN"]
+
+#Batch fetching options
+dkUrlTemplate = "https://www.digikey.com/scripts/DkSearch/dksus.dll?Detail&name={0}"
+fetchConcurrency = 4 #number of product pages fetched at the same time
+httpPoolSize = None #connections kept open to a host (None for one per fetch thread)
+fetchRateLimit = 2.0 #maximum requests per second to a single host (None for no limit)
+fetchTimeout = 15.0 #seconds to wait for the server before a request is retried
+fetchRetries = 3 #times a request is retried after a timeout, dropped connection or 429/5xx response
+fetchBackoff = 0.5 #seconds before the first retry; doubles (with jitter) after each one, up to fetchMaxBackoff
+fetchMaxBackoff = 10.0
+breakerThreshold = 5 #failed requests in a row before the import stops (it can be resumed later)
+breakerResetTime = 30.0 #seconds before a request is tried again after that
+
+#Supplier backends, asked at the same time (see kicadLibPopSupplier.py); Digi-Key is always the last one
+catalogPaths = [] #CSV or SQLite part catalogs; with pageCacheMode "offline" only these and cached pages are used
+supplierStrategy = "first" #"first" takes the first backend to have a part, "complete" the answer with the most fields
+
+#Product page parser; can be "html5lib", "strainer" or "tokenizer" (see kicadLibPopParse.py)
+parserBackend = "tokenizer"
+
+#Page cache options
+pageCacheDir = os.path.join(dirName,".cache","pages")
+pageCacheTtl = 7*24*3600 #seconds before a cached page is downloaded again (None to never expire)
+pageCacheMaxBytes = 50*1024*1024 #least recently used pages are removed past this size (None for no limit)
+pageCacheMode = "normal" #can be "normal", "offline" (never use the network) or "refresh" (always download)
+
+#Parsed attribute store options
+attrStorePath = os.path.join(dirName,".cache","attrs.sqlite")
+useAttrStore = True #skip downloading and parsing parts that have already been parsed
+
+#Part store (see kicadLibPopStore.py); every imported part is recorded here, and "store sync" writes the parts changed
+#in it to the libraries
+partStorePath = os.path.join(dirName,".cache","parts.sqlite")
+usePartStore = True
+
+#Footprint index; the listing of each .pretty library is kept here until the library changes
+footprintIndexPath = os.path.join(dirName,".cache","footprints.json")
+#Footprint geometry (pads, courtyard, 3D models); each footprint is kept here until its file changes
+footprintGeometryPath = os.path.join(dirName,".cache","footprint-geometry.json")
+
+#Pin tables (see kicadLibPopSymgen.py); a part going into SFUSat.lib is drawn from <pinTableDir>/<MPN>.csv if there is one
+pinTableDir = os.path.join(dirName,"pintables")
+symbolUnitPins = 48 #pins per unit before a group of pins is split over several units
+
+#Parametric search index; the fields of each library are kept here until the library changes
+searchIndexPath = os.path.join(dirName,".cache","search.json")
+
+#Import checkpoint; an interrupted import carries on from here when it's run again with the same input
+checkpointPath = os.path.join(dirName,".cache","import.checkpoint")
+
+#Run report (see kicadLibPopStats.py); written at the end of every import
+reportPath = os.path.join(dirName,".cache","import-report.json")
+profileImports = False #profile every thread with cProfile (saved next to the report as a .prof file)
+traceImportMemory = False #record the peak memory and the lines that allocated the most with tracemalloc
+
+rateLimiter = RateLimiter(fetchRateLimit)
+retryPolicy = RetryPolicy(fetchRetries,fetchTimeout,fetchBackoff,fetchMaxBackoff)
+httpSession = HttpSession(httpPoolSize or fetchConcurrency,fetchTimeout)
+fetchBreaker = CircuitBreaker(breakerThreshold,breakerResetTime)
+footprintIndex = FootprintIndex(dirName,footprintIndexPath)
+footprintGeometry = FootprintGeometry(dirName,footprintGeometryPath)
+pageCache = PageCache(pageCacheDir,pageCacheTtl,pageCacheMaxBytes,pageCacheMode)
+attrStore = None #opened by importFiles
+partStore = None #opened by importFiles
+suppliers = None #made by importFiles (see makeSuppliers)
+runStats = RunStats() #replaced by importFiles for each import
+searchIndex = None #built the first time it's needed (see getSearchIndex)
 
 #constants 
 nonNumericChars = r"[^\d.+]"
@@ -245,93 +389,239 @@ capSymbolShape = "DRAW\nP 2 0 1 20 -80 -30 80 -30 N\nP 2 0 1 20 -80 30 80 30 N\n
 indSymbolShape = "DRAW\nA -75 0 25 1 -1801 0 1 0 N -50 0 -100 0\nA -25 0 25 1 -1801 0 1 0 N 0 0 -50 0\nA 25 0 25 1 -1801 0 1 0 N 50 0 0 0\nA 75 0 25 1 -1801 0 1 0 N 100 0 50 0\nX 1 1 -150 0 50 R 50 50 1 1 P\nX 2 2 150 0 50 L 50 50 1 1 P\nENDDRAW"
 resSymbolShape = "DRAW\nS 100 -40 -100 40 0 1 10 N\nX ~ 1 -150 0 50 R 50 50 1 1 P\nX ~ 2 150 0 50 L 50 50 1 1 P\nENDDRAW"
 otherSymbolShape = "DRAW\nENDDRAW" #If the symbol is not standard
+
+#Part families (see kicadLibPopRules.py); the first rule that matches a part's Categories is used
+#{value}, {tolerance}, {tempCoefficient}, {power} and {package} are worked out by the functions in partRuleParams,
+#anything else in a template is copied from the product attributes
+#"similarFields" are the (field, comparison) pairs a part already in the library has to meet to be reported as an
+#equivalent of a new part (see kicadLibPopSearch.py)
+partRules = [{"name":"cap",
+              "match":"Capacitor",
+              "library":"cap",
+              "valueField":"Capacitance",
+              "unitIndex":-2, #where the SI prefix is in the value field
+              "defaultUnit":"",
+              "nameTemplate":"C_{value}_{tolerance}_{Voltage - Rated}_{tempCoefficient}_{package}",
+              "footprintLib":"SFUSat-cap",
+              "footprintTemplate":"C_{package}",
+              "similarFields":[("Capacitance","="),("Package / Case","="),("Voltage - Rated",">="),("Tolerance","<=")],
+              "reference":"C",
+              "attrConfig":capAttrConfig,
+              "symbolShape":capSymbolShape},
+             {"name":"ind",
+              "match":"Inductor",
+              "library":"ind",
+              "valueField":"Inductance",
+              "unitIndex":-2,
+              "defaultUnit":"",
+              "nameTemplate":"L_{value}_{tolerance}_{Current Rating}_{package}",
+              "footprintLib":"SFUSat-ind",
+              "footprintTemplate":"L_{package}",
+              "similarFields":[("Inductance","="),("Package / Case","="),("Current Rating",">="),("Tolerance","<=")],
+              "reference":"L",
+              "attrConfig":indAttrConfig,
+              "symbolShape":indSymbolShape},
+             {"name":"ferrite",
+              "match":"Ferrite",
+              "library":"ind",
+              "valueField":"Impedance @ Frequency",
+              "unitIndex":-14,
+              "valueEnd":-14, #drop the " Ohms @ 100MHz" part
+              "defaultUnit":"R",
+              "nameTemplate":"FB_{value}_{Current Rating (Max)}_{package}",
+              "footprintLib":"SFUSat-ind",
+              "footprintTemplate":"L_{package}",
+              "similarFields":[("Impedance @ Frequency","="),("Package / Case","="),("Current Rating (Max)",">=")],
+              "reference":"L",
+              "attrConfig":indAttrConfig,
+              "symbolShape":indSymbolShape},
+             {"name":"res",
+              "match":"Resistor",
+              "exclude":"Potentiometers",
+              "library":"res",
+              "valueField":"Resistance",
+              "unitIndex":-5,
+              "defaultUnit":"R",
+              "nameTemplate":"R_{value}_{tolerance}_{power}_{package}",
+              "footprintLib":"SFUSat-res",
+              "footprintTemplate":"R_{package}",
+              "similarFields":[("Resistance","="),("Package / Case","="),("Power (Watts)",">="),("Tolerance","<=")],
+              "reference":"R",
+              "attrConfig":resAttrConfig,
+              "symbolShape":resSymbolShape},
+             {"name":"other",
+              "match":"", #everything else
+              "library":"other",
+              "nameTemplate":"{Manufacturer Part Number 1}",
+              "footprintLib":"SFUSat",
+              "footprintTemplate":"{Manufacturer Part Number 1}",
+              "reference":[("FET|BJT","Q"),
+                           ("Diodes","D"),
+                           ("Crystals","X"),
+                           ("","U")],
+              "attrConfig":otherAttrConfig,
+              "symbolShape":otherSymbolShape,
+              "pinTables":True, #drawn from the part's pin table instead if it has one (see drawFromPinTable)
+              "keepDrawing":True}] #these are drawn by hand, so regenerating keeps their name, DEF line, F0 to F3 and drawing
 ###############################################################################
 ### HELPER FUNCTIONS ###
 ###############################################################################
 #Open the part's webpage
 def openUrl(partNum):
-    dkUrl = "http://search.digikey.com/scripts/DkSearch/dksus.dll?Detail&name={0}".format(partNum) 
-    webpage = urlopen(dkUrl).read().decode("utf-8")
-    soup = bs4.BeautifulSoup(webpage,"html5lib")
+    return(parsePage(fetchPage(partNum)))
+
+#Get the part's webpage from the page cache, downloading it if needed
+def fetchPage(partNum):
+    return(pageCache.getOrFetch(partNum,downloadPage))
+
+#Download the part's webpage over a pooled connection, retrying timeouts and server errors (see kicadLibPopFetch)
+def downloadPage(partNum):
+    with runStats.stage("fetch",partNum):
+        return(fetchUrl(dkUrlTemplate.format(partNum),retryPolicy,fetchBreaker,rateLimiter,httpSession))
+
+#Parse the part's webpage
+def parsePage(webpage):
+    soup = kicadLibPopParse.parsePage(webpage,parserBackend)
 
     return(soup)
 
-#Find the SI unit associated with a value 
-def getSiUnit(searchValue):
-    for unit, value in siUnitToValDict.items():
-        if value == searchValue:
-            return(unit)
+#Attributes from the Digi-Key page for a part number (or an MPN, see kicadLibPopSupplier.DigiKeySupplier)
+def getDigiKeyAttrs(key):
+    webpage = fetchPage(key)
+
+    with runStats.stage("parse",key):
+        try:
+            return(makeProdAttrs(parsePage(webpage),{})) #Make a dictionary filled with the product attributes
+        except Exception as error: #a page laid out some other way; the part fails instead of the whole import
+            raise PageParseError("couldn't parse the page for {0} ({1}: {2})".format(key,type(error).__name__,error))
+
+#The supplier backends: the local catalogs, then Digi-Key
+def makeSuppliers():
+    backends = [LocalCatalog(path,"Digi-Key",fieldsToIgnore) for path in catalogPaths]
+    backends.append(DigiKeySupplier(getDigiKeyAttrs))
+
+    return(Suppliers(backends,supplierStrategy,fetchConcurrency))
+
+#Look a part up with the suppliers; returns (productAttrDict, the backend that answered, None), or
+#(None, None, the error that stopped it)
+def tryLookupPart(partNum):
+    try:
+        with runStats.stage("lookup",partNum):
+            backend, productAttrDict = suppliers.lookup(partNum)
+    except (FetchError, CacheMiss, PageParseError) as error:
+        return(None,None,error)
+
+    if productAttrDict is None:
+        return(None,None,LookupError("no supplier has {0}".format(partNum)))
+
+    return(productAttrDict,backend,None)
+
+#Look a manufacturer part number up with the suppliers; returns (productAttrDict, None) or (None, error)
+def tryLookupMpn(mpn):
+    try:
+        backend, productAttrDict = suppliers.lookupMpn(mpn)
+    except (FetchError, CacheMiss, PageParseError) as error:
+        return(None,error)
+
+    if (productAttrDict is None) or not ("Supplier Part Number 1" in productAttrDict):
+        return(None,LookupError("no supplier has exactly one part with the MPN {0}".format(mpn)))
+
+    return(productAttrDict,None)
+
+#Supplier part numbers for manufacturer part numbers, in order; MPNs that can't be resolved are reported and skipped
+def resolveMpns(mpns):
+    for index, mpn, (productAttrDict, error) in inOrder(fetchAll(mpns,runStats.profiled(tryLookupMpn),fetchConcurrency)):
+        if productAttrDict is None:
+            print("Couldn't resolve {0}: {1}".format(mpn,error))
+            continue
+
+        yield(productAttrDict["Supplier Part Number 1"])
+
+#Version of the parsed attributes; changes whenever the parsing code or ignored fields change
+def parserVersion():
+    parserFuncs = [makeProdAttrs,getProdDetails,getProdAttrs,removeAttrs]
+    source = "".join(inspect.getsource(func) for func in parserFuncs)+repr(fieldsToIgnore)
+    source += inspect.getsource(kicadLibPopParse)+parserBackend
+
+    return(hashlib.sha1(source.encode("utf-8")).hexdigest()[:16])
 
-    print("ERROR: Value does not have a valid SI unit")
-    return("")
+#Look up all of the parts with the suppliers concurrently (fetching and parsing pages as needed)
+#Parts already in the attribute store are yielded straight away without fetching anything; only answers parsed from
+#Digi-Key pages are stored, since local catalogs can change without parserVersion changing
+#Yields (index,partNum,productAttrDict,error) in the order the results become available; productAttrDict is None
+#and error says why if the part couldn't be found or fetched
+def parseParts(partNums):
+    partsToFetch = [] #(index,partNum) of the parts that have to be downloaded
+
+    for index, partNum in enumerate(partNums):
+        with runStats.stage("attrStore",partNum):
+            productAttrDict = attrStore.get(partNum) if attrStore else None
+
+        if productAttrDict is None:
+            partsToFetch.append((index,partNum))
+        else:
+            yield(index,partNum,productAttrDict,None)
+
+    lookupFunc = runStats.profiled(tryLookupPart)
+
+    for fetchIndex, partNum, (productAttrDict, backend, error) in fetchAll([part[1] for part in partsToFetch],lookupFunc,
+                                                                          fetchConcurrency):
+        if productAttrDict is None:
+            yield(partsToFetch[fetchIndex][0],partNum,None,error)
+            continue
+
+        if attrStore and backend.keepAttrs:
+            with runStats.stage("attrStore",partNum):
+                attrStore.put(partNum,productAttrDict)
+
+        yield(partsToFetch[fetchIndex][0],partNum,productAttrDict,None)
+
+#Find a footprint in one of the .pretty libraries; returns "library:footprint", or "" if there isn't one
+def findFootprint(libName,name,symbolName):
+    footprintName = footprintIndex.find(libName,name)
+
+    if footprintName is None:
+        runStats.count("missingFootprints")
+        suggestions = footprintIndex.fuzzy(libName,name)
+        print("No footprint '{0}:{1}' found for {2}{3}".format(libName,
+                                                              name,
+                                                              symbolName,
+                                                              " (similar: {0})".format(", ".join(suggestions)) if suggestions else ""))
+        return("")
+
+    return("{0}:{1}".format(libName,footprintName))
+
+#Compiled part templates, one per attribute config and symbol shape (see kicadLibPopLib.LibPartTemplate)
+#Configs are compiled the first time they're used, so don't change one after that
+libPartTemplates = {}
 
 #generate a part definition to be written to the library file
 def makeLibPart(productAttrDict,fixedAttrDict,attrConfig,symbolShape):
-    dataToWrite = []
-    attributeNum = 4    #F4 is the first optional attribute
-
-    dataToWrite.append("# \n# {0}\n#".format(fixedAttrDict["Value"])) #header
-    dataToWrite.append("DEF {0} {1} 0 {2} {3} {4} {5} {6} {7}".format(fixedAttrDict["Value"], #part definition
-                                                                      fixedAttrDict["Reference"],
-                                                                      attrConfig['name']['textOffset'],
-                                                                      attrConfig['name']['drawPinnumber'],
-                                                                      attrConfig['name']['drawPinname'],
-                                                                      attrConfig['name']['unitCount'],
-                                                                      attrConfig['name']['unitsLocked'],
-                                                                      attrConfig['name']['optionFlag']))
-    
-    dataToWrite.append('F0 "{0}" {1} {2} {3} {4} {5} {6} {7}'.format(fixedAttrDict["Reference"],
-                                                                     attrConfig['ref']['posx'],
-                                                                     attrConfig['ref']['posy'],
-                                                                     attrConfig['ref']['textSize'],
-                                                                     attrConfig['ref']['textOrient'],
-                                                                     attrConfig['ref']['visible'],
-                                                                     attrConfig['ref']['hTextJustify'],
-                                                                     attrConfig['ref']['vTextJustify']))
-    dataToWrite.append('F1 "{0}" {1} {2} {3} {4} {5} {6} {7}'.format(fixedAttrDict["Value"],
-                                                                     attrConfig['val']['posx'],
-                                                                     attrConfig['val']['posy'],
-                                                                     attrConfig['val']['textSize'],
-                                                                     attrConfig['val']['textOrient'],
-                                                                     attrConfig['val']['visible'],
-                                                                     attrConfig['val']['hTextJustify'],
-                                                                     attrConfig['val']['vTextJustify']))
-    dataToWrite.append('F2 "{0}" {1} {2} {3} {4} {5} {6} {7}'.format(fixedAttrDict["Footprint"],
-                                                                     attrConfig['other']['posx'],
-                                                                     attrConfig['other']['posy'],
-                                                                     attrConfig['other']['textSize'],
-                                                                     attrConfig['other']['textOrient'],
-                                                                     attrConfig['other']['visible'],
-                                                                     attrConfig['other']['hTextJustify'],
-                                                                     attrConfig['other']['vTextJustify']))
-    dataToWrite.append('F3 "{0}" {1} {2} {3} {4} {5} {6} {7}'.format(fixedAttrDict["Datasheet"],
-                                                                     attrConfig['other']['posx'],
-                                                                     attrConfig['other']['posy'],
-                                                                     attrConfig['other']['textSize'],
-                                                                     attrConfig['other']['textOrient'],
-                                                                     attrConfig['other']['visible'],
-                                                                     attrConfig['other']['hTextJustify'],
-                                                                     attrConfig['other']['vTextJustify']))
-
-    for key, value in sorted(productAttrDict.items()):       
-        #put the description into the description file instead
-        if not key == "Description":
-            dataToWrite.append('F{0} "{1}" {2} {3} {4} {5} {6} {7} {8} "{9}"'.format(attributeNum,
-                                                                                     value,
-                                                                                     attrConfig['other']['posx'],
-                                                                                     attrConfig['other']['posy'],
-                                                                                     attrConfig['other']['textSize'],
-                                                                                     attrConfig['other']['textOrient'],
-                                                                                     attrConfig['other']['visible'],
-                                                                                     attrConfig['other']['hTextJustify'],
-                                                                                     attrConfig['other']['vTextJustify'],
-                                                                                     key))
-        attributeNum += 1
-
-    dataToWrite.append(symbolShape)
-    dataToWrite.append("ENDDEF")
-    
-    return dataToWrite
+    templateKey = (id(attrConfig),symbolShape)
+
+    if not templateKey in libPartTemplates:
+        libPartTemplates[templateKey] = LibPartTemplate(attrConfig,symbolShape)
+
+    return(libPartTemplates[templateKey].render(productAttrDict,fixedAttrDict))
+
+#Draw a part from its pin table in pinTableDir, if its MPN has one (see kicadLibPopSymgen.py)
+#Returns (attribute config, symbol shape) to render the part with, or None to use its rule's
+def drawFromPinTable(productAttrDict,rule):
+    tablePath = findPinTable(pinTableDir,productAttrDict.get("Manufacturer Part Number 1",""))
+    if tablePath is None:
+        return(None)
+
+    try:
+        symbol = generateSymbol(readPinTable(tablePath),symbolUnitPins)
+    except (OSError, ValueError) as error:
+        runStats.count("pinTableErrors")
+        print("Couldn't draw {0} from its pin table: {1}".format(productAttrDict.get("Manufacturer Part Number 1"),error))
+        return(None)
+
+    runStats.count("symbolsDrawn")
+    print("Drew {0} units from {1}".format(len(symbol.units),os.path.basename(tablePath)))
+
+    return(symbolAttrConfig(rule["attrConfig"],symbol),symbol.shape)
 
 #Make the description for the description file
 def makeDesc(description,name):
@@ -345,234 +635,63 @@ def makeDesc(description,name):
     return(dataToWrite)
 
 #Make a dictionary filled with the fixed attributes
-def makeFixedAttrs(productAttrDict):
-    if "Capacitor" in productAttrDict["Categories"]:
-        
-        #Make sure the value is formatted properly
-        unit = productAttrDict["Capacitance"][-2]
-        
-        if unit.isdigit() or unit == " ":
-            unit = ""
-        
-        if unit == "µ": unit = "u"
-        
-        value = float(re.sub(nonNumericChars, "", productAttrDict["Capacitance"]))
-        
-        #want to fix any value that can be expressed with a different unit (usually nano)
-        if value < 1.0: 
-            value *= 1000 #avoid values with decimals; move them to the previous unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e-3) #the new unit
-        elif value >= 1000.0:
-            value /= 1000 #avoid values larger than 1000; move them to the next unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e3) #the new unit            
-        
-    
-        valueStr = str(value).replace(".",unit)
-    
-        tolerance = productAttrDict["Tolerance"].replace("±","")
-        
-        if productAttrDict["Package / Case"] == "Nonstandard":
-            package = productAttrDict["Supplier Device Package"]
-        else:
-            package = productAttrDict["Package / Case"].split(" ")[0]
-        
-        if not "Temperature Coefficient" in productAttrDict:
-            if "Tantalum" in productAttrDict["Categories"]:
-                lastParam = "TANT"
-            else:
-                lastParam = "[FIX_THIS]"
-        elif productAttrDict["Temperature Coefficient"] == "C0G, NP0":
-            lastParam = "NP0"
-        else:
-            lastParam = productAttrDict["Temperature Coefficient"]
-    
-        symbolName = "C_{0}_{1}_{2}_{3}_{4}".format(valueStr,
-                                                    tolerance,
-                                                    productAttrDict["Voltage - Rated"],
-                                                    lastParam,
-                                                    package)
-        
-        footprint = "SFUSat-cap:C_{0}".format(package)
+def makeFixedAttrs(productAttrDict,rule=None):
+    fixedAttrDict = {}
 
-        if not any(footprint.split(":")[1] in file for file in os.listdir(path="SFUSat-cap.pretty")):
-            print("No footprint '{0}' found for {1}".format(footprint,symbolName))
-            footprint = ""
-        
-        fixedAttrDict["Reference"] = "C"
+    if rule is None:
+        rule = partRuleSet.classify(productAttrDict["Categories"])
 
-    elif "Inductor" in productAttrDict["Categories"]:
-        
-        #Make sure the value is formatted properly
-        unit = productAttrDict["Inductance"][-2]
-        
-        if unit.isdigit() or unit == " ":
-            unit = ""
-        
-        if unit == "µ": unit = "u"
-        
-        value = float(re.sub(nonNumericChars, "", productAttrDict["Inductance"]))
-        
-        #want to fix any value that can be expressed with a different unit (usually nano)
-        if value < 1.0: 
-            value *= 1000 #avoid values with decimals; move them to the previous unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e-3) #the new unit
-        elif value >= 1000.0:
-            value /= 1000 #avoid values larger than 1000; move them to the next unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e3) #the new unit            
-         
-        valueStr = str(value).replace(".",unit)
-    
-        tolerance = productAttrDict["Tolerance"].replace("±","")
+    symbolName = partRuleSet.render(rule,"nameTemplate",productAttrDict)
+    footprintName = partRuleSet.render(rule,"footprintTemplate",productAttrDict)
 
-        if productAttrDict["Package / Case"] == "Nonstandard":
-            package = productAttrDict["Supplier Device Package"]
-        else:
-            package = productAttrDict["Package / Case"].split(" ")[0]
+    fixedAttrDict["Reference"] = partRuleSet.reference(rule,productAttrDict["Categories"])
+    fixedAttrDict["Value"] = symbolName
+    fixedAttrDict["Footprint"] = findFootprint(rule["footprintLib"],footprintName,symbolName)
+    fixedAttrDict["Datasheet"] = ""
     
-        symbolName = "L_{0}_{1}_{2}_{3}".format(valueStr,
-                                                    tolerance,
-                                                    productAttrDict["Current Rating"],
-                                                    package)
-        
-        footprint = "SFUSat-ind:L_{0}".format(package)
-        
-        if not any(footprint.split(":")[1] in file for file in os.listdir(path="SFUSat-ind.pretty")):
-            print("No footprint '{0}' found for {1}".format(footprint,symbolName))
-            footprint = ""
-        
-        fixedAttrDict["Reference"] = "L"
+    return(fixedAttrDict)
 
-    elif "Ferrite" in productAttrDict["Categories"]:
-        
-        #Make sure the value is formatted properly
-        unit = productAttrDict["Impedance @ Frequency"][-14]
-        
-        if unit.isdigit() or unit == " ":
-            unit = "R"
-        
-        if unit == "µ": unit = "u"
-        
-        print("unit: {0}".format(unit))
-        
-        value = float(re.sub(nonNumericChars, "", productAttrDict["Impedance @ Frequency"][0:-14]))
-        
-        print("value: {0}".format(value))
-        
-        #want to fix any value that can be expressed with a different unit (usually nano)
-        if value < 1.0: 
-            value *= 1000 #avoid values with decimals; move them to the previous unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e-3) #the new unit
-        elif value >= 1000.0:
-            value /= 1000 #avoid values larger than 1000; move them to the next unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e3) #the new unit            
-
-        print("unit: {0}".format(unit))
-        
-        valueStr = str(value).replace(".",unit)
+#Value of the rule's value field in symbol name form (e.g. "4u7")
+def getRuleValue(productAttrDict,rule):
+    valueText = productAttrDict[rule["valueField"]]
+    unit = parseUnit(valueText[rule["unitIndex"]],rule["defaultUnit"])
 
-        print("valueStr: {0}".format(valueStr))
+    if rule.get("valueEnd"):
+        valueText = valueText[0:rule["valueEnd"]]
 
-        if productAttrDict["Package / Case"] == "Nonstandard":
-            package = productAttrDict["Supplier Device Package"]
-        else:
-            package = productAttrDict["Package / Case"].split(" ")[0]
-    
-        currentRating = productAttrDict["Current Rating (Max)"]
-    
-        symbolName = "FB_{0}_{1}_{2}".format(valueStr,
-                                             currentRating,
-                                             package)
-        
-        footprint = "SFUSat-ind:L_{0}".format(package)
+    return(makeValueStr(re.sub(nonNumericChars, "", valueText),unit))
 
-        if not any(footprint.split(":")[1] in file for file in os.listdir(path="SFUSat-ind.pretty")):
-            print("No footprint '{0}' found for {1}".format(footprint,symbolName))
-            footprint = ""
-        
-        fixedAttrDict["Reference"] = "L"
+def getPackage(productAttrDict,rule):
+    if productAttrDict["Package / Case"] == "Nonstandard":
+        return(productAttrDict["Supplier Device Package"])
 
-    elif ("Resistor" in productAttrDict["Categories"]) and not ("Potentiometers" in productAttrDict["Categories"]):
-        
-        #Make sure the value is formatted properly
-        unit = productAttrDict["Resistance"][-5]
-        
-        if unit.isdigit() or unit == " ":
-            unit = "R"
-        
-        if unit == "µ": unit = "u"
-        
-        value = float(re.sub(nonNumericChars, "", productAttrDict["Resistance"]))
-        
-        #want to fix any value that can be expressed with a different unit (usually nano)
-        if value < 1.0: 
-            value *= 1000 #avoid values with decimals; move them to the previous unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e-3) #the new unit
-        elif value >= 1000.0:
-            value /= 1000 #avoid values larger than 1000; move them to the next unit
-            unitValue = siUnitToValDict[unit] #get the value associated with the unit
-            unit = getSiUnit(unitValue*1e3) #the new unit            
-        
-        valueStr = str(value).replace(".",unit)
-    
-        if productAttrDict["Tolerance"] == "Jumper":
-            tolerance = "0%"
-        else:
-            tolerance = productAttrDict["Tolerance"].replace("±","")
-        power = productAttrDict["Power (Watts)"].split(",")[0]
+    return(productAttrDict["Package / Case"].split(" ")[0])
 
-        if productAttrDict["Package / Case"] == "Nonstandard":
-            package = productAttrDict["Supplier Device Package"]
-        else:
-            package = productAttrDict["Package / Case"].split(" ")[0]
-    
-        symbolName = "R_{0}_{1}_{2}_{3}".format(valueStr,
-                                                tolerance,
-                                                power,
-                                                package)
-        
-        footprint = "SFUSat-res:R_{0}".format(package)
-        
-        
-        
-        if not any(footprint.split(":")[1] in file for file in os.listdir(path="SFUSat-res.pretty")):
-            print("No footprint '{0}' found for {1}".format(footprint,symbolName))
-            footprint = ""
-        
-        fixedAttrDict["Reference"] = "R"
+def getTolerance(productAttrDict,rule):
+    if productAttrDict["Tolerance"] == "Jumper":
+        return("0%")
 
-    else:
-#        print("Sorry, there's only functionality for chip capacitors, resistors, and inductors at this time")
-#        sys.exit()
-    
-        symbolName = productAttrDict["Manufacturer Part Number 1"]
-        
-        footprint = "SFUSat:{0}".format(symbolName)
+    return(productAttrDict["Tolerance"].replace("±",""))
 
-        if not any(footprint in file for file in os.listdir(path="SFUSat.pretty")):
-            print("No footprint '{0}' found for {1}".format(footprint,symbolName))
-            footprint = ""
-        
-        if ("FET" in productAttrDict["Categories"]) or ("BJT" in productAttrDict["Categories"]):
-            fixedAttrDict["Reference"] = "Q"
-        elif "Diodes" in productAttrDict["Categories"]:
-            fixedAttrDict["Reference"] = "D"
-        elif "Crystals" in productAttrDict["Categories"]:
-            fixedAttrDict["Reference"] = "X"
-        else:
-            fixedAttrDict["Reference"] = "U"
-        
-    fixedAttrDict["Value"] = symbolName
-    fixedAttrDict["Footprint"] = footprint
-    fixedAttrDict["Datasheet"] = ""
-    
-    return(fixedAttrDict)
+def getTempCoefficient(productAttrDict,rule):
+    if not "Temperature Coefficient" in productAttrDict:
+        if "Tantalum" in productAttrDict["Categories"]:
+            return("TANT")
+        return("[FIX_THIS]")
+
+    if productAttrDict["Temperature Coefficient"] == "C0G, NP0":
+        return("NP0")
+
+    return(productAttrDict["Temperature Coefficient"])
+
+def getPower(productAttrDict,rule):
+    return(productAttrDict["Power (Watts)"].split(",")[0])
+
+partRuleParams = {"value":getRuleValue,
+                  "package":getPackage,
+                  "tolerance":getTolerance,
+                  "tempCoefficient":getTempCoefficient,
+                  "power":getPower}
 
 #Create the product attribute dictionary
 def makeProdAttrs(soup,productAttrDict):
@@ -585,11 +704,11 @@ def makeProdAttrs(soup,productAttrDict):
     
 #Grab product details from the component webpage
 def getProdDetails(soup,productAttrDict):
-    productDetailsTable = soup.find("table", {"id": "product-details"}).find("tbody").find_all("tr")
+    productDetailsTable = getTableRows(soup,"product-details")
 
-    for row in productDetailsTable:
-        field = row.find_all("th")[0].get_text().rstrip(" \r\n ").lstrip(" \r\n ")
-        value = row.find_all("td")[0].get_text().rstrip(" \r\n ").lstrip(" \r\n ")
+    for rowAttrs, headers, cells in productDetailsTable:
+        field = headers[0].rstrip(" \r\n ").lstrip(" \r\n ")
+        value = cells[0].rstrip(" \r\n ").lstrip(" \r\n ")
         
         if field == "Digi-Key Part Number": field = "Supplier Part Number 1"
         if "Manufacturer" in field: field += " 1"
@@ -603,19 +722,19 @@ def getProdDetails(soup,productAttrDict):
 #Grab product attributes from the component webpage
 def getProdAttrs(soup,productAttrDict):
     appendLastField = False #Used when the "Categories" field spans multiple rows
-    productAttrTable = soup.find("table", {"id": "prod-att-table"}).find("tbody").find_all("tr")
+    productAttrTable = getTableRows(soup,"prod-att-table")
 
-    for row in productAttrTable:
-        if ("id" in row.attrs):
-            if (row.attrs["id"] == "prod-att-title-row"):
+    for rowAttrs, headers, cells in productAttrTable:
+        if ("id" in rowAttrs):
+            if (rowAttrs["id"] == "prod-att-title-row"):
                 continue
         
-        try: field = row.find_all("th")[0].get_text().rstrip(" \r\n ").lstrip(" \r\n ")
-        except: appendLastField = True
+        try: field = headers[0].rstrip(" \r\n ").lstrip(" \r\n ")
+        except IndexError: appendLastField = True
         
         if field == "Manufacturer": continue #Already populate the manufacturer from the details table
         
-        value = row.find_all("td")[0].get_text().rstrip(" \r\n ").lstrip(" \r\n ")
+        value = cells[0].rstrip(" \r\n ").lstrip(" \r\n ")
 
         #Need to add an escape character to fields with quotation marks (like dimensions)
         if '"' in value:
@@ -638,6 +757,62 @@ def removeAttrs(productAttrDict):
             
     return(productAttrDict)
 
+#Check whether a part, or a part with the same name, is already in a library
+def isDuplicate(library,partNum,productAttrDict,fixedAttrDict,libName):
+    if library.hasSupplierPartNum(partNum) or library.hasMfrPartNum(productAttrDict.get("Manufacturer Part Number 1")):
+        runStats.count("duplicatePartNums")
+        print("Part number ({0}) already exists in {1}, checking next part...".format(partNum,libName))
+        return(True)
+
+    if library.hasName(fixedAttrDict["Value"]):
+        runStats.count("duplicateNames")
+        print("Similar part to {0} ({1}) already exists in {2}, checking next part...".format(partNum,
+                                                                                               fixedAttrDict["Value"],
+                                                                                               libName))
+        return(True)
+
+    return(False)
+
+#Add a new part to the library index so later parts in the same run are checked against it too
+def addToLibrary(library,libPart,description,libKey=None):
+    for symbol in parseLib("\n".join(libPart)):
+        library.add(symbol,description)
+
+        if (searchIndex is not None) and (libKey is not None):
+            searchIndex.add(libKey,symbol.name,symbolFields(symbol))
+
+#The part store's record of a part going into a rule's library (see kicadLibPopStore.py)
+#drawing is the (attribute config, symbol shape) it was drawn with if it didn't use its rule's
+def makeStoredPart(partNum,rule,productAttrDict,fixedAttrDict,drawing=None):
+    return(StoredPart(partNum,productAttrDict.get("Manufacturer Part Number 1"),rule["library"],rule["name"],
+                      fixedAttrDict["Value"],fixedAttrDict["Reference"],fixedAttrDict["Footprint"],fixedAttrDict["Datasheet"],
+                      productAttrDict,drawing,False,None,None,None,None))
+
+#The parametric search index of the part libraries, built (or read from its cache) the first time it's needed
+def getSearchIndex():
+    global searchIndex
+
+    if searchIndex is None:
+        searchIndex = SearchIndex(searchIndexPath).load({libKey:libPath for libKey, (libPath, descPath, libName) in libraryFiles.items()})
+
+    return(searchIndex)
+
+#Find parts in the libraries matching conditions like "capacitance>=10u" or ("Voltage - Rated", ">=", "16V")
+#Returns [(library key, symbol name, fields)]
+def searchParts(conditions,libKeys=None):
+    return(getSearchIndex().search(conditions,libKeys))
+
+#Names of the parts already in a rule's library that meet its similarFields for a new part
+def findSimilarParts(rule,productAttrDict):
+    conditions = [(field,op,productAttrDict[field]) for field, op in rule.get("similarFields",[]) if field in productAttrDict]
+    if not conditions:
+        return([])
+
+    try:
+        return([name for libKey, name, fields in searchParts(conditions,[rule["library"]])])
+    except ValueError: #a field no part in the libraries has yet
+        return([])
+
 #Read data from the library file
 def readFile(filepath):
     libfile = open(filepath, "r", encoding="utf-8", errors="replace")
@@ -648,133 +823,1314 @@ def readFile(filepath):
 
 #Write data to the library file
 def writeFile(filepath,dataToWrite):
-    libfile = open(filepath, "wb")
+    data = "".join("{0}\n".format(item) for part in dataToWrite for item in part)
 
-    for part in dataToWrite:
-        for item in part:
-            libfile.write("{0}\n".format(item).encode("utf-8"))
-        
-    libfile.close()
+    with open(filepath,"wb") as libfile:
+        libfile.write(data.encode("utf-8"))
 
 #Write data to the second last lines of the library file before the "End Library statement"
-def writeToLibFile(filepath,libContents,dataToWrite):    
-    dataToWrite = [[libContents.rstrip("#\n#End Library")]]+dataToWrite
-    dataToWrite.append(["#\n#End Library"])
-                        
-    writeFile(filepath,dataToWrite)
+#Only the end of the file is rewritten, so this takes as long as the parts being added, not the whole library
+def writeToLibFile(filepath,dataToWrite):
+    appendBlocks(filepath,dataToWrite,libTrailer)
     
     return(dataToWrite)
 
-def writeToDescFile(filepath,descContents,dataToWrite):
-    dataToWrite = [[descContents.rstrip("#\n#End Doc Library")]]+dataToWrite
-    dataToWrite.append(["#\n#End Doc Library"])
-                        
-    writeFile(filepath,dataToWrite)
+def writeToDescFile(filepath,dataToWrite):
+    appendBlocks(filepath,dataToWrite,descTrailer)
     
     return(dataToWrite)    
 
+partRuleSet = RuleSet(partRules,partRuleParams)
+
 ###############################################################################
 ### MAIN SCRIPT ###
 ###############################################################################
-for partNum in partNums:    
-    soup = openUrl(partNum)
-    
-    productAttrDict = {}
-    fixedAttrDict = {}
-    
-    productAttrDict = makeProdAttrs(soup,productAttrDict) #Make a dictionary filled with the product attributes
-    fixedAttrDict = makeFixedAttrs(productAttrDict) #Make a dictionary filled with the KiCAD fixed attributes
+#Read part numbers from a text, CSV or TSV file ("-" for stdin) one line at a time
+#CSV/TSV files use the first column named in partNumColumns, or the first column if there isn't a header
+def readPartNums(filepath):
+    partFile = sys.stdin if filepath == "-" else open(filepath,"r",encoding="utf-8-sig",newline="")
+
+    try:
+        firstLine = partFile.readline()
+        if not firstLine:
+            return
+
+        lines = itertools.chain([firstLine],partFile)
+
+        if ("\t" in firstLine) or ("," in firstLine):
+            delimiter = "\t" if "\t" in firstLine else ","
+            rows = csv.reader(lines,delimiter=delimiter,skipinitialspace=True)
+            header = [column.strip() for column in next(rows)]
+            column = next((header.index(name) for name in partNumColumns if name in header),None)
+
+            if column is None:
+                if "Reference" in header:
+                    print("No part number column in {0}, skipping it".format(filepath))
+                    return
+                column = 0
+                rows = itertools.chain([header],rows) #no header; the first row is a part
+
+            for row in rows:
+                if len(row) > column:
+                    yield(row[column])
+        else:
+            for line in lines:
+                yield(line)
+    finally:
+        if not partFile is sys.stdin:
+            partFile.close()
+
+#Clean up and deduplicate part numbers as they're read
+def uniquePartNums(partNums):
+    seen = set()
 
-    if "Capacitor" in productAttrDict["Categories"]:
-        if capLibContents == None:
-            capLibContents = readFile(capLibFilePath) #read the library file so we can see whether or not the part number/name already exists
-            capDescContents = readFile(capDescFilePath) #read the description file to populate it later
+    for partNum in partNums:
+        partNum = partNum.strip() #Removes beginning and trailing whitespace
 
-        if partNum in capLibContents:
-            print("Part number ({0}) already exists in capacitor library, checking next part...".format(partNum))
+        if (not partNum) or partNum.startswith("#") or (partNum in seen):
             continue
-        
-        elif fixedAttrDict["Value"] in capLibContents:
-            print("Similar part to {0} ({1}) already exists in library, checking next part...".format(partNum,
-                                                                                                      fixedAttrDict["Value"]))
+
+        seen.add(partNum)
+        yield(partNum)
+
+#Key of an import for its checkpoint; changes if a file is edited. None for stdin, which can't be read again.
+def importKey(filepaths,extraPartNums):
+    if "-" in filepaths:
+        return(None)
+
+    inputs = [[os.path.abspath(filepath),os.path.getsize(filepath),os.stat(filepath).st_mtime_ns] for filepath in filepaths]
+
+    return(hashlib.sha1(json.dumps([inputs,list(extraPartNums)]).encode("utf-8")).hexdigest()[:16])
+
+#Split an iterable into lists of at most "size" items
+def chunked(iterable,size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(itertools.islice(iterator,size))
+        if not chunk:
+            return
+        yield(chunk)
+
+#Add a group of parts to the libraries
+#Returns (number of parts added, [(partNum,error)] for the parts that couldn't be fetched)
+def importParts(partNums):
+    newParts = {} #library key -> (parts for the library file, descriptions for the description file)
+    storedParts = [] #StoredPart of every part added
+    failed = []
+
+    #Parts are built in the same order as partNums no matter which page arrives first
+    for index, partNum, productAttrDict, error in inOrder(parseParts(partNums)):
+        if productAttrDict is None:
+            print("Couldn't get {0}: {1}".format(partNum,error))
+            failed.append((partNum,error))
+            runStats.part(partNum,"failed",error=str(error))
             continue
 
-        else:
-            print("Adding {0} to capacitor library...".format(partNum))
-            
-        capParts.append(makeLibPart(productAttrDict,fixedAttrDict,capAttrConfig,capSymbolShape))
-        capDesc.append(makeDesc(productAttrDict["Description"],fixedAttrDict["Value"]))
+        with runStats.stage("classify",partNum):
+            rule = partRuleSet.classify(productAttrDict["Categories"])
+        with runStats.stage("fixedAttrs",partNum):
+            fixedAttrDict = makeFixedAttrs(productAttrDict,rule) #Make a dictionary filled with the KiCAD fixed attributes
 
-    elif ("Inductor" in productAttrDict["Categories"]) or ("Ferrite" in productAttrDict["Categories"]):
-        if indLibContents == None:
-            indLibContents = readFile(indLibFilePath) #read the library file so we can see whether or not the part number/name already exists
-            indDescContents = readFile(indDescFilePath) #read the description file to populate it later
+        libPath, descPath, libName = libraryFiles[rule["library"]]
+        with runStats.stage("loadLibrary"):
+            library = getLibrary(libPath,descPath) #indexed library to see whether or not the part number/name already exists
 
-        if partNum in indLibContents:
-            print("Part number ({0}) already exists in inductor library, checking next part...".format(partNum))
+        with runStats.stage("duplicates",partNum):
+            duplicate = isDuplicate(library,partNum,productAttrDict,fixedAttrDict,libName)
+        if duplicate:
+            runStats.part(partNum,"duplicate",library=rule["library"],name=fixedAttrDict["Value"])
             continue
-        
-        elif fixedAttrDict["Value"] in indLibContents:
-            print("Similar part to {0} ({1}) already exists in library, checking next part...".format(partNum,
-                                                                                                      fixedAttrDict["Value"]))
+
+        with runStats.stage("similar",partNum):
+            similarParts = findSimilarParts(rule,productAttrDict)
+        if similarParts:
+            runStats.count("similarReported")
+            print("Similar parts to {0} already in {1}: {2}".format(partNum,libName,", ".join(similarParts)))
+
+        print("Adding {0} to {1}...".format(partNum,libName))
+
+        drawing = None
+        if rule.get("pinTables"):
+            with runStats.stage("symgen",partNum):
+                drawing = drawFromPinTable(productAttrDict,rule)
+
+        libParts, libDesc = newParts.setdefault(rule["library"],([],[]))
+        with runStats.stage("render",partNum):
+            if drawing is None:
+                libParts.append(makeLibPart(productAttrDict,fixedAttrDict,rule["attrConfig"],rule["symbolShape"]))
+            else:
+                libParts.append(LibPartTemplate(*drawing).render(productAttrDict,fixedAttrDict)) #made for this part only
+            libDesc.append(makeDesc(productAttrDict["Description"],fixedAttrDict["Value"]))
+        with runStats.stage("index",partNum):
+            addToLibrary(library,libParts[-1],productAttrDict["Description"],rule["library"])
+        storedParts.append(makeStoredPart(partNum,rule,productAttrDict,fixedAttrDict,drawing))
+
+        runStats.part(partNum,"added",library=rule["library"],name=fixedAttrDict["Value"])
+
+    for libKey, (libParts, libDesc) in newParts.items():
+        libPath, descPath, libName = libraryFiles[libKey]
+        with runStats.stage("write"):
+            writeToLibFile(libPath,libParts)
+            writeToDescFile(descPath,libDesc)
+
+    if partStore is not None:
+        with runStats.stage("partStore"):
+            partStore.put(storedParts,synced=True) #one transaction for the chunk
+            for libKey in newParts:
+                libPath, descPath, libName = libraryFiles[libKey]
+                state = partStore.libraryState(libKey)
+                partStore.setLibraryState(libKey,state.revision if state else 0,(libPath,descPath),
+                                          getLibrary(libPath,descPath).symbols)
+
+    return(sum(len(libParts) for libParts, libDesc in newParts.values()),failed)
+
+#Add every part number in the files to the libraries, chunkSize parts at a time
+#Each chunk is written before the next is read, so the part list never has to fit in memory
+#Progress is checkpointed after each chunk; unless resume is False, running the same import again skips the parts
+#that were done and retries the ones that couldn't be fetched
+#MPNs are resolved to supplier part numbers first (see resolveMpns)
+#A run report is written to reportPath at the end (see kicadLibPopStats.py)
+#Returns (number of parts added, whether every part was dealt with)
+def importFiles(filepaths,extraPartNums=[],resume=True,mpns=[]):
+    global attrStore, partStore, suppliers, runStats
+
+    runStats = RunStats(profileImports,traceImportMemory).start()
+
+    if useAttrStore and not (pageCacheMode == "refresh"):
+        attrStore = AttrStore(attrStorePath,parserVersion())
+    if usePartStore:
+        partStore = PartStore(partStorePath)
+    suppliers = makeSuppliers()
+
+    checkpoint = Checkpoint(checkpointPath,importKey(filepaths,list(extraPartNums)+["MPN "+mpn for mpn in mpns]))
+    if resume and (checkpoint.key is not None):
+        checkpoint.load()
+        if checkpoint:
+            print("Resuming the last import: skipping {0} parts, retrying {1} that failed.".format(len(checkpoint.done),
+                                                                                                  len(checkpoint.failed)))
+
+    partNums = itertools.chain(extraPartNums,resolveMpns(mpns),*(readPartNums(filepath) for filepath in filepaths))
+    partNums = (partNum for partNum in uniquePartNums(partNums) if not partNum in checkpoint.done)
+    retries = checkpoint.failed #failed last time (and already in checkpoint.done); tried first
+    chunks = itertools.chain(((chunk,False) for chunk in chunked(retries,chunkSize)),
+                             ((chunk,True) for chunk in chunked(partNums,chunkSize)))
+
+    added = 0
+    retried = 0
+    failed = [] #(partNum,error)
+    stopped = False
+
+    attrStoreStats = None
+
+    try:
+        for chunk, fromInput in chunks:
+            chunkAdded, chunkFailed = importParts(chunk)
+            added += chunkAdded
+            failed.extend(chunkFailed)
+
+            if fromInput:
+                checkpoint.done.update(chunk)
+            else:
+                retried += len(chunk)
+
+            if checkpoint.key is not None:
+                checkpoint.failed = [partNum for partNum, error in failed]+retries[retried:]
+                checkpoint.save()
+
+            if fetchBreaker.isOpen:
+                stopped = True
+                break
+    finally:
+        httpSession.close()
+        suppliers.close()
+
+        if attrStore:
+            attrStoreStats = attrStore.stats()
+            attrStore.close()
+            attrStore = None
+        if partStore:
+            partStore.close()
+            partStore = None
+
+    if stopped:
+        print("Stopped after {0} failed requests in a row; the supplier may be down.".format(fetchBreaker.failures))
+    if failed:
+        print("{0} parts couldn't be fetched: {1}".format(len(failed),", ".join(partNum for partNum, error in failed)))
+    if (stopped or failed) and (checkpoint.key is not None):
+        print("Run the same command again to carry on from here.")
+    elif not (stopped or failed):
+        checkpoint.clear()
+
+    runStats.count("added",added)
+    runStats.count("failed",len(failed))
+    runStats.count("fetchRetries",retryPolicy.retried)
+    runStats.count("breakerTrips",fetchBreaker.trips)
+    runStats.stop()
+
+    print("Library updating {0} ({1} parts added).".format("stopped" if stopped else "complete",added))
+    print("Page cache: {hits} hits, {misses} misses, {evictions} evictions".format(**pageCache.stats()))
+    if len(suppliers.backends) > 1:
+        print("Suppliers: {0}".format(", ".join("{0} {1}".format(name,count) for name, count in suppliers.answers.items())))
+    httpStats = httpSession.stats()
+    if httpStats["requests"]:
+        print("HTTP: {requests} requests over {connections} connections, {redirects} redirects; mean ms per request: "
+              "DNS {dns:.1f}, connect {connect:.1f}, TLS {tls:.1f}, first byte {ttfb:.1f}, transfer {transfer:.1f}".format(**httpStats))
+    if attrStoreStats is not None:
+        print("Attribute store: {hits} hits, {misses} misses".format(**attrStoreStats))
+
+    runStats.save(reportPath,{"command":"import",
+                              "inputs":{"files":filepaths,"parts":extraPartNums,"mpns":mpns},
+                              "complete":not (stopped or failed),
+                              "settings":{"chunkSize":chunkSize,
+                                          "fetchConcurrency":fetchConcurrency,
+                                          "parserBackend":parserBackend,
+                                          "pageCacheMode":pageCacheMode,
+                                          "useAttrStore":useAttrStore,
+                                          "catalogs":catalogPaths,
+                                          "supplierStrategy":supplierStrategy,
+                                          "pinTables":pinTableDir,
+                                          "partStore":partStorePath if usePartStore else None},
+                              "pageCache":pageCache.stats(),
+                              "attrStore":attrStoreStats,
+                              "http":httpStats,
+                              "rateLimitWaitSeconds":rateLimiter.waited,
+                              "suppliers":suppliers.answers})
+    print("Time {0:.2f} s: {1} (report: {2})".format(runStats.wallSeconds,runStats.summary(),reportPath))
+
+    return(added,not (stopped or failed))
+
+#Libraries (library path, description path) kicadLibPop writes to
+def partLibraries():
+    return([(libPath,descPath) for libPath, descPath, libName in libraryFiles.values()])
+
+#Re-canonicalize the value in every symbol name (e.g. C_0n1_... -> C_100p0_...)
+#Names are only reported unless write is True
+def canonicalizeLibraries(write=False):
+    libraries = [(libPath,descPath,getLibrary(libPath,descPath)) for libPath, descPath in partLibraries()]
+    renames = canonicalizeNames([name for libPath, descPath, library in libraries for name in library.symbols])
+
+    for libPath, descPath, library in libraries:
+        libRenames = {name:renames[name] for name in library.symbols if name in renames}
+
+        for name, newName in list(libRenames.items()):
+            if newName in library.symbols:
+                print("{0} -> {1} (already exists in {2}, not renamed)".format(name,newName,os.path.basename(libPath)))
+                del(libRenames[name])
+            else:
+                print("{0} -> {1}".format(name,newName))
+
+        if write and libRenames:
+            renameSymbols(libPath,descPath,libRenames)
+
+    print("{0} symbol names {1}.".format(len(renames),"renamed" if write else "to rename"))
+    return(renames)
+
+#Product attributes of a library symbol: the attribute store's if it has the part, otherwise the symbol's
+#own named fields plus its description from the description file
+def symbolAttrs(symbol,desc):
+    productAttrDict = attrStore.get(symbol.supplierPartNum) if attrStore else None
+
+    if productAttrDict is None:
+        productAttrDict = symbol.namedFields()
+        productAttrDict["Description"] = desc.get("D","")
+
+    return(productAttrDict)
+
+#Sort the symbols of every part library into regeneration jobs, one per library
+#Symbols with a supplier part number are re-rendered in the library their rule picks; everything else is kept as is
+def makeRegenJobs(keepNames=False):
+    jobs = {}
+
+    for libKey, (libPath, descPath, libName) in libraryFiles.items():
+        jobs[libKey] = {"libKey":libKey,
+                        "keepNames":keepNames,
+                        "lib":splitLib(readText(libPath)),
+                        "desc":splitDcm(readText(descPath)),
+                        "parts":{}, #symbol name -> (rule name, productAttrDict) of the parts that stay in this library
+                        "movedOut":set(),
+                        "movedIn":[]} #(symbol name, lib lines, dcm lines, rule name, productAttrDict)
+
+    for libKey, (libPath, descPath, libName) in libraryFiles.items():
+        library = getLibrary(libPath,descPath)
+        descBlocks = dict(jobs[libKey]["desc"][1])
+
+        for name, lines in jobs[libKey]["lib"][1]:
+            symbol = library.symbols.get(name)
+            if (symbol is None) or (not symbol.supplierPartNum):
+                continue
+
+            productAttrDict = symbolAttrs(symbol,library.descs.get(descName(name),{}))
+            if not "Categories" in productAttrDict:
+                continue
+
+            rule = partRuleSet.classify(productAttrDict["Categories"])
+
+            if rule["library"] == libKey:
+                jobs[libKey]["parts"][name] = (rule["name"],productAttrDict)
+            else:
+                jobs[libKey]["movedOut"].add(name)
+                jobs[rule["library"]]["movedIn"].append((name,lines,descBlocks.get(descName(name)),rule["name"],productAttrDict))
+
+    return([jobs[libKey] for libKey in libraryFiles])
+
+#Whether a symbol called name keeps its name instead of the one the rule gives (newName): its rule's parts are drawn and
+#named by hand, the name was edited after the rule gave it, or the new name still needs fixing
+def keepSymbolName(rule,name,newName):
+    return(rule.get("keepDrawing") or (not partRuleSet.isTemplateName(rule,name)) or ("[FIX_THIS]" in newName))
+
+#Re-render one symbol block (and its description block, if it has one) with the current rules
+#Returns (new name, lib lines, dcm lines), or None if the symbol's attributes can't be turned into a part
+def regenerateSymbol(name,lines,descLines,rule,productAttrDict,keepName=False):
+    try:
+        fixedAttrDict = makeFixedAttrs(productAttrDict,rule)
+    except (KeyError,IndexError,ValueError,ArithmeticError):
+        return(None)
+
+    #symbols drawn by hand are named by hand too, so are symbols whose name the rules couldn't have given (a qualifier
+    #like HIQ added by hand), and a name that needs fixing shouldn't replace one that was fixed
+    if keepName or keepSymbolName(rule,name,fixedAttrDict["Value"]):
+        fixedAttrDict["Value"] = name
+
+    newName = fixedAttrDict["Value"]
+    if "\ufffd" in newName: #the attributes were mangled before they were written
+        return(None)
+
+    return((newName,)+renderOverBlock(name,lines,descLines,rule,productAttrDict,fixedAttrDict))
+
+#Render a part over its old symbol block (comment lines, then DEF to ENDDEF) and description block (or None) as
+#fixedAttrDict["Value"]: the comment lines and the description's keywords and datasheet are kept, and so are the
+#footprint if fixedAttrDict has none and, for rules that keep their drawing, the drawing, DEF line and F0 to F3
+#Returns (lib lines, dcm lines or None)
+def renderOverBlock(name,lines,descLines,rule,productAttrDict,fixedAttrDict):
+    newName = fixedAttrDict["Value"]
+    defIndex = next(index for index, line in enumerate(lines) if line.startswith("DEF "))
+    symbol = LibSymbol(name,"",lines[defIndex:])
+    renames = {name:newName}
+
+    if not fixedAttrDict["Footprint"]:
+        fixedAttrDict["Footprint"] = symbol.footprint #keep a footprint that was picked by hand
+
+    symbolShape = rule["symbolShape"]
+    if rule.get("keepDrawing"):
+        lastField = max(index for index, line in enumerate(symbol.lines) if re.match(r"F\d+ ",line))
+        symbolShape = "\n".join(symbol.lines[lastField+1:-1])
+
+    #without the description the fields are numbered without a gap, the way KiCAD saves them
+    fieldAttrDict = {key:value for key, value in productAttrDict.items() if key != "Description"}
+    libPart = makeLibPart(fieldAttrDict,fixedAttrDict,rule["attrConfig"],symbolShape)
+    partLines = "\n".join(libPart[1:]).split("\n") #DEF to ENDDEF; the comment lines in front of the block are kept
+
+    if rule.get("keepDrawing"):
+        for index, prefix in enumerate(["DEF ","F0 ","F1 ","F2 ","F3 "]):
+            oldLine = next((line for line in symbol.lines if line.startswith(prefix)),None)
+            if oldLine is not None:
+                partLines[index] = renameLibLine(oldLine,renames)
+
+    libLines = [renameLibLine(line,renames) for line in lines[:defIndex]]+partLines
+
+    desc = makeDesc(productAttrDict.get("Description",""),descName(newName))
+    if descLines is None:
+        newDescLines = desc if productAttrDict.get("Description") else None
+    else:
+        cmpIndex = next(index for index, line in enumerate(descLines) if line.startswith("$CMP "))
+        otherLines = [line for line in descLines[cmpIndex+1:-1] if not line.startswith("D ")] #keywords, datasheet
+        newDescLines = descLines[:cmpIndex]+desc[1:-1]+otherLines+desc[-1:]
+
+    return(libLines,newDescLines)
+
+#Re-render the parts of one library and its description file (runs in a worker process)
+#Returns (library text, description text, messages)
+def regenerateLibrary(job):
+    libHeader, libBlocks, libTrailerLines = job["lib"]
+    descHeader, descBlocks, descTrailerLines = job["desc"]
+    oldDescs = dict(descBlocks)
+
+    taken = {name for name, lines in libBlocks if not name in job["movedOut"]} #names a renamed symbol can't take
+    newLibBlocks = []
+    newDescs = {} #old name -> (new name, dcm lines)
+    extraDescs = [] #descriptions of parts that didn't have one here
+    messages = []
+
+    #(symbol name, lib lines, dcm lines, rule name, productAttrDict, moved in from another library)
+    entries = [(name,lines,oldDescs.get(descName(name)))+job["parts"].get(name,(None,None))+(False,)
+               for name, lines in libBlocks if not name in job["movedOut"]]
+    entries += [entry+(True,) for entry in job["movedIn"]]
+
+    for name, lines, descLines, ruleName, productAttrDict, movedIn in entries:
+        regenerated = None
+
+        if ruleName is not None:
+            regenerated = regenerateSymbol(name,lines,descLines,partRuleSet.byName[ruleName],productAttrDict,job["keepNames"])
+
+            if regenerated is None:
+                messages.append("Couldn't regenerate {0} from its attributes, keeping it as is".format(name))
+            elif (regenerated[0] != name) and (regenerated[0] in taken):
+                messages.append("{0} would be renamed to {1}, which already exists; keeping it as is".format(name,regenerated[0]))
+                regenerated = None
+
+        if regenerated is None:
+            newName, libLines, newDescLines = name, lines, descLines
+        else:
+            newName, libLines, newDescLines = regenerated
+            if newName != name:
+                messages.append("{0} -> {1}".format(name,newName))
+                taken.discard(name)
+
+        taken.add(newName)
+        newLibBlocks.append((newName,libLines))
+
+        if newDescLines is None:
             continue
+        if (descLines is None) or movedIn:
+            extraDescs.append((descName(newName),newDescLines))
+        else:
+            newDescs[descName(name)] = (descName(newName),newDescLines)
+
+    movedOut = {descName(name) for name in job["movedOut"]}
+    newDescBlocks = [newDescs.get(name,(name,lines)) for name, lines in descBlocks if not name in movedOut]
+    newDescBlocks += extraDescs
+
+    return(joinBlocks(libHeader,newLibBlocks,libTrailerLines),joinBlocks(descHeader,newDescBlocks,descTrailerLines),messages)
+
+#Rebuild every part library from its parts' attributes with the current rules, attribute configs and symbol shapes
+#Libraries are rendered in parallel, one process each, and only written if they change (never if dryRun)
+#Output only depends on the input files, so regenerating twice changes nothing the second time
+#Symbols are renamed to what the naming rules give unless keepNames is True
+def regenerateLibraries(workers=None,dryRun=False,keepNames=False):
+    global attrStore
+
+    if useAttrStore:
+        attrStore = AttrStore(attrStorePath,parserVersion())
+
+    try:
+        regenJobs = makeRegenJobs(keepNames)
+    finally:
+        if attrStore:
+            attrStore.close()
+            attrStore = None
+
+    if workers == 1:
+        results = list(map(regenerateLibrary,regenJobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or min(len(regenJobs),os.cpu_count() or 1)) as executor:
+            results = list(executor.map(regenerateLibrary,regenJobs))
+
+    changed = []
+
+    for job, (libText, descText, messages) in zip(regenJobs,results):
+        libPath, descPath, libName = libraryFiles[job["libKey"]]
+
+        for message in messages:
+            print(message)
+
+        for filepath, text in [(libPath,libText),(descPath,descText)]:
+            if text != readText(filepath):
+                changed.append(filepath)
+                if not dryRun:
+                    writeText(filepath,text)
+
+            if not dryRun:
+                updateManifest(filepath,text) #so "diff" shows what's edited by hand from here on
+
+        unloadLibrary(libPath) #reload the regenerated library next time
 
+    for filepath in changed:
+        print("{0} {1}".format(os.path.basename(filepath),"would change" if dryRun else "regenerated"))
+    print("Regeneration complete ({0} files {1}).".format(len(changed),"would change" if dryRun else "changed"))
+
+    return(changed)
+
+#Print the symbols that differ between two manifests; returns the number of symbols that differ
+def printDiff(title,old,new):
+    diff = diffManifests(old,new)
+    count = len(diff["added"])+len(diff["removed"])+len(diff["changed"])
+
+    print("{0}: {1} added, {2} removed, {3} changed, {4} unchanged".format(title,
+                                                                         len(diff["added"]),
+                                                                         len(diff["removed"]),
+                                                                         len(diff["changed"]),
+                                                                         diff["unchanged"]))
+    for mark, key in [("+","added"),("-","removed"),("~","changed")]:
+        for name in diff[key]:
+            print("  {0} {1}".format(mark,name))
+
+    return(count)
+
+#Compare two library or description files, or with no files, every part library with its saved manifest
+#(what's been changed since the script last regenerated or merged it); update saves the current manifests
+#Returns the number of symbols that differ
+def diffLibraries(filepaths=None,update=False):
+    count = 0
+
+    if filepaths:
+        oldPath, newPath = filepaths
+        return(printDiff("{0} -> {1}".format(oldPath,newPath),currentManifest(oldPath),currentManifest(newPath)))
+
+    for libPath, descPath in partLibraries():
+        for filepath in [libPath,descPath]:
+            saved = Manifest.load(filepath)
+
+            if update:
+                updateManifest(filepath)
+            elif saved is None:
+                print("{0}: no manifest yet (diff --update saves one)".format(os.path.basename(filepath)))
+            else:
+                count += printDiff(os.path.basename(filepath),saved,currentManifest(filepath))
+
+    return(count)
+
+#Merge another version of a library or description file into ours symbol by symbol (three-way if base is given)
+#The result is written to outPath (ours if not given); returns the names of the symbols in conflict
+#Works as a git merge driver: merge %A %B --base %O
+#The files' format is taken from their header lines, since git's temporary files have no extension
+#Returns None (leaving ours as it is) if ours and theirs aren't both .lib or both .dcm files
+def mergeLibrary(oursPath,theirsPath,basePath=None,outPath=None):
+    oursText = readText(oursPath)
+    theirsText = readText(theirsPath)
+    fileType = fileFormat(oursPath,oursText)
+    theirsType = fileFormat(theirsPath,theirsText)
+
+    if (fileType is None) or (theirsType is None) or (fileType != theirsType):
+        print("Can't merge {0} and {1}: they aren't both .lib or both .dcm files".format(os.path.basename(oursPath),
+                                                                                       os.path.basename(theirsPath)))
+        return(None)
+
+    header, ours, trailer = splitFile(oursPath,oursText,fileType)
+    theirs = splitFile(theirsPath,theirsText,fileType)[1]
+    base = splitFile(basePath,readText(basePath),fileType)[1] if basePath else None
+
+    merged, conflicts, taken = mergeBlocks(ours,theirs,base)
+    outPath = outPath or oursPath
+    text = joinBlocks(header,merged,trailer)
+
+    writeText(outPath,text)
+
+    if os.path.abspath(outPath) in [os.path.abspath(filepath) for filepath in itertools.chain(*partLibraries())]:
+        updateManifest(outPath,text) #not for git's temporary files
+        unloadLibrary(os.path.abspath(outPath))
+
+    for name in conflicts:
+        print("Conflict: {0} was changed on one side and changed or removed on the other, check it by hand".format(name))
+    print("Merged {0} ({1} symbols taken from {2}, {3} conflicts).".format(os.path.basename(outPath),
+                                                                          taken,
+                                                                          os.path.basename(theirsPath),
+                                                                          len(conflicts)))
+
+    return(conflicts)
+
+#Symbols in the part libraries whose pin count isn't their footprint's pad count (unnumbered pads not counted)
+#Symbols without pins (the empty symbols made for other parts) or without a footprint that exists are left out
+#Returns [(library file name, symbol name, footprint, pin numbers, pad numbers)]
+def pinPadMismatches():
+    mismatches = []
+
+    for libPath, descPath in partLibraries():
+        library = getLibrary(libPath,descPath)
+
+        for name in library.symbols:
+            symbol = library.symbols[name]
+            pins = symbol.pinNumbers()
+            footprintPath = footprintIndex.resolve(symbol.footprint)
+            if not (pins and footprintPath):
+                continue
+
+            pads = footprintGeometry.get(footprintPath).padNumbers()
+            if len(pins) != len(pads):
+                mismatches.append((os.path.basename(libPath),name,symbol.footprint,pins,pads))
+
+    footprintGeometry.save()
+
+    return(mismatches)
+
+#Sort key for pin and pad numbers that puts 2 before 10
+def pinSortKey(number):
+    return([int(piece) if piece.isdigit() else piece for piece in re.split(r"(\d+)",number)])
+
+#Print the pads, courtyard and 3D models of footprints ("library:footprint"; every footprint if there are none),
+#or with mismatches, the symbols whose pin count isn't their footprint's pad count
+#Returns the number of footprints that weren't found or the number of mismatches
+def showFootprints(footprintRefs=None,mismatches=False,asJson=False):
+    if mismatches:
+        found = pinPadMismatches()
+
+        if asJson:
+            print(json.dumps([{"library":libName,"symbol":name,"footprint":footprint,
+                               "pins":sorted(pins,key=pinSortKey),"pads":sorted(pads,key=pinSortKey)}
+                              for libName, name, footprint, pins, pads in found],ensure_ascii=False,indent=1))
         else:
-            print("Adding {0} to inductor library...".format(partNum))        
+            for libName, name, footprint, pins, pads in found:
+                print("{0}: {1} has {2} pins but {3} has {4} pads".format(libName,name,len(pins),footprint,len(pads)))
+            print("{0} symbols don't match their footprints.".format(len(found)))
+
+        return(len(found))
+
+    if not footprintRefs:
+        footprintRefs = ["{0}:{1}".format(libName,name) for libName in footprintIndex.libNames() for name in footprintIndex.paths[libName]]
+
+    footprints = {}
+    missing = 0
+    for footprintRef in footprintRefs:
+        footprintPath = footprintIndex.resolve(footprintRef)
+        if footprintPath is None:
+            footprints[footprintRef] = None
+            missing += 1
+            continue
 
-        indParts.append(makeLibPart(productAttrDict,fixedAttrDict,indAttrConfig,indSymbolShape))
-        indDesc.append(makeDesc(productAttrDict["Description"],fixedAttrDict["Value"]))
+        footprint = footprintGeometry.get(footprintPath)
+        footprints[footprintRef] = {"pads":footprint.pads,
+                                    "padCount":len(footprint.padNumbers()),
+                                    "courtyard":footprint.courtyard,
+                                    "models":[{"path":modelPath,"found":resolveModel(footprintPath,modelPath)}
+                                              for modelPath in footprint.models]}
 
-    elif "Resistor" in productAttrDict["Categories"]:
-        if resLibContents == None:
-            resLibContents = readFile(resLibFilePath) #read the library file so we can see whether or not the part number/name already exists
-            resDescContents = readFile(resDescFilePath) #read the description file to populate it later
+    footprintGeometry.save()
 
-        if partNum in resLibContents:
-            print("Part number ({0}) already exists in resistor library, checking next part...".format(partNum))
+    if asJson:
+        print(json.dumps(footprints,ensure_ascii=False,indent=1))
+        return(missing)
+
+    for footprintRef, footprint in footprints.items():
+        if footprint is None:
+            print("{0}: no such footprint".format(footprintRef))
             continue
-        
-        elif fixedAttrDict["Value"] in resLibContents:
-            print("Similar part ({0}) already exists in resistor library, checking next part...".format(fixedAttrDict["Value"]))
+
+        courtyard = "no courtyard"
+        if footprint["courtyard"] is not None:
+            x1, y1, x2, y2 = footprint["courtyard"]
+            courtyard = "courtyard {0:g} x {1:g} mm".format(round(x2-x1,4),round(y2-y1,4))
+
+        models = ", ".join("{0}{1}".format(model["path"],"" if model["found"] else " (not found)") for model in footprint["models"])
+        print("{0}: {1} pads, {2}, {3}".format(footprintRef,footprint["padCount"],courtyard,models or "no 3D model"))
+
+    return(missing)
+
+#Check every library in the repository, or the .lib/.dcm files given, for the problems listed in kicadLibPopCheck.py
+#Libraries are scanned in parallel (workers processes, one per library by default)
+#Returns the number of errors
+def checkLibraries(filepaths=None,workers=None,asJson=False):
+    if filepaths:
+        libPaths = sorted({os.path.splitext(os.path.abspath(filepath))[0]+".lib" for filepath in filepaths})
+    else:
+        libPaths = sorted(glob.glob(os.path.join(dirName,"*.lib")))
+    libPaths = [libPath for libPath in libPaths if os.path.isfile(libPath)]
+
+    pairs = [(libPath,os.path.splitext(libPath)[0]+".dcm") for libPath in libPaths]
+    pairs = [(libPath,descPath if os.path.isfile(descPath) else None) for libPath, descPath in pairs]
+
+    if (workers == 1) or (len(pairs) < 2):
+        scans = list(map(scanLibrary,pairs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or min(len(pairs),os.cpu_count() or 1)) as executor:
+            scans = list(executor.map(scanLibrary,pairs))
+
+    violations = []
+    for scan in scans:
+        violations += checkScan(scan,footprintIndex,footprintGeometry)
+    footprintGeometry.save()
+
+    violations.sort(key=lambda violation:(violation.file,violation.line))
+    counts = {severity:sum(1 for violation in violations if violation.severity == severity) for severity in severities}
+
+    if asJson:
+        print(json.dumps({"libraries":[os.path.basename(libPath) for libPath in libPaths],
+                          "symbols":sum(len(scan["symbols"]) for scan in scans),
+                          "errors":counts["error"],
+                          "warnings":counts["warning"],
+                          "violations":[violation._asdict() for violation in violations]},ensure_ascii=False,indent=1))
+    else:
+        for violation in violations:
+            print(formatViolation(violation))
+        print("Checked {0} symbols in {1} libraries: {2} errors, {3} warnings.".format(sum(len(scan["symbols"]) for scan in scans),
+                                                                                   len(libPaths),counts["error"],counts["warning"]))
+
+    return(counts["error"])
+
+#Draw symbols from pin tables (see kicadLibPopSymgen.py) and add them to a library (SFUSat.lib by default)
+#Symbols are named after their tables unless a name is given (for one table). A symbol already in the library is
+#skipped, or with replace, redrawn in place keeping its footprint, datasheet and attribute fields. Symbols are
+#printed instead of written with printOnly
+#Returns the number of tables that couldn't be drawn or added
+def generateSymbols(tablePaths,name=None,reference="U",footprint="",description="",libPath=None,pinLimit=None,
+                    replace=False,printOnly=False):
+    libPath = os.path.abspath(libPath or otherLibFilePath)
+    descPath = os.path.splitext(libPath)[0]+".dcm"
+
+    for filepath, header, trailer in ((libPath,libHeader,libTrailer),(descPath,descHeader,descTrailer)):
+        if (not printOnly) and not (os.path.isfile(filepath) and os.path.getsize(filepath)):
+            writeText(filepath,"{0}\n{1}\n".format(header,trailer))
+
+    library = getLibrary(libPath,descPath if os.path.isfile(descPath) else None) if os.path.isfile(libPath) else None
+    footprintPath = footprintIndex.resolve(footprint) if footprint else None
+    if footprint and (footprintPath is None):
+        print("Footprint {0} doesn't exist in this repository".format(footprint))
+
+    newParts = [] #(lib lines, description lines)
+    redrawn = {} #symbol name -> lib lines from DEF to ENDDEF
+    drawnNames = set() #names drawn so far in this batch, which the library doesn't know about yet
+    failures = 0
+
+    for tablePath in tablePaths:
+        symbolName = name or os.path.splitext(os.path.basename(tablePath))[0]
+        if symbolName in drawnNames:
+            print("{0} is drawn from another pin table already, skipping {1}".format(symbolName,tablePath))
+            failures += 1
+            continue
+
+        try:
+            pins = readPinTable(tablePath)
+            symbol = generateSymbol(pins,pinLimit or symbolUnitPins)
+        except (OSError, ValueError) as error:
+            print("Couldn't draw {0}: {1}".format(symbolName,error))
+            failures += 1
+            continue
+
+        oldSymbol = library.symbols[symbolName] if (library is not None) and (symbolName in library) else None
+        if (oldSymbol is not None) and not replace:
+            print("{0} is already in {1}, skipping it (--replace to redraw it)".format(symbolName,os.path.basename(libPath)))
+            failures += 1
             continue
 
+        fixedAttrDict = {"Reference":reference,"Value":symbolName,"Footprint":footprint,"Datasheet":""}
+        productAttrDict = {}
+        if oldSymbol is not None:
+            fixedAttrDict["Footprint"] = footprint or oldSymbol.footprint
+            fixedAttrDict["Datasheet"] = oldSymbol.fields[3][0] if 3 in oldSymbol.fields else ""
+            productAttrDict = oldSymbol.namedFields()
+
+        libPart = LibPartTemplate(symbolAttrConfig(otherAttrConfig,symbol),symbol.shape).render(productAttrDict,fixedAttrDict)
+        print("{0}: {1} pins in {2} units ({3})".format(symbolName,len(pins),len(symbol.units),
+                                                         ", ".join(label for label, unitPins in symbol.units)))
+
+        drawnNames.add(symbolName)
+        pinNumbers = {pin.number for pin in pins}
+        padPath = footprintIndex.resolve(fixedAttrDict["Footprint"]) if fixedAttrDict["Footprint"] else None
+        if padPath is not None:
+            pads = footprintGeometry.get(padPath).padNumbers()
+            for label, numbers in (("Pins without a pad",pinNumbers-pads),("Pads without a pin",pads-pinNumbers)):
+                if numbers:
+                    print("    {0} in {1}: {2}".format(label,fixedAttrDict["Footprint"],", ".join(sorted(numbers,key=pinSortKey))))
+
+        if printOnly:
+            print("\n".join(libPart))
+        elif oldSymbol is not None:
+            redrawn[symbolName] = "\n".join(libPart[1:]).split("\n") #the comment lines in front of the old block are kept
         else:
-            print("Adding {0} to resistor library...".format(partNum))
+            newParts.append((libPart,makeDesc(description,descName(symbolName)) if description else None))
+
+    footprintGeometry.save()
+    redrawnCount = len(redrawn)
+
+    if redrawn:
+        header, blocks, trailer = splitLib(readText(libPath))
+        for index, (blockName, lines) in enumerate(blocks):
+            if blockName in redrawn:
+                defIndex = next(lineIndex for lineIndex, line in enumerate(lines) if line.startswith("DEF "))
+                blocks[index] = (blockName,lines[:defIndex]+redrawn.pop(blockName)) #a duplicate DEF is left alone
+        writeText(libPath,joinBlocks(header,blocks,trailer))
+    if newParts:
+        writeToLibFile(libPath,[libPart for libPart, desc in newParts])
+        descs = [desc for libPart, desc in newParts if desc is not None]
+        if descs:
+            writeToDescFile(descPath,descs)
+
+    if redrawnCount or newParts:
+        unloadLibrary(libPath)
+        print("Added {0} and redrew {1} symbols in {2}.".format(len(newParts),redrawnCount,os.path.basename(libPath)))
+
+    return(failures)
+
+#Record every part in the libraries that has a supplier part number in the part store, as already written
+#Attributes come from the attribute store if it has the part, otherwise from the symbol and its description
+#Returns the number of parts that weren't in the store or were different there
+def adoptLibraries(store):
+    global attrStore
+
+    if useAttrStore:
+        attrStore = AttrStore(attrStorePath,parserVersion())
+
+    try:
+        for libKey, (libPath, descPath, libName) in libraryFiles.items():
+            library = getLibrary(libPath,descPath)
+            parts = []
+
+            for name in library.symbols:
+                symbol = library.symbols[name]
+                if not symbol.supplierPartNum:
+                    continue
+
+                productAttrDict = symbolAttrs(symbol,library.descs.get(descName(name),{}))
+                rule = partRuleSet.classify(productAttrDict.get("Categories",""))
+                fixedAttrDict = {"Reference":symbol.reference,
+                                 "Value":name,
+                                 "Footprint":symbol.footprint,
+                                 "Datasheet":symbol.fields[3][0] if 3 in symbol.fields else ""}
+
+                parts.append(makeStoredPart(symbol.supplierPartNum,dict(rule,library=libKey),productAttrDict,fixedAttrDict))
+
+            changed = store.put(parts,synced=True)
+            state = store.libraryState(libKey)
+            store.setLibraryState(libKey,state.revision if state else 0,(libPath,descPath),library.symbols)
+            print("{0}: {1} parts, {2} new or changed in the store".format(os.path.basename(libPath),len(parts),changed))
+    finally:
+        if attrStore:
+            attrStore.close()
+            attrStore = None
+
+    return(store.stats())
+
+#Work out every stored part's rule, library, name, reference and footprint again with the current rules, the same way
+#regenerate does, and store the parts that change so "store sync" rewrites only them
+#Returns the number of parts that changed
+def refreshStore(store):
+    changed = []
+
+    for part in store.select("WHERE NOT deleted ORDER BY partNum"):
+        try:
+            rule = partRuleSet.classify(part.attrs["Categories"])
+            fixedAttrDict = makeFixedAttrs(part.attrs,rule)
+        except (KeyError,IndexError,ValueError,ArithmeticError):
+            print("Couldn't work out {0} ({1}) from its attributes, keeping it as is".format(part.partNum,part.name))
+            continue
 
-        resParts.append(makeLibPart(productAttrDict,fixedAttrDict,resAttrConfig,resSymbolShape))
-        resDesc.append(makeDesc(productAttrDict["Description"],fixedAttrDict["Value"]))
+        if keepSymbolName(rule,part.name,fixedAttrDict["Value"]) or ("\ufffd" in fixedAttrDict["Value"]):
+            fixedAttrDict["Value"] = part.name
 
-    else:
-        if otherLibContents == None:
-            otherLibContents = readFile(otherLibFilePath) #read the library file so we can see whether or not the part number/name already exists
-            otherDescContents = readFile(otherDescFilePath) #read the description file to populate it later
+        refreshed = makeStoredPart(part.partNum,rule,part.attrs,fixedAttrDict,part.drawing)
+        refreshed = refreshed._replace(footprint=refreshed.footprint or part.footprint)
+
+        if refreshed[:10] != part[:10]:
+            changed.append(refreshed)
+            if refreshed.name != part.name:
+                print("{0} -> {1}".format(part.name,refreshed.name))
+
+    store.put(changed)
+    print("{0} parts changed (revision {1}); run \"store sync\" to write them to the libraries.".format(len(changed),store.revision))
+
+    return(len(changed))
 
-        if partNum in otherLibContents:
-            print("Part number ({0}) already exists in library, checking next part...".format(partNum))
+#Lib lines and dcm lines of a stored part, rendered over its old blocks if it has them (see renderOverBlock)
+def renderStoredPart(part,lines=None,descLines=None):
+    rule = partRuleSet.byName[part.rule]
+    fixedAttrDict = {"Reference":part.reference,"Value":part.name,"Footprint":part.footprint,"Datasheet":part.datasheet}
+
+    if lines is not None:
+        return(renderOverBlock(part.syncedName or part.name,lines,descLines,rule,part.attrs,fixedAttrDict))
+
+    if part.drawing:
+        libPart = LibPartTemplate(*part.drawing).render(part.attrs,fixedAttrDict)
+    else:
+        libPart = makeLibPart(part.attrs,fixedAttrDict,rule["attrConfig"],rule["symbolShape"])
+
+    return(libPart,makeDesc(part.attrs.get("Description",""),part.name))
+
+#Write the parts changed in the part store since each library was last synced to the libraries
+#Parts that were removed or moved are taken out and changed parts are re-rendered in place, which rewrites the
+#library; new parts are only appended. The names in a library are taken from the store unless the library was
+#changed some other way since, so a sync that has nothing to do doesn't read any library
+#Parts whose new name is already taken are left for the next sync
+#Returns (parts written, parts taken out, conflicts)
+def syncLibraries(store,dryRun=False):
+    revision = store.revision
+    plans = {} #library key -> {"names":..., "appends":[StoredPart], "conflicts":[StoredPart]}
+    movedBlocks = {} #partNum -> (lib lines, dcm lines) taken out of another library
+    written = []
+    takenOut = []
+
+    for libKey, (libPath, descPath, libName) in libraryFiles.items():
+        incoming, outgoing = store.pending(libKey)
+        if not (incoming or outgoing):
             continue
-        
-        if fixedAttrDict["Value"] in otherLibContents:
-            print("Similar part to {0} ({1}) already exists in library, checking next part...".format(partNum,
-                                                                                                      fixedAttrDict["Value"]))
+
+        library = None
+        if store.isUnchanged(libKey,(libPath,descPath)):
+            names = set(store.libraryState(libKey).names)
+        else:
+            library = Library(libPath,descPath).load()
+            names = set(library.symbols)
+
+        updates = []
+        appends = []
+        for part in incoming:
+            if part.syncedLibrary == libKey:
+                updates.append(part)
+            elif (library is not None) and (part.name in names) and (library.bySupplierPartNum.get(part.partNum) == part.name):
+                updates.append(part._replace(syncedLibrary=libKey,syncedName=part.name)) #written by a sync that didn't finish
+            else:
+                appends.append(part)
+
+        plan = plans[libKey] = {"names":names,"appends":appends,"conflicts":[]}
+        if not (updates or outgoing):
             continue
 
-        otherParts.append(makeLibPart(productAttrDict,fixedAttrDict,otherAttrConfig,otherSymbolShape))
-        otherDesc.append(makeDesc(productAttrDict["Description"],fixedAttrDict["Value"]))                
-
-#        print("Sorry, currently only chip capacitors, inductors, and resistors are supported.")
-#        continue
-
-if not capParts == []:
-    writeToLibFile(capLibFilePath,capLibContents,capParts)
-    writeToDescFile(capDescFilePath,capDescContents,capDesc)
-if not indParts == []:
-    writeToLibFile(indLibFilePath,indLibContents,indParts)
-    writeToDescFile(indDescFilePath,indDescContents,indDesc)
-if not resParts == []:
-    writeToLibFile(resLibFilePath,resLibContents,resParts)
-    writeToDescFile(resDescFilePath,resDescContents,resDesc)
-if not otherParts == []:
-    writeToLibFile(otherLibFilePath,otherLibContents,otherParts)
-    writeToDescFile(otherDescFilePath,otherDescContents,otherDesc)
-
-print("Library updating complete.")
+        header, blocks, trailer = splitLib(readText(libPath))
+        descHeader, descBlocks, descTrailerLines = splitDcm(readText(descPath))
+        blockIndex = {}
+        for index, (name, lines) in reversed(list(enumerate(blocks))):
+            blockIndex[name] = index
+        descIndex = {}
+        for index, (name, lines) in reversed(list(enumerate(descBlocks))):
+            descIndex[name] = index
+
+        for part in outgoing:
+            index = blockIndex.pop(part.syncedName,None)
+            descIdx = descIndex.pop(descName(part.syncedName),None)
+            oldLines = blocks[index][1] if index is not None else None
+            oldDescLines = descBlocks[descIdx][1] if descIdx is not None else None
+
+            if index is not None:
+                blocks[index] = None
+            if descIdx is not None:
+                descBlocks[descIdx] = None
+            if (not part.deleted) and (oldLines is not None):
+                movedBlocks[part.partNum] = (oldLines,oldDescLines)
+
+            names.discard(part.syncedName)
+            takenOut.append(part)
+            print("{0}: {1} {2}".format(os.path.basename(libPath),"removed" if part.deleted else "moved out",part.syncedName))
+
+        for part in updates:
+            index = blockIndex.get(part.syncedName)
+            if index is None: #taken out of the library by hand; write it again
+                appends.append(part._replace(syncedLibrary=None,syncedName=None))
+                continue
+            if (part.name != part.syncedName) and (part.name in names):
+                plan["conflicts"].append(part)
+                print("{0}: {1} can't be renamed to {2}, which already exists".format(os.path.basename(libPath),part.syncedName,part.name))
+                continue
+
+            try:
+                descIdx = descIndex.get(descName(part.syncedName))
+                libLines, newDescLines = renderStoredPart(part,blocks[index][1],descBlocks[descIdx][1] if descIdx is not None else None)
+            except KeyError:
+                plan["conflicts"].append(part)
+                print("{0}: no rule named {1} for {2}".format(os.path.basename(libPath),part.rule,part.name))
+                continue
+
+            blocks[index] = (part.name,libLines)
+            if newDescLines is not None:
+                if descIdx is not None:
+                    descBlocks[descIdx] = (descName(part.name),newDescLines)
+                else:
+                    descBlocks.append((descName(part.name),newDescLines))
+
+            names.discard(part.syncedName)
+            names.add(part.name)
+            written.append(part)
+            print("{0}: updated {1}{2}".format(os.path.basename(libPath),part.name,
+                                               "" if part.name == part.syncedName else " (was {0})".format(part.syncedName)))
+
+        if not dryRun:
+            writeText(libPath,joinBlocks(header,[block for block in blocks if block is not None],trailer))
+            writeText(descPath,joinBlocks(descHeader,[block for block in descBlocks if block is not None],descTrailerLines))
+
+    for libKey, plan in plans.items():
+        libPath, descPath, libName = libraryFiles[libKey]
+        names = plan["names"]
+        libParts = []
+        libDesc = []
+
+        for part in plan["appends"]:
+            if part.name in names:
+                plan["conflicts"].append(part)
+                print("{0}: {1} ({2}) can't be added, the name is already taken".format(os.path.basename(libPath),part.name,part.partNum))
+                continue
+
+            oldLines, oldDescLines = movedBlocks.get(part.partNum,(None,None))
+            try:
+                libPart, desc = renderStoredPart(part,oldLines,oldDescLines)
+            except KeyError:
+                plan["conflicts"].append(part)
+                print("{0}: no rule named {1} for {2}".format(os.path.basename(libPath),part.rule,part.name))
+                continue
+
+            libParts.append(libPart)
+            if desc is not None:
+                libDesc.append(desc)
+            names.add(part.name)
+            written.append(part)
+            print("{0}: added {1}".format(os.path.basename(libPath),part.name))
+
+        if libParts and not dryRun:
+            writeToLibFile(libPath,libParts)
+            if libDesc:
+                writeToDescFile(descPath,libDesc)
+
+    if dryRun:
+        return(written,takenOut,[part for plan in plans.values() for part in plan["conflicts"]])
+
+    store.markSynced(written,takenOut)
+    for libKey, plan in plans.items():
+        libPath, descPath, libName = libraryFiles[libKey]
+        conflictRevisions = [part.revision for part in plan["conflicts"]]
+        store.setLibraryState(libKey,min(conflictRevisions)-1 if conflictRevisions else revision,(libPath,descPath),plan["names"])
+        unloadLibrary(libPath)
+
+    return(written,takenOut,[part for plan in plans.values() for part in plan["conflicts"]])
+
+#Run a part store command ("adopt", "sync", "refresh", "list" or "remove"); returns the exit code
+def partStoreCommand(args):
+    store = PartStore(args.db)
+
+    try:
+        if args.storeCommand == "adopt":
+            print("{parts} parts in the store (revision {revision}).".format(**adoptLibraries(store)))
+
+        elif args.storeCommand == "refresh":
+            refreshStore(store)
+
+        elif args.storeCommand == "sync":
+            written, takenOut, conflicts = syncLibraries(store,args.dry_run)
+            print("{0} {1} parts and took out {2}{3}.".format("Would write" if args.dry_run else "Wrote",len(written),
+                                                               len(takenOut),", {0} conflicts".format(len(conflicts)) if conflicts else ""))
+            return(1 if conflicts else 0)
+
+        elif args.storeCommand == "remove":
+            removed = store.remove(args.parts)
+            print("Removed {0} parts (revision {1}); run \"store sync\" to take them out of the libraries.".format(removed,store.revision))
+            return(0 if removed == len(set(args.parts)) else 1)
+
+        elif args.storeCommand == "list":
+            parts = []
+            if args.pending:
+                for libKey in (args.lib or libraryFiles):
+                    incoming, outgoing = store.pending(libKey)
+                    parts += incoming+[part for part in outgoing if not part in incoming]
+            elif args.mpn:
+                parts = store.findMpn(args.mpn)
+            else:
+                parts = [part for libKey in (args.lib or libraryFiles) for part in store.changedSince(args.since,libKey)]
+
+            if args.json:
+                print(json.dumps([part._asdict() for part in parts],ensure_ascii=False,indent=1))
+            else:
+                for part in parts:
+                    state = "removed" if part.deleted else ("synced" if part.syncedRevision == part.revision else "pending")
+                    print("{0}: {1} {2} (revision {3}, {4})".format(part.library,part.partNum,part.name,part.revision,state))
+                print("{parts} parts, {pending} pending, revision {revision}.".format(**store.stats()))
+    finally:
+        store.close()
+
+    return(0)
+
+#Write the CSV BOM of an EESCHEMA XML netlist (see kicadLibPopBom.py), next to the netlist unless csvPath is given
+#With join, supplier fields that components are missing are filled in from their symbols in the libraries
+#Returns whether the BOM was written
+def exportBom(netlistPath,csvPath=None,group=False,join=False):
+    if csvPath is None:
+        csvPath = os.path.splitext(netlistPath)[0]+".csv"
+
+    try:
+        bom = writeBom(netlistPath,csvPath,group,dirName if join else None)
+    except (OSError, ParseError) as error:
+        print("Couldn't write the BOM of {0}: {1}".format(netlistPath,error))
+        return(False)
+
+    print("Wrote {0} components to {1}".format(len(bom),csvPath))
+    if join:
+        print("Filled in the supplier fields of {0} components from the libraries.".format(bom.join.filled))
+
+    return(True)
+
+#Build the command line parser
+def makeArgParser():
+    parser = argparse.ArgumentParser(description="Populate the SFUSat KiCAD libraries from Digi-Key part numbers")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    importCmd = commands.add_parser("import",help="add parts to the libraries")
+    importCmd.add_argument("files",nargs="*",
+                           help="text, CSV or TSV files of Digi-Key part numbers (BOMs from bom2csvSFUsat.xsl work); - for stdin")
+    importCmd.add_argument("-p","--part",action="append",default=[],help="a part number to add (can be repeated)")
+    importCmd.add_argument("-m","--mpn",action="append",default=[],help="a manufacturer part number to look up and add")
+    importCmd.add_argument("--catalog",action="append",default=list(catalogPaths),
+                           help="CSV or SQLite part catalog to look parts up in besides Digi-Key (can be repeated)")
+    importCmd.add_argument("--strategy",choices=strategies,default=supplierStrategy,
+                           help="use the first supplier to have a part, or the most complete answer")
+    importCmd.add_argument("--chunk-size",type=int,default=chunkSize,help="parts processed and written at a time")
+    importCmd.add_argument("--concurrency",type=int,default=fetchConcurrency,help="product pages fetched at the same time")
+    importCmd.add_argument("--pool-size",type=int,default=httpPoolSize,
+                           help="connections kept open to the supplier (default: one per concurrent fetch)")
+    importCmd.add_argument("--rate-limit",type=float,default=fetchRateLimit,help="maximum requests per second to a host")
+    importCmd.add_argument("--timeout",type=float,default=fetchTimeout,help="seconds to wait for a page before retrying")
+    importCmd.add_argument("--retries",type=int,default=fetchRetries,help="times a failed request is retried")
+    importCmd.add_argument("--restart",action="store_true",help="ignore the checkpoint of an unfinished import of the same input")
+    importCmd.add_argument("--cache-mode",choices=["normal","offline","refresh"],default=pageCacheMode)
+    importCmd.add_argument("--parser",choices=list(kicadLibPopParse.parserBackends),default=parserBackend)
+    importCmd.add_argument("--no-attr-store",action="store_true",help="always parse product pages")
+    importCmd.add_argument("--pin-tables",default=pinTableDir,metavar="DIR",
+                           help="directory of pin tables (<MPN>.csv) to draw other parts from")
+    importCmd.add_argument("--no-part-store",action="store_true",help="don't record the parts in the part store")
+    importCmd.add_argument("--report",default=reportPath,help="where to write the JSON run report")
+    importCmd.add_argument("--profile",action="store_true",help="profile the import with cProfile (saved next to the report)")
+    importCmd.add_argument("--trace-memory",action="store_true",help="record the peak memory and biggest allocations")
+    importCmd.add_argument("--url-template",default=dkUrlTemplate,help=argparse.SUPPRESS) #for local stand-in servers
+
+    regenCmd = commands.add_parser("regenerate",help="re-render every part in the libraries with the current rules")
+    regenCmd.add_argument("--jobs",type=int,default=None,help="worker processes (default: one per library)")
+    regenCmd.add_argument("--dry-run",action="store_true",help="only list the files that would change")
+    regenCmd.add_argument("--no-attr-store",action="store_true",help="only use the attributes saved in the libraries")
+    regenCmd.add_argument("--keep-names",action="store_true",help="re-render the fields but don't rename any symbols")
+
+    searchCmd = commands.add_parser("search",help="find parts in the libraries by their parameters")
+    searchCmd.add_argument("conditions",nargs="*",metavar="CONDITION",
+                           help='e.g. "package=0603" "capacitance>=10u" "voltage>=16V" (=, <, <=, >, >=, ~ for text)')
+    searchCmd.add_argument("--lib",action="append",choices=list(libraryFiles),help="only search these libraries")
+    searchCmd.add_argument("--json",action="store_true",help="print the matching parts and all their fields as JSON")
+
+    diffCmd = commands.add_parser("diff",help="list the symbols that changed")
+    diffCmd.add_argument("files",nargs="*",metavar="FILE",
+                         help="two .lib or .dcm files to compare (default: each library against its manifest)")
+    diffCmd.add_argument("--update",action="store_true",help="save the current manifests instead")
+
+    mergeCmd = commands.add_parser("merge",help="merge another version of a library symbol by symbol")
+    mergeCmd.add_argument("ours",help="our .lib or .dcm file")
+    mergeCmd.add_argument("theirs",help="their version of the file")
+    mergeCmd.add_argument("--base",help="the version both sides started from, for a three-way merge")
+    mergeCmd.add_argument("-o","--output",help="where to write the result (default: ours)")
+
+    checkCmd = commands.add_parser("check",help="check the libraries for broken footprints, duplicates and missing descriptions")
+    checkCmd.add_argument("files",nargs="*",metavar="FILE",help=".lib or .dcm files to check (default: every library)")
+    checkCmd.add_argument("--jobs",type=int,default=None,help="worker processes (default: one per library)")
+    checkCmd.add_argument("--json",action="store_true",help="print the violations as JSON")
+
+    footprintsCmd = commands.add_parser("footprints",help="show the pads, courtyards and 3D models of footprints")
+    footprintsCmd.add_argument("footprints",nargs="*",metavar="FOOTPRINT",help="library:footprint (default: every footprint)")
+    footprintsCmd.add_argument("--mismatches",action="store_true",
+                               help="list the symbols whose pin count isn't their footprint's pad count instead")
+    footprintsCmd.add_argument("--json",action="store_true",help="print the results as JSON")
+
+    bomCmd = commands.add_parser("bom",help="write a CSV BOM from an EESCHEMA XML netlist")
+    bomCmd.add_argument("netlist",help="the XML netlist (%%I in KiCAD's BOM dialog)")
+    bomCmd.add_argument("-o","--output",help="where to write the BOM (default: the netlist's name with .csv)")
+    bomCmd.add_argument("--group",action="store_true",help="one row per set of identical parts, with a quantity")
+    bomCmd.add_argument("--join",action="store_true",help="fill in missing supplier fields from the libraries")
+
+    symgenCmd = commands.add_parser("symgen",help="draw multi-unit symbols from pin tables and add them to a library")
+    symgenCmd.add_argument("tables",nargs="+",metavar="TABLE",help="CSV/TSV pin tables, one per symbol (named after the file)")
+    symgenCmd.add_argument("--name",help="symbol name (one table only)")
+    symgenCmd.add_argument("--reference",default="U",help="reference designator")
+    symgenCmd.add_argument("--footprint",default="",help="library:footprint, checked against the table's pin numbers")
+    symgenCmd.add_argument("--description",default="",help="description for the .dcm file")
+    symgenCmd.add_argument("--lib",help="library to add the symbols to (default: SFUSat.lib)")
+    symgenCmd.add_argument("--max-pins",type=int,default=symbolUnitPins,help="pins per unit before a group is split")
+    symgenCmd.add_argument("--replace",action="store_true",help="redraw symbols that are already in the library")
+    symgenCmd.add_argument("--print",action="store_true",help="print the symbols instead of writing them")
+
+    storeCmd = commands.add_parser("store",help="manage the part store and sync it to the libraries")
+    storeCmd.add_argument("--db",default=partStorePath,help="the part store's SQLite file")
+    storeCommands = storeCmd.add_subparsers(dest="storeCommand")
+    storeCommands.required = True
+    storeCommands.add_parser("adopt",help="record the parts already in the libraries in the store")
+    storeCommands.add_parser("refresh",help="work out every part's name, footprint and library again with the current rules")
+    syncCmd = storeCommands.add_parser("sync",help="write the parts changed in the store to the libraries")
+    syncCmd.add_argument("--dry-run",action="store_true",help="only list what would be written")
+    removeCmd = storeCommands.add_parser("remove",help="remove parts (taken out of the libraries by the next sync)")
+    removeCmd.add_argument("parts",nargs="+",metavar="PART",help="supplier part numbers")
+    listCmd = storeCommands.add_parser("list",help="list the stored parts")
+    listCmd.add_argument("--lib",action="append",choices=list(libraryFiles),help="only list these libraries")
+    listCmd.add_argument("--since",type=int,default=0,help="only parts changed after this revision")
+    listCmd.add_argument("--pending",action="store_true",help="only parts the next sync would write or take out")
+    listCmd.add_argument("--mpn",help="parts with this manufacturer part number")
+    listCmd.add_argument("--json",action="store_true",help="print the parts and all their attributes as JSON")
+
+    canonCmd = commands.add_parser("canonicalize",help="re-canonicalize the values in symbol names")
+    canonCmd.add_argument("--write",action="store_true",help="rename the symbols instead of only listing them")
+
+    return(parser)
+
+def main(argv=None):
+    global chunkSize, fetchConcurrency, parserBackend, pageCacheMode, useAttrStore, dkUrlTemplate, catalogPaths, supplierStrategy
+    global rateLimiter, retryPolicy, fetchBreaker, httpSession, pageCache, reportPath, profileImports, traceImportMemory
+    global pinTableDir, usePartStore
+
+    args = makeArgParser().parse_args(argv)
+
+    if args.command == "import":
+        if not (args.files or args.part or args.mpn):
+            args.files = ["-"]
+
+        chunkSize = max(1,args.chunk_size)
+        fetchConcurrency = args.concurrency
+        parserBackend = args.parser
+        pageCacheMode = args.cache_mode
+        useAttrStore = not args.no_attr_store
+        dkUrlTemplate = args.url_template
+        catalogPaths = args.catalog
+        supplierStrategy = args.strategy
+        reportPath = args.report
+        profileImports = args.profile
+        traceImportMemory = args.trace_memory
+        pinTableDir = args.pin_tables
+        usePartStore = not args.no_part_store
+
+        rateLimiter = RateLimiter(args.rate_limit)
+        retryPolicy = RetryPolicy(args.retries,args.timeout,fetchBackoff,fetchMaxBackoff)
+        fetchBreaker = CircuitBreaker(breakerThreshold,breakerResetTime)
+        httpSession = HttpSession(args.pool_size or args.concurrency,args.timeout)
+        pageCache = PageCache(pageCacheDir,pageCacheTtl,pageCacheMaxBytes,pageCacheMode)
+
+        added, complete = importFiles(args.files,args.part,not args.restart,args.mpn)
+        return(0 if complete else 1)
+
+    elif args.command == "regenerate":
+        useAttrStore = not args.no_attr_store
+        regenerateLibraries(args.jobs,args.dry_run,args.keep_names)
+
+    elif args.command == "search":
+        try:
+            conditions = [parseCondition(condition) for condition in args.conditions]
+            results = searchParts(conditions,args.lib)
+            fieldNames = [getSearchIndex().resolveField(field) for field, op, value in conditions]
+        except ValueError as error:
+            print(error)
+            return(2)
+
+        if args.json:
+            print(json.dumps([{"library":libKey,"name":name,"fields":fields} for libKey, name, fields in results],
+                             ensure_ascii=False,indent=1))
+        else:
+            for libKey, name, fields in results:
+                print("{0}: {1}".format(os.path.basename(libraryFiles[libKey][0]),name))
+                for field in dict.fromkeys(fieldNames):
+                    print("    {0}: {1}".format(field,fields.get(field,"")))
+            print("{0} parts found.".format(len(results)))
+
+    elif args.command == "diff":
+        if not len(args.files) in (0,2):
+            print("diff takes two files or none")
+            return(2)
+        return(1 if diffLibraries(args.files,args.update) else 0)
+
+    elif args.command == "merge":
+        conflicts = mergeLibrary(args.ours,args.theirs,args.base,args.output)
+        if conflicts is None:
+            return(2)
+        return(1 if conflicts else 0)
+
+    elif args.command == "check":
+        return(1 if checkLibraries(args.files,args.jobs,args.json) else 0)
+
+    elif args.command == "footprints":
+        return(1 if showFootprints(args.footprints,args.mismatches,args.json) else 0)
+
+    elif args.command == "bom":
+        return(0 if exportBom(args.netlist,args.output,args.group,args.join) else 1)
+
+    elif args.command == "symgen":
+        if args.name and (len(args.tables) > 1):
+            print("--name can only be used with one pin table")
+            return(2)
+        return(1 if generateSymbols(args.tables,args.name,args.reference,args.footprint,args.description,args.lib,
+                                    max(1,args.max_pins),args.replace,args.print) else 0)
+
+    elif args.command == "store":
+        return(partStoreCommand(args))
+
+    elif args.command == "canonicalize":
+        canonicalizeLibraries(args.write)
+
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,859 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for kicadLibPop.py
+
+USAGE:
+python kicadLibPopBench.py parse [--pages DIR] [--repeat N] [--backends html5lib,strainer,tokenizer]
+python kicadLibPopBench.py render [--parts N]
+python kicadLibPopBench.py fetch [--pages N] [--latency S[,S]] [--error-rate R] [--timeout S] [--no-pool]
+python kicadLibPopBench.py pipeline [--parts N] [--pages DIR] [--runs N] [--save-baseline] [--tolerance T]
+python kicadLibPopBench.py bom [--components N] [--repeat N]
+
+parse: times each parser backend in kicadLibPopParse.py on a set of saved
+product pages and reports the mean parse time and peak memory (tracemalloc)
+per page. Pages are read from DIR ("*.html" or "*.html.gz", so the page cache
+directory works as is). If DIR has no pages, synthetic Digi-Key shaped pages
+are generated instead. The rows each backend returns are compared, so the
+benchmark doubles as a check that the fast backends agree with html5lib.
+
+render: renders N synthetic parts with kicadLibPop.makeLibPart (compiled
+templates) and with the original str.format implementation kept below as
+legacyMakeLibPart, checks the output is identical and reports parts/s.
+
+fetch: fetches N synthetic pages with kicadLibPopFetch.fetchUrl from a local
+FixtureServer that delays responses (a fixed latency or a random one between
+two values) and answers a fraction of requests with 503. Reports how many
+pages arrived intact, how many were given up on or stopped by the circuit
+breaker, and how long it took. Any page that arrives different from the one
+served is an error. Pages are fetched over a pooled keep-alive HttpSession
+unless --no-pool is given, which opens a connection per request instead; the
+connection counts and mean time per request phase are printed for comparison.
+
+pipeline: replays a corpus of product pages through a whole
+"kicadLibPop.py import" with no network. Each run copies the scripts and
+libraries to a temporary directory, puts the pages in its page cache and
+imports them in offline mode as a separate process. The corpus is N parts of
+each family in fixtureFamilies (capacitors, resistors, inductors, ferrites,
+FETs, diodes and crystals), or the pages saved in DIR (e.g. the page cache of
+real imports). Reports throughput (parts/s over the import's own wall time),
+latency percentiles of every per-part stage and the total of the batch stages
+from the run reports (see kicadLibPopStats.py), and the peak RSS of the
+import process. --save-baseline keeps the results in .cache/bench-baseline.json;
+later runs are compared with it, and anything more than the tolerance slower
+(or bigger) is flagged as a regression and fails the benchmark.
+
+bom: writes a synthetic EESCHEMA XML netlist of N components (placed from
+symbols in the part libraries, some without their supplier fields and some
+without any fields) and exports its BOM with kicadLibPopBom (plain, grouped
+and with the supplier fields joined from the libraries) and with legacyBom,
+a transcription of bom2csvSFUsat.xsl kept below. Reports the time and peak
+memory (tracemalloc) of each and checks the plain BOM is identical to
+legacyBom's. If xsltproc is installed, the XSL itself is timed and compared
+too.
+"""
+
+import argparse
+import gc
+import glob
+import gzip
+import html
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+import kicadLibPopParse
+
+dirName = os.path.dirname(os.path.abspath(__file__))
+defaultPageDir = os.path.join(dirName,".cache","pages")
+defaultBaselinePath = os.path.join(dirName,".cache","bench-baseline.json")
+
+###############################################################################
+### FIXTURE PAGES ###
+###############################################################################
+#Read every saved page in a directory; returns {name: webpage}
+def loadPages(pageDir):
+    pages = {}
+
+    for pagePath in sorted(glob.glob(os.path.join(pageDir,"*.html"))+glob.glob(os.path.join(pageDir,"*.html.gz"))):
+        name = os.path.basename(pagePath).split(".html")[0]
+        opener = gzip.open if pagePath.endswith(".gz") else open
+
+        with opener(pagePath,"rb") as pageFile:
+            pages[name] = pageFile.read().decode("utf-8")
+
+    return(pages)
+
+#Render a product attribute dictionary as a page with the same table markup as Digi-Key
+#filler is the number of unrelated page sections, to give the page a realistic size
+def makeProductPage(productAttrDict,filler=200):
+    detailFields = ["Supplier Part Number 1","Manufacturer 1","Manufacturer Part Number 1","Description"]
+    detailNames = {"Supplier Part Number 1":"Digi-Key Part Number",
+                   "Manufacturer 1":"Manufacturer",
+                   "Manufacturer Part Number 1":"Manufacturer Part Number"}
+
+    page = ["<!DOCTYPE html><html><head><title>{0}</title>".format(html.escape(productAttrDict.get("Description",""))),
+            "<script>var dataLayer = [];</script></head><body>"]
+    page += ['<div class="nav"><ul><li><a href="/x/{0}">Section {0}</a></li></ul><p>{1}</p></div>'.format(index,"lorem ipsum "*20)
+             for index in range(filler//2)]
+
+    page.append('<table id="product-details"><tbody>')
+    for field in detailFields:
+        if field in productAttrDict:
+            page.append("<tr>\n<th>{0}</th>\n<td>\n  {1}\n</td>\n</tr>".format(detailNames.get(field,field),
+                                                                              html.escape(productAttrDict[field])))
+    page.append("</tbody></table>")
+
+    page.append('<table id="prod-att-table"><tbody>')
+    page.append('<tr id="prod-att-title-row"><th>Categories</th><td>Attribute</td></tr>')
+    for field, value in sorted(productAttrDict.items()):
+        if field in detailFields or field == "Supplier 1":
+            continue
+
+        value = value.replace('\\"','"') #pages have plain quotes, the parser escapes them
+
+        if field == "Categories" and " - " in value:
+            first, rest = value.split(" - ",1)
+            page.append('<tr><th rowspan="2">{0}</th><td><a href="#">{1}</a></td></tr>'.format(field,html.escape(first)))
+            page.append('<tr><td><a href="#">{0}</a></td></tr>'.format(html.escape(rest)))
+        else:
+            page.append("<tr><th>{0}</th><td>{1}</td></tr>".format(html.escape(field),html.escape(value)))
+    page.append("</tbody></table>")
+
+    page += ['<div class="footer"><span>{0}</span><p>{1}</p></div>'.format(index,"dolor sit amet "*20)
+             for index in range(filler-filler//2)]
+    page.append("</body></html>")
+
+    return("\n".join(page))
+
+#Synthetic pages for when there aren't any saved ones
+def syntheticPages(count=20):
+    pages = {}
+
+    for index in range(count):
+        partNum = "BENCH{0:04d}-ND".format(index)
+        pages[partNum] = makeProductPage({"Supplier Part Number 1":partNum,
+                                          "Manufacturer 1":"Murata Electronics North America",
+                                          "Manufacturer Part Number 1":"GRM188R71E{0:03d}KA01D".format(index),
+                                          "Description":"CAP CER 0.1UF 25V X7R 0603",
+                                          "Capacitance":"0.1µF",
+                                          "Categories":"Capacitors - Ceramic Capacitors",
+                                          "Package / Case":"0603 (1608 Metric)",
+                                          "Size / Dimension":'0.063\\" L x 0.031\\" W (1.60mm x 0.80mm)',
+                                          "Temperature Coefficient":"X7R",
+                                          "Tolerance":"±10%",
+                                          "Voltage - Rated":"25V"})
+
+    return(pages)
+
+#Part families of the pipeline corpus: (name, function of the part's index that returns its productAttrDict)
+#Values are swept so the parts get different names and aren't skipped as duplicates of each other
+def fixtureCap(index):
+    value = ["1.0","1.5","2.2","3.3","4.7","6.8"][index%6]
+    unit = ["p","n","µ"][index//6%3]
+    package = ["0402 (1005 Metric)","0603 (1608 Metric)","0805 (2012 Metric)"][index//18%3]
+    return({"Capacitance":"{0}{1}F".format(value,unit),
+            "Categories":"Capacitors - Ceramic Capacitors",
+            "Description":"CAP CER {0}{1}F 63V X7S {2}".format(value,unit.replace("µ","U").upper(),package[:4]),
+            "Manufacturer Part Number 1":"GRMF{0:04d}".format(index),
+            "Package / Case":package,
+            "Size / Dimension":'0.063\\" L x 0.031\\" W (1.60mm x 0.80mm)',
+            "Temperature Coefficient":"X7S",
+            "Tolerance":["±10%","±20%"][index//54%2],
+            "Voltage - Rated":"{0}V".format([63,100,200][index//108%3])})
+
+def fixtureRes(index):
+    value = ["1.02","1.27","1.58","1.96","2.43","3.01","3.74","4.64","5.76","7.15"][index%10]
+    unit = ["","k","M"][index//10%3]
+    return({"Resistance":"{0} {1}Ohms".format(value,unit),
+            "Categories":"Resistors - Chip Resistor - Surface Mount",
+            "Description":"RES SMD {0}{1} OHM 0.5% 1/16W".format(value,unit.upper()),
+            "Manufacturer Part Number 1":"ERJF{0:04d}".format(index),
+            "Package / Case":["0402 (1005 Metric)","0603 (1608 Metric)"][index//30%2],
+            "Power (Watts)":"0.063W, 1/16W",
+            "Tolerance":["±0.5%","±0.25%"][index//60%2],
+            "Composition":"Thin Film"})
+
+def fixtureInd(index):
+    value = ["1.2","1.8","2.7","3.9","5.6","8.2"][index%6]
+    unit = ["n","µ"][index//6%2]
+    return({"Inductance":"{0}{1}H".format(value,unit),
+            "Categories":"Inductors, Coils, Chokes - Fixed Inductors",
+            "Description":"FIXED IND {0}{1}H 0603".format(value,unit.replace("µ","U").upper()),
+            "Manufacturer Part Number 1":"LQMF{0:04d}".format(index),
+            "Package / Case":["0603 (1608 Metric)","0805 (2012 Metric)"][index//12%2],
+            "Tolerance":"±{0}%".format([5,10,20][index//24%3]),
+            "Current Rating":"{0}mA".format(170+10*(index//72))})
+
+def fixtureFerrite(index):
+    return({"Impedance @ Frequency":"{0} Ohms @ 100MHz".format([33,47,68,120,220,330,470,680,1000][index%9]),
+            "Categories":"Filters - Ferrite Beads and Chips",
+            "Description":"FERRITE BEAD 0603 1LN",
+            "Manufacturer Part Number 1":"BLMF{0:04d}".format(index),
+            "Package / Case":["0402 (1005 Metric)","0603 (1608 Metric)"][index//9%2],
+            "Current Rating (Max)":"{0}mA".format(150+25*(index//18)),
+            "DC Resistance (DCR) (Max)":"300 mOhm"})
+
+def fixtureFet(index):
+    return({"Categories":"Discrete Semiconductor Products - Transistors - FETs, MOSFETs - Single",
+            "Description":"MOSFET N-CH {0}V {1}A SOT23".format(20+10*(index%5),1+index%4),
+            "Manufacturer Part Number 1":"FETF{0:04d}".format(index),
+            "Package / Case":"TO-236-3, SC-59, SOT-23-3",
+            "FET Type":"N-Channel",
+            "Drain to Source Voltage (Vdss)":"{0}V".format(20+10*(index%5)),
+            "Current - Continuous Drain (Id) @ 25°C":"{0}A (Ta)".format(1+index%4),
+            "Rds On (Max) @ Id, Vgs":"{0} mOhm @ 1A, 4.5V".format(30+index)})
+
+def fixtureDiode(index):
+    return({"Categories":"Discrete Semiconductor Products - Diodes - Rectifiers - Single",
+            "Description":"DIODE SCHOTTKY {0}V 1A SOD123".format(20+20*(index%4)),
+            "Manufacturer Part Number 1":"DIOF{0:04d}".format(index),
+            "Package / Case":"SOD-123",
+            "Diode Type":"Schottky",
+            "Voltage - DC Reverse (Vr) (Max)":"{0}V".format(20+20*(index%4)),
+            "Current - Average Rectified (Io)":"1A",
+            "Voltage - Forward (Vf) (Max) @ If":"{0}mV @ 1A".format(390+index)})
+
+def fixtureCrystal(index):
+    frequency = ["8","12","16","20","24","25","32"][index%7]
+    return({"Categories":"Crystals, Oscillators, Resonators - Crystals",
+            "Description":"CRYSTAL {0}.0000MHZ 18PF SMD".format(frequency),
+            "Manufacturer Part Number 1":"XTLF{0:04d}".format(index),
+            "Package / Case":"4-SMD, No Lead",
+            "Frequency":"{0}MHz".format(frequency),
+            "Frequency Tolerance":"±{0}ppm".format(10+index%3*10),
+            "Load Capacitance":"18pF"})
+
+fixtureFamilies = [("cap",fixtureCap),
+                   ("res",fixtureRes),
+                   ("ind",fixtureInd),
+                   ("ferrite",fixtureFerrite),
+                   ("fet",fixtureFet),
+                   ("diode",fixtureDiode),
+                   ("crystal",fixtureCrystal)]
+
+#Product pages for "count" parts of each fixture family; returns {part number: webpage}
+def fixtureCorpus(count):
+    pages = {}
+
+    for family, makeAttrs in fixtureFamilies:
+        for index in range(count):
+            partNum = "BENCH-{0}{1:04d}-ND".format(family.upper(),index)
+            productAttrDict = makeAttrs(index)
+            productAttrDict.update({"Supplier Part Number 1":partNum,"Manufacturer 1":"Bench Components"})
+            pages[partNum] = makeProductPage(productAttrDict)
+
+    return(pages)
+
+#Synthetic product and fixed attributes for render benchmarks
+def syntheticParts(count):
+    parts = []
+
+    for index in range(count):
+        productAttrDict = {"Capacitance":"{0}pF".format(index%1000+1),
+                           "Categories":"Capacitors - Ceramic Capacitors",
+                           "Description":"CAP CER {0}PF 50V C0G/NP0 0402".format(index%1000+1),
+                           "Manufacturer 1":"Murata Electronics North America",
+                           "Manufacturer Part Number 1":"GRM1555C1H{0:06d}".format(index),
+                           "Package / Case":"0402 (1005 Metric)",
+                           "Size / Dimension":'0.039\\" L x 0.020\\" W (1.00mm x 0.50mm)',
+                           "Supplier 1":"Digi-Key",
+                           "Supplier Part Number 1":"BENCH{0:06d}-ND".format(index),
+                           "Temperature Coefficient":"C0G, NP0",
+                           "Tolerance":"±5%",
+                           "Voltage - Rated":"50V"}
+        fixedAttrDict = {"Reference":"C",
+                         "Value":"C_{0}p0_5%_50V_NP0_0402".format(index%1000+1),
+                         "Footprint":"SFUSat-cap:C_0402",
+                         "Datasheet":""}
+        parts.append((productAttrDict,fixedAttrDict))
+
+    return(parts)
+
+#makeLibPart as it was before templates were compiled, kept as the reference for the render benchmark
+def legacyMakeLibPart(productAttrDict,fixedAttrDict,attrConfig,symbolShape):
+    dataToWrite = []
+    attributeNum = 4    #F4 is the first optional attribute
+
+    dataToWrite.append("# \n# {0}\n#".format(fixedAttrDict["Value"])) #header
+    dataToWrite.append("DEF {0} {1} 0 {2} {3} {4} {5} {6} {7}".format(fixedAttrDict["Value"], #part definition
+                                                                      fixedAttrDict["Reference"],
+                                                                      attrConfig['name']['textOffset'],
+                                                                      attrConfig['name']['drawPinnumber'],
+                                                                      attrConfig['name']['drawPinname'],
+                                                                      attrConfig['name']['unitCount'],
+                                                                      attrConfig['name']['unitsLocked'],
+                                                                      attrConfig['name']['optionFlag']))
+
+    for fieldNum, fieldKey, configKey in [(0,"Reference","ref"),(1,"Value","val"),(2,"Footprint","other"),(3,"Datasheet","other")]:
+        dataToWrite.append('F{0} "{1}" {2} {3} {4} {5} {6} {7} {8}'.format(fieldNum,
+                                                                          fixedAttrDict[fieldKey],
+                                                                          attrConfig[configKey]['posx'],
+                                                                          attrConfig[configKey]['posy'],
+                                                                          attrConfig[configKey]['textSize'],
+                                                                          attrConfig[configKey]['textOrient'],
+                                                                          attrConfig[configKey]['visible'],
+                                                                          attrConfig[configKey]['hTextJustify'],
+                                                                          attrConfig[configKey]['vTextJustify']))
+
+    for key, value in sorted(productAttrDict.items()):
+        #put the description into the description file instead
+        if not key == "Description":
+            dataToWrite.append('F{0} "{1}" {2} {3} {4} {5} {6} {7} {8} "{9}"'.format(attributeNum,
+                                                                                     value,
+                                                                                     attrConfig['other']['posx'],
+                                                                                     attrConfig['other']['posy'],
+                                                                                     attrConfig['other']['textSize'],
+                                                                                     attrConfig['other']['textOrient'],
+                                                                                     attrConfig['other']['visible'],
+                                                                                     attrConfig['other']['hTextJustify'],
+                                                                                     attrConfig['other']['vTextJustify'],
+                                                                                     key))
+        attributeNum += 1
+
+    dataToWrite.append(symbolShape)
+    dataToWrite.append("ENDDEF")
+
+    return dataToWrite
+
+#Write a netlist shaped like EESCHEMA's with "count" components placed from the symbols in the part libraries
+#Every 5th component is missing its supplier fields (for the join) and every 50th has no fields at all
+def syntheticNetlist(netlistPath,count):
+    from kicadLibPopBom import supplierFields
+    from kicadLibPopLib import Library
+
+    symbols = []
+    for libName in ("SFUSat-cap","SFUSat-res","SFUSat-ind"):
+        library = Library(os.path.join(dirName,libName+".lib")).load()
+        symbols += [(libName,library.symbols[name]) for name in list(library.symbols)[:40]]
+        library.close()
+
+    with open(netlistPath,"w",encoding="utf-8") as netlistFile:
+        netlistFile.write('<?xml version="1.0" encoding="utf-8"?>\n<export version="D">\n  <design>\n'
+                          '    <source>bench.sch</source>\n    <tool>Eeschema 4.0.7</tool>\n  </design>\n  <components>\n')
+
+        for index in range(count):
+            libName, symbol = symbols[index%len(symbols)]
+            ref = "{0}{1}".format(symbol.reference or "U",index+1)
+            fields = {name:text.replace('\\"','"') for name, text in symbol.namedFields().items()}
+            if index%5 == 4:
+                fields = {name:text for name, text in fields.items() if not name in supplierFields}
+
+            netlistFile.write('    <comp ref={0}>\n      <value>{1}</value>\n      <footprint>{2}</footprint>\n'.format(
+                              quoteattr(ref),escape(symbol.name),escape(symbol.footprint)))
+            if index%50 != 49:
+                netlistFile.write("      <fields>\n"+"".join('        <field name={0}>{1}</field>\n'.format(quoteattr(name),escape(text))
+                                                          for name, text in fields.items())+"      </fields>\n")
+            netlistFile.write('      <libsource lib={0} part={1}/>\n      <sheetpath names="/" tstamps="/"/>\n'
+                              '      <tstamp>{2:08X}</tstamp>\n    </comp>\n'.format(quoteattr(libName),quoteattr(symbol.name),index))
+
+        netlistFile.write("  </components>\n  <libparts>\n")
+        for libName, symbol in symbols:
+            netlistFile.write('    <libpart lib={0} part={1}>\n      <fields>\n        <field name="Reference">{2}</field>\n'
+                              '        <field name="Value">{3}</field>\n      </fields>\n      <pins>\n'
+                              '        <pin num="1" name="~" type="passive"/>\n        <pin num="2" name="~" type="passive"/>\n'
+                              '      </pins>\n    </libpart>\n'.format(quoteattr(libName),quoteattr(symbol.name),
+                                                                       escape(symbol.reference),escape(symbol.name)))
+
+        netlistFile.write("  </libparts>\n  <nets>\n")
+        for net in range(count//2):
+            netlistFile.write('    <net code="{0}" name="Net-{0}">\n'.format(net+1)+
+                              "".join('      <node ref="X{0}" pin="{1}"/>\n'.format(net*2+node,node%2+1) for node in range(3))+
+                              "    </net>\n")
+        netlistFile.write("  </nets>\n</export>\n")
+
+#bom2csvSFUsat.xsl transcribed with ElementTree, kept as the reference for the BOM benchmark
+#Like the XSL it loads the whole netlist and, for every component, goes through its fields once per header field
+#(the header itself is only worked out once; xsltproc works it out again for every component)
+def legacyBom(netlistPath):
+    root = ElementTree.parse(netlistPath).getroot()
+
+    firstFields = {} #key('headentr',@name)[1]
+    for field in root.iter("field"):
+        firstFields.setdefault(field.get("name"),field)
+    heads = [field.get("name") for field in root.findall("components/comp/fields/field") if firstFields[field.get("name")] is field]
+
+    def valueOf(element):
+        return("".join(element.itertext()) if element is not None else "")
+
+    output = ["Reference, Value, Footprint, Datasheet"+"".join(", "+name for name in heads)+"\r\n"]
+    for comp in root.findall("components/comp"):
+        row = '"{0}","{1}","{2}","{3}"'.format(comp.get("ref",""),valueOf(comp.find("value")),
+                                               valueOf(comp.find("footprint")),valueOf(comp.find("datasheet")))
+        for fields in comp.findall("fields"):
+            fieldvar = fields.findall("field")
+            for name in heads:
+                row += ',"'
+                for field in fieldvar:
+                    if field.get("name") == name:
+                        row += valueOf(field)
+                row += '"'
+        output.append(row+"\r\n")
+
+    return("".join(output))
+
+###############################################################################
+### BENCHMARKS ###
+###############################################################################
+#Time func(*args) over "repeat" runs; returns (mean seconds, peak bytes, result)
+def measure(func,args,repeat):
+    gc.collect()
+    start = time.perf_counter()
+    for run in range(repeat):
+        result = func(*args)
+    elapsed = (time.perf_counter()-start)/repeat
+
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return(elapsed,peak,result)
+
+#Parse a page and pull out both product tables
+def parseTables(webpage,backend):
+    doc = kicadLibPopParse.parsePage(webpage,backend)
+    return([[(dict(rowAttrs),headers,cells) for rowAttrs, headers, cells in kicadLibPopParse.getTableRows(doc,tableId)]
+            for tableId in kicadLibPopParse.productTableIds])
+
+def benchParse(pages,backends,repeat):
+    results = {}
+    reference = None
+
+    for backend in backends:
+        try:
+            totalTime = 0.0
+            maxPeak = 0
+            tables = {}
+            for name, webpage in pages.items():
+                elapsed, peak, tables[name] = measure(parseTables,(webpage,backend),repeat)
+                totalTime += elapsed
+                maxPeak = max(maxPeak,peak)
+        except ImportError as error:
+            print("{0:10} skipped ({1})".format(backend,error))
+            continue
+
+        if reference is None:
+            reference = (backend,tables)
+            mismatches = 0
+        else:
+            mismatches = sum(1 for name in pages if tables[name] != reference[1][name])
+
+        results[backend] = {"meanParseTime":totalTime/len(pages),
+                            "peakMemory":maxPeak,
+                            "mismatches":mismatches}
+
+        print("{0:10} {1:8.2f} ms/page {2:8.1f} KiB peak {3}".format(backend,
+                                                                   1000*totalTime/len(pages),
+                                                                   maxPeak/1024,
+                                                                   "" if not mismatches else "{0} pages differ from {1}".format(mismatches,reference[0])))
+
+    return(results)
+
+def benchRender(count):
+    import kicadLibPop
+
+    parts = syntheticParts(count)
+    attrConfig = kicadLibPop.capAttrConfig
+    symbolShape = kicadLibPop.capSymbolShape
+    results = {}
+
+    for name, func in [("legacy",legacyMakeLibPart),("template",kicadLibPop.makeLibPart)]:
+        gc.collect()
+        start = time.perf_counter()
+        rendered = [func(productAttrDict,fixedAttrDict,attrConfig,symbolShape) for productAttrDict, fixedAttrDict in parts]
+        elapsed = time.perf_counter()-start
+
+        results[name] = {"seconds":elapsed,"partsPerSecond":count/elapsed,"output":rendered}
+        print("{0:10} {1:8.1f} ms for {2} parts ({3:,.0f} parts/s)".format(name,1000*elapsed,count,count/elapsed))
+
+    same = results["legacy"]["output"] == results["template"]["output"]
+    print("speedup {0:.1f}x, output {1}".format(results["legacy"]["seconds"]/results["template"]["seconds"],
+                                                "identical" if same else "DIFFERENT"))
+
+    return(same)
+
+#Fetch synthetic pages from a FixtureServer that injects latency and errors
+def benchFetch(count,latency,errorRate,timeout,retries,concurrency,pool=True):
+    from kicadLibPopFetch import CircuitBreaker, CircuitOpen, FetchError, FixtureServer, HttpSession, RetryPolicy
+    from kicadLibPopFetch import fetchAll, fetchUrl
+
+    pages = syntheticPages(count)
+    policy = RetryPolicy(retries,timeout,baseDelay=0.01,maxDelay=0.5,seed=1)
+    breaker = CircuitBreaker(threshold=5,resetTime=1.0)
+    session = HttpSession(concurrency,timeout) if pool else None
+
+    with FixtureServer(pages,latency=latency,errorRate=errorRate,seed=1,compress=True) as server:
+        #Returns the page, or the FetchError it failed with
+        def fetch(partNum):
+            try:
+                return(fetchUrl(server.urlTemplate.format(partNum),policy,breaker,session=session))
+            except FetchError as error:
+                return(error)
+
+        start = time.perf_counter()
+        results = {partNum:result for index, partNum, result in fetchAll(list(pages),fetch,concurrency)}
+        elapsed = time.perf_counter()-start
+
+    intact = sum(1 for partNum, result in results.items() if result == pages[partNum])
+    stopped = sum(1 for result in results.values() if isinstance(result,CircuitOpen))
+    gaveUp = sum(1 for result in results.values() if isinstance(result,FetchError))-stopped
+    wrong = len(results)-intact-stopped-gaveUp
+
+    print("{0} pages in {1:.2f} s: {2} intact, {3} given up on, {4} stopped by the breaker ({5} trips), {6} wrong".format(
+          count,elapsed,intact,gaveUp,stopped,breaker.trips,wrong))
+    print("{0} requests over {1} connections, {2} injected failures".format(server.requestCount,
+                                                                          server.connectionCount,
+                                                                          server.errorCount))
+    if session is not None:
+        session.close()
+        print("mean ms per request: DNS {dns:.2f}, connect {connect:.2f}, first byte {ttfb:.2f}, "
+              "transfer {transfer:.2f}; {bytes:,} bytes received".format(**session.stats()))
+
+    return(wrong == 0)
+
+#Export the BOM of a synthetic netlist every way there is; returns whether they agree
+def benchBom(count,repeat):
+    from kicadLibPopBom import Bom, SupplierJoin
+
+    workDir = tempfile.mkdtemp(prefix="kicadLibPopBench")
+    try:
+        netlistPath = os.path.join(workDir,"bench.xml")
+        syntheticNetlist(netlistPath,count)
+        print("{0} components, {1:.1f} MiB netlist".format(count,os.path.getsize(netlistPath)/2**20))
+
+        #Export with kicadLibPopBom; returns (BOM text, rows)
+        def streamBom(group=False,join=False):
+            bom = Bom(group,SupplierJoin(dirName) if join else None).read(netlistPath)
+            outFile = io.StringIO(newline="")
+            bom.write(outFile)
+            return(outFile.getvalue(),len(outFile.getvalue().splitlines())-1)
+
+        results = {}
+        for name, func, args in [("legacy",lambda:(legacyBom(netlistPath),count),()),
+                                 ("stream",streamBom,()),
+                                 ("grouped",streamBom,(True,)),
+                                 ("joined",streamBom,(False,True))]:
+            elapsed, peak, (text, rows) = measure(func,args,repeat)
+            results[name] = text
+            print("{0:10} {1:8.1f} ms {2:8.1f} MiB peak {3:8,} rows".format(name,1000*elapsed,peak/2**20,rows))
+
+        same = results["stream"] == results["legacy"]
+
+        if shutil.which("xsltproc"):
+            csvPath = os.path.join(workDir,"bench.csv")
+            start = time.perf_counter()
+            subprocess.run(["xsltproc","-o",csvPath,os.path.join(dirName,"bom2csvSFUsat.xsl"),netlistPath],check=True)
+            print("{0:10} {1:8.1f} ms".format("xsltproc",1000*(time.perf_counter()-start)))
+
+            with open(csvPath,"r",encoding="utf-8",newline="") as csvFile:
+                xslSame = csvFile.read() == results["stream"]
+            print("output {0} xsltproc's".format("identical to" if xslSame else "DIFFERENT from"))
+            same = same and xslSame
+        else:
+            print("xsltproc isn't installed, so the XSL itself wasn't timed")
+    finally:
+        shutil.rmtree(workDir,ignore_errors=True)
+
+    print("output {0} legacyBom's".format("identical to" if results["stream"] == results["legacy"] else "DIFFERENT from"))
+
+    return(same)
+
+###############################################################################
+### PIPELINE ###
+###############################################################################
+#Copy what an import needs (scripts, libraries and footprint libraries) to runDir
+#The footprint libraries are only read, so they're linked rather than copied where the OS allows it
+def makeRunDir(runDir):
+    for pattern in ("*.py","*.lib","*.dcm"):
+        for filepath in glob.glob(os.path.join(dirName,pattern)):
+            shutil.copy2(filepath,runDir)
+
+    for prettyPath in glob.glob(os.path.join(dirName,"*.pretty")):
+        try:
+            os.symlink(prettyPath,os.path.join(runDir,os.path.basename(prettyPath)),target_is_directory=True)
+        except OSError:
+            shutil.copytree(prettyPath,os.path.join(runDir,os.path.basename(prettyPath)))
+
+#Run a command with its output going to logPath; returns (exit code, peak RSS in bytes or None if the OS can't say)
+def runMeasured(command,cwd,logPath):
+    with open(logPath,"wb") as logFile:
+        process = subprocess.Popen(command,cwd=cwd,stdout=logFile,stderr=subprocess.STDOUT)
+
+        if not hasattr(os,"wait4"): #Windows
+            return(process.wait(),None)
+
+        pid, status, usage = os.wait4(process.pid,0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    peakRss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss*1024 #bytes on macOS, KiB elsewhere
+
+    return(process.returncode,peakRss)
+
+#Import the pages once in a fresh copy of the libraries; returns (the import's run report, peak RSS)
+def runImport(pages,parser=None):
+    from kicadLibPopCache import PageCache
+
+    runDir = tempfile.mkdtemp(prefix="kicadLibPopBench")
+    try:
+        makeRunDir(runDir)
+
+        pageCache = PageCache(os.path.join(runDir,".cache","pages"),ttl=None,maxBytes=None)
+        for partNum, webpage in pages.items():
+            pageCache.put(partNum,webpage)
+
+        with open(os.path.join(runDir,"parts.txt"),"w",encoding="utf-8") as partsFile:
+            partsFile.write("\n".join(pages)+"\n")
+
+        reportPath = os.path.join(runDir,"report.json")
+        command = [sys.executable,"kicadLibPop.py","import","--cache-mode","offline","--restart","--report",reportPath]
+        if parser:
+            command += ["--parser",parser]
+
+        exitCode, peakRss = runMeasured(command+["parts.txt"],runDir,os.path.join(runDir,"import.log"))
+
+        try:
+            with open(reportPath,"r",encoding="utf-8") as reportFile:
+                report = json.load(reportFile)
+        except (OSError, ValueError):
+            report = None
+
+        if exitCode or (report is None):
+            with open(os.path.join(runDir,"import.log"),"r",encoding="utf-8",errors="replace") as logFile:
+                raise RuntimeError("The import failed (exit code {0}):\n{1}".format(exitCode,logFile.read()[-2000:]))
+    finally:
+        shutil.rmtree(runDir,ignore_errors=True)
+
+    return(report,peakRss)
+
+#Value at a fraction (0 to 1) of the way through a list of numbers, interpolated between neighbours
+def percentile(values,fraction):
+    values = sorted(values)
+    position = (len(values)-1)*fraction
+    lower = int(position)
+    upper = min(lower+1,len(values)-1)
+
+    return(values[lower]+(values[upper]-values[lower])*(position-lower))
+
+#Put the reports of several runs together: median throughput, stage percentiles, outcomes and peak RSS
+def summarizeRuns(reports,peakRsses):
+    throughputs = []
+    partStages = {} #stage -> [seconds of every part in every run]
+    runTotals = {} #stage -> [seconds per run]
+    outcomes = {}
+
+    for report in reports:
+        throughputs.append(len(report["parts"])/report["wallSeconds"])
+
+        for name, stage in report["stages"].items():
+            runTotals.setdefault(name,[]).append(stage["seconds"])
+
+        for record in report["parts"]:
+            outcomes[record["outcome"]] = outcomes.get(record["outcome"],0)+1
+            for name, seconds in record["stages"].items():
+                partStages.setdefault(name,[]).append(seconds)
+
+    stages = {}
+    for name in sorted(runTotals,key=lambda name:-sum(runTotals[name])):
+        stages[name] = {"secondsPerRun":sum(runTotals[name])/len(reports)}
+
+        if name in partStages:
+            samples = partStages[name]
+            stages[name].update({"samples":len(samples),
+                                 "p50Ms":1000*percentile(samples,0.5),
+                                 "p90Ms":1000*percentile(samples,0.9),
+                                 "p99Ms":1000*percentile(samples,0.99),
+                                 "maxMs":1000*max(samples)})
+
+    peakRsses = [peakRss for peakRss in peakRsses if peakRss is not None]
+
+    return({"runs":len(reports),
+            "partsPerSecond":percentile(throughputs,0.5),
+            "runSeconds":[report["wallSeconds"] for report in reports],
+            "peakRssBytes":max(peakRsses) if peakRsses else None,
+            "outcomes":outcomes,
+            "stages":stages})
+
+#Regressions of the results against a baseline, as messages
+#A per-part stage only counts as slower if its percentile grew by more than minDeltaMs as well, since the fastest
+#ones take a few µs, and a batch stage (loading and writing the libraries) only if it grew by more than 1% of the
+#baseline's run time
+def findRegressions(results,baseline,tolerance,minDeltaMs=0.1):
+    regressions = []
+
+    if results["partsPerSecond"] < baseline["partsPerSecond"]*(1-tolerance):
+        regressions.append("throughput {0:.1f} parts/s, was {1:.1f}".format(results["partsPerSecond"],baseline["partsPerSecond"]))
+
+    if results["peakRssBytes"] and baseline.get("peakRssBytes") and \
+       (results["peakRssBytes"] > baseline["peakRssBytes"]*(1+tolerance)):
+        regressions.append("peak RSS {0:.1f} MiB, was {1:.1f}".format(results["peakRssBytes"]/2**20,baseline["peakRssBytes"]/2**20))
+
+    for name, stage in results["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+
+        if "p50Ms" in stage:
+            limits = {"p50Ms":minDeltaMs,"p90Ms":minDeltaMs}
+        else:
+            limits = {"secondsPerRun":0.01*percentile(baseline["runSeconds"],0.5)}
+
+        for key, minDelta in limits.items():
+            if (key in old) and (stage[key] > old[key]*(1+tolerance)) and (stage[key]-old[key] > minDelta):
+                regressions.append("{0} {1} {2:.3f}, was {3:.3f}".format(name,key,stage[key],old[key]))
+
+    return(regressions)
+
+def printResults(results):
+    print("{0:.1f} parts/s (median of {1} runs: {2} s), peak RSS {3}, outcomes {4}".format(
+          results["partsPerSecond"],
+          results["runs"],
+          ", ".join("{0:.2f}".format(seconds) for seconds in results["runSeconds"]),
+          "{0:.1f} MiB".format(results["peakRssBytes"]/2**20) if results["peakRssBytes"] else "unknown",
+          ", ".join("{0} {1}".format(count,outcome) for outcome, count in sorted(results["outcomes"].items()))))
+
+    print("{0:12} {1:>10} {2:>9} {3:>9} {4:>9} {5:>9}".format("stage","s/run","p50 ms","p90 ms","p99 ms","max ms"))
+    for name, stage in results["stages"].items():
+        print("{0:12} {1:10.3f} ".format(name,stage["secondsPerRun"])+
+              " ".join("{0:9.3f}".format(stage[key]) if key in stage else "{0:>9}".format("-")
+                       for key in ("p50Ms","p90Ms","p99Ms","maxMs")))
+
+#Replay a corpus through whole imports and compare the results with the baseline; returns whether there was no regression
+def benchPipeline(pages,corpus,runs,parser,baselinePath,saveBaseline,tolerance):
+    reports = []
+    peakRsses = []
+
+    for run in range(runs):
+        report, peakRss = runImport(pages,parser)
+        reports.append(report)
+        peakRsses.append(peakRss)
+
+    results = summarizeRuns(reports,peakRsses)
+    results.update({"corpus":corpus,
+                    "parser":parser or "default",
+                    "python":platform.python_version(),
+                    "machine":platform.node(),
+                    "date":time.strftime("%Y-%m-%dT%H:%M:%S")})
+    printResults(results)
+
+    if saveBaseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baselinePath)),exist_ok=True)
+        with open(baselinePath,"w",encoding="utf-8") as baselineFile:
+            json.dump(results,baselineFile,ensure_ascii=False,indent=1)
+        print("Saved as the baseline in {0}".format(baselinePath))
+        return(True)
+
+    try:
+        with open(baselinePath,"r",encoding="utf-8") as baselineFile:
+            baseline = json.load(baselineFile)
+    except (OSError, ValueError):
+        print("No baseline in {0} to compare with (--save-baseline to keep these results)".format(baselinePath))
+        return(True)
+
+    for key in ("corpus","parser"):
+        if baseline.get(key) != results[key]:
+            print("Not compared with the baseline, its {0} was {1}, not {2}".format(key,baseline.get(key),results[key]))
+            return(True)
+
+    for key in ("python","machine"):
+        if baseline.get(key) != results[key]:
+            print("Warning: the baseline's {0} was {1}, not {2}".format(key,baseline.get(key),results[key]))
+
+    regressions = findRegressions(results,baseline,tolerance)
+    if regressions:
+        print("Regressions against the baseline of {0} (more than {1:.0%} worse):".format(baseline.get("date"),tolerance))
+        for regression in regressions:
+            print("  "+regression)
+    else:
+        print("No regressions against the baseline of {0}".format(baseline.get("date")))
+
+    return(not regressions)
+
+###############################################################################
+### COMMAND LINE ###
+###############################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="kicadLibPop benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    parseCmd = commands.add_parser("parse",help="compare the product page parser backends")
+    parseCmd.add_argument("--pages",default=defaultPageDir,help="directory of saved product pages")
+    parseCmd.add_argument("--repeat",type=int,default=5,help="runs per page")
+    parseCmd.add_argument("--backends",default=",".join(kicadLibPopParse.parserBackends))
+
+    renderCmd = commands.add_parser("render",help="compare makeLibPart with the original implementation")
+    renderCmd.add_argument("--parts",type=int,default=10000,help="number of synthetic parts to render")
+
+    fetchCmd = commands.add_parser("fetch",help="fetch pages from a local server that injects latency and errors")
+    fetchCmd.add_argument("--pages",type=int,default=200,help="number of synthetic pages")
+    fetchCmd.add_argument("--latency",default="0.005,0.05",help="seconds per response, or MIN,MAX for a random delay")
+    fetchCmd.add_argument("--error-rate",type=float,default=0.2,help="fraction of requests answered with 503")
+    fetchCmd.add_argument("--timeout",type=float,default=1.0,help="seconds before a request is retried")
+    fetchCmd.add_argument("--retries",type=int,default=5)
+    fetchCmd.add_argument("--concurrency",type=int,default=8)
+    fetchCmd.add_argument("--no-pool",action="store_true",help="open a new connection for every request")
+
+    pipelineCmd = commands.add_parser("pipeline",help="replay a corpus of product pages through whole imports")
+    pipelineCmd.add_argument("--parts",type=int,default=40,help="parts of each fixture family in the corpus")
+    pipelineCmd.add_argument("--pages",help="replay the saved product pages in this directory instead")
+    pipelineCmd.add_argument("--runs",type=int,default=3,help="imports to run")
+    pipelineCmd.add_argument("--parser",choices=list(kicadLibPopParse.parserBackends),help="parser backend to import with")
+    pipelineCmd.add_argument("--baseline",default=defaultBaselinePath,help="baseline results to compare with")
+    pipelineCmd.add_argument("--save-baseline",action="store_true",help="save the results as the baseline")
+    pipelineCmd.add_argument("--tolerance",type=float,default=0.2,help="how much worse than the baseline is a regression")
+
+    bomCmd = commands.add_parser("bom",help="compare the streaming BOM export with bom2csvSFUsat.xsl")
+    bomCmd.add_argument("--components",type=int,default=20000,help="components in the synthetic netlist")
+    bomCmd.add_argument("--repeat",type=int,default=3,help="runs per exporter")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "parse":
+        pages = loadPages(args.pages)
+        if not pages:
+            print("No saved pages in {0}, using synthetic pages".format(args.pages))
+            pages = syntheticPages()
+
+        results = benchParse(pages,args.backends.split(","),args.repeat)
+        return(0 if all(result["mismatches"] == 0 for result in results.values()) else 1)
+
+    if args.command == "render":
+        return(0 if benchRender(args.parts) else 1)
+
+    if args.command == "fetch":
+        latency = tuple(float(value) for value in args.latency.split(","))
+        latency = latency[0] if len(latency) == 1 else latency
+        return(0 if benchFetch(args.pages,latency,args.error_rate,args.timeout,args.retries,args.concurrency,
+                                 not args.no_pool) else 1)
+
+    if args.command == "bom":
+        return(0 if benchBom(args.components,args.repeat) else 1)
+
+    if args.command == "pipeline":
+        if args.pages:
+            pages = {unquote(name):webpage for name, webpage in loadPages(args.pages).items()}
+            corpus = {"pages":os.path.abspath(args.pages),"parts":len(pages)}
+        else:
+            pages = fixtureCorpus(args.parts)
+            corpus = {"families":[family for family, makeAttrs in fixtureFamilies],"partsPerFamily":args.parts}
+
+        if not pages:
+            print("No saved pages in {0}".format(args.pages))
+            return(1)
+
+        return(0 if benchPipeline(pages,corpus,args.runs,args.parser,args.baseline,args.save_baseline,args.tolerance) else 1)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+BOM export for kicadLibPop.py
+
+Turns an EESCHEMA XML netlist into the same CSV BOM as bom2csvSFUsat.xsl:
+a header of "Reference, Value, Footprint, Datasheet" and every field name used
+by any component (in the order they first appear), then one row per
+component with every cell in quotation marks and CRLF line endings. A
+component without a fields section only gets the first four cells, and
+quotation marks inside values aren't escaped, exactly like the XSL.
+
+The netlist is streamed with iterparse and each component is thrown away
+once it's been read, and reading stops at the end of the components section,
+so the libparts and nets sections (most of a netlist) aren't even parsed. The
+field names are collected in the same pass, and each cell is a dictionary
+lookup, so the export takes time linear in the number of components rather
+than components times fields.
+
+Options the XSL doesn't have:
+group - one row per set of identical parts (same value, footprint, datasheet
+        and fields), with the references joined in natural order
+        ("C1, C2, C10") and a Quantity column after Reference.
+join  - fill in the supplier fields ("Supplier Part Number 1",
+        "Manufacturer Part Number 1", ...) that a component is missing from
+        its symbol in the libraries kicadLibPop.py writes, found by the
+        netlist's libsource. Parts placed before their symbols had supplier
+        fields, or whose fields were deleted in the schematic, still end up
+        in the BOM with part numbers.
+
+KiCAD can run it as a BOM plugin:
+python "path/to/kicadLibPop.py" bom "%I" -o "%O.csv"
+"""
+
+import os
+import re
+
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from kicadLibPopLib import Library
+
+headFields = ("Reference","Value","Footprint","Datasheet")
+
+#Fields filled in from the libraries with join
+supplierFields = ("Supplier 1","Supplier Part Number 1","Manufacturer 1","Manufacturer Part Number 1")
+
+newline = "\r\n" #same as the XSL's &nl;
+
+#A component of the netlist; fields is {name: text} in netlist order, or None if it has no fields section
+Component = namedtuple("Component",["ref","value","footprint","datasheet","lib","part","fields"])
+
+###############################################################################
+### READING ###
+###############################################################################
+#Text of an element and everything in it, like xsl:value-of
+def elementText(element):
+    if element is None:
+        return("")
+    if not len(element):
+        return(element.text or "")
+
+    return("".join(element.itertext()))
+
+#Turn a <comp> element into a Component
+def readComponent(comp):
+    fieldsElement = comp.find("fields")
+    fields = None
+
+    if fieldsElement is not None:
+        fields = {}
+        for field in fieldsElement.iter("field"):
+            name = field.get("name","")
+            fields[name] = fields.get(name,"")+elementText(field) #the XSL prints every field with the name
+
+    libsource = comp.find("libsource")
+
+    return(Component(comp.get("ref",""),
+                     elementText(comp.find("value")),
+                     elementText(comp.find("footprint")),
+                     elementText(comp.find("datasheet")),
+                     libsource.get("lib","") if libsource is not None else "",
+                     libsource.get("part","") if libsource is not None else "",
+                     fields))
+
+#Components of a netlist (path or file object) in order, read one at a time
+#Everything is thrown away as soon as it's been read, so memory doesn't grow with the netlist, and the rest of the
+#netlist isn't read once the components section ends
+def iterComponents(source):
+    path = [] #elements from the root to the current one
+
+    for event, element in ElementTree.iterparse(source,events=("start","end")):
+        if event == "start":
+            path.append(element)
+            continue
+
+        path.pop()
+        depth = len(path)
+
+        if (depth == 2) and (element.tag == "comp") and (path[1].tag == "components") and (path[0].tag == "export"):
+            yield(readComponent(element))
+
+        if depth == 2: #whole component
+            path[1].remove(element)
+        elif (depth == 1) and (element.tag == "components"):
+            return
+        elif depth == 1: #whole section before the components
+            path[0].remove(element)
+
+###############################################################################
+### SUPPLIER FIELDS ###
+###############################################################################
+class SupplierJoin:
+    def __init__(self,libDir,fields=supplierFields):
+        self.libDir = libDir
+        self.fields = fields
+
+        self.libraries = {} #library nickname -> Library, or None if there's no such file
+        self.symbolFields = {} #(library, part) -> {field: text} of the supplier fields the symbol has
+        self.filled = 0 #components that had fields filled in
+
+    def library(self,lib):
+        if not lib in self.libraries:
+            libPath = os.path.join(self.libDir,lib+".lib")
+            self.libraries[lib] = Library(libPath).load() if os.path.isfile(libPath) else None
+
+        return(self.libraries[lib])
+
+    #Supplier fields of a library symbol, with the quotation marks the library escapes unescaped like KiCAD does
+    def lookup(self,lib,part):
+        key = (lib,part)
+
+        if not key in self.symbolFields:
+            library = self.library(lib) if lib else None
+            fields = {}
+
+            if (library is not None) and (part in library.symbols):
+                symbolFields = library.symbols[part].namedFields()
+                fields = {field:symbolFields[field].replace('\\"','"') for field in self.fields if symbolFields.get(field)}
+
+            self.symbolFields[key] = fields
+
+        return(self.symbolFields[key])
+
+    #The component with the supplier fields it's missing (or has empty) filled in from its symbol
+    def fill(self,component):
+        fields = component.fields or {}
+        missing = [field for field in self.fields if not fields.get(field)]
+        if not missing:
+            return(component)
+
+        symbolFields = self.lookup(component.lib,component.part)
+        additions = {field:symbolFields[field] for field in missing if field in symbolFields}
+        if not additions:
+            return(component)
+
+        self.filled += 1
+        fields = dict(fields)
+        fields.update(additions)
+
+        return(component._replace(fields=fields))
+
+    #Close the libraries that were opened
+    def close(self):
+        for library in self.libraries.values():
+            if library is not None:
+                library.close()
+
+###############################################################################
+### WRITING ###
+###############################################################################
+#Sort key that puts C2 before C10
+def naturalKey(ref):
+    return([int(piece) if piece.isdigit() else piece for piece in re.split(r"(\d+)",ref)])
+
+class Bom:
+    def __init__(self,group=False,join=None):
+        self.group = group
+        self.join = join #SupplierJoin, or None
+
+        self.fieldNames = {} #field name -> column, in the order they first appear
+        self.rows = [] #(ref, value, footprint, datasheet, ((column, text), ...) or None)
+        self.strings = {} #one copy of each distinct text, since most of a BOM repeats
+
+    #Add a component, recording any field names it brings
+    def add(self,component):
+        if self.join is not None:
+            component = self.join.fill(component)
+
+        intern = self.strings.setdefault
+        cells = None
+
+        if component.fields is not None:
+            cells = []
+            for name, text in component.fields.items():
+                column = self.fieldNames.setdefault(name,len(self.fieldNames))
+                cells.append((column,intern(text,text)))
+            cells = tuple(cells)
+
+        self.rows.append((component.ref,intern(component.value,component.value),intern(component.footprint,component.footprint),
+                          intern(component.datasheet,component.datasheet),cells))
+
+    #Add every component of a netlist; returns self
+    def read(self,source):
+        for component in iterComponents(source):
+            self.add(component)
+
+        return(self)
+
+    def header(self):
+        names = list(headFields)
+        if self.group:
+            names.insert(1,"Quantity")
+
+        return(", ".join(names+list(self.fieldNames))+newline)
+
+    #Row text: the head cells, then a cell per field name if the part has a fields section
+    def formatRow(self,headCells,cells):
+        line = '"'+'","'.join(headCells)+'"'
+
+        if cells is not None:
+            texts = [""]*len(self.fieldNames)
+            for column, text in cells:
+                texts[column] = text
+            line += "".join(',"'+text+'"' for text in texts)
+
+        return(line+newline)
+
+    #Rows in netlist order, or one per group of identical parts in the order each group first appears
+    def lines(self):
+        if not self.group:
+            for ref, value, footprint, datasheet, cells in self.rows:
+                yield(self.formatRow((ref,value,footprint,datasheet),cells))
+            return
+
+        groups = {} #(value, footprint, datasheet, cells) -> references
+        for ref, value, footprint, datasheet, cells in self.rows:
+            groups.setdefault((value,footprint,datasheet,tuple(sorted(cells)) if cells is not None else None),[]).append(ref)
+
+        for (value, footprint, datasheet, cells), refs in groups.items():
+            refs.sort(key=naturalKey)
+            yield(self.formatRow((", ".join(refs),str(len(refs)),value,footprint,datasheet),cells))
+
+    #Write the BOM to a text file opened with newline=""
+    def write(self,outFile):
+        outFile.write(self.header())
+        for line in self.lines():
+            outFile.write(line)
+
+    def __len__(self):
+        return(len(self.rows))
+
+#Write the BOM of a netlist to a CSV file; returns the Bom
+def writeBom(netlistPath,csvPath,group=False,libDir=None):
+    join = SupplierJoin(libDir) if libDir else None
+    try:
+        bom = Bom(group,join).read(netlistPath)
+    finally:
+        if join is not None:
+            join.close()
+
+    with open(csvPath,"w",encoding="utf-8",newline="") as csvFile:
+        bom.write(csvFile)
+
+    return(bom)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Local caches for kicadLibPop.py
+
+PageCache keeps downloaded product pages on disk (gzip compressed, one file
+per part number) so re-running a BOM doesn't download every page again.
+Entries older than the TTL are fetched again, and the least recently used
+entries are evicted once the cache grows past its size cap. The access time
+of each file is set explicitly on every hit, so LRU order doesn't depend on
+how the filesystem is mounted.
+
+Cache modes:
+"normal"  - use cached pages when they're fresh, fetch otherwise
+"offline" - only use cached pages, never touch the network
+"refresh" - always fetch, then update the cache
+
+AttrStore keeps the parsed product attributes (the output of makeProdAttrs)
+in SQLite, keyed by supplier part number and parser schema version. A
+repeat import can skip both the download and the HTML parsing. The schema
+version is supplied by the caller; entries written with any other version are
+deleted when the store is opened.
+
+Checkpoint records how far an import got: which of its part numbers have
+been written to the libraries and which ones couldn't be fetched. It's saved
+after every chunk, so an import that was interrupted, or stopped because the
+supplier was failing, carries on from the last chunk it wrote when it's run
+again with the same input. Parts are recorded by part number rather than by
+position in the input, since MPNs are resolved again on the next run and may
+not resolve to the same list.
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from urllib.parse import quote, unquote
+
+cacheModes = ("normal","offline","refresh")
+
+#Raised in offline mode when a page isn't cached
+class CacheMiss(LookupError):
+    pass
+
+###############################################################################
+### PAGE CACHE ###
+###############################################################################
+class PageCache:
+    def __init__(self,cacheDir,ttl=7*24*3600,maxBytes=50*1024*1024,mode="normal"):
+        if mode not in cacheModes:
+            raise ValueError("Unknown cache mode '{0}'".format(mode))
+
+        self.cacheDir = cacheDir
+        self.ttl = ttl #seconds; None to never expire
+        self.maxBytes = maxBytes #None for no size cap
+        self.mode = mode
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+        self.totalBytes = None #worked out the first time the cache is written to
+
+    #Path of the cache file for a key
+    def entryPath(self,key):
+        return(os.path.join(self.cacheDir,"{0}.html.gz".format(quote(key,safe="-_."))))
+
+    #Cached page for a key, or None if there isn't a fresh one
+    def get(self,key):
+        entryPath = self.entryPath(key)
+
+        try:
+            fetched = os.path.getmtime(entryPath)
+            if (self.ttl is not None) and (time.time()-fetched > self.ttl):
+                return(None)
+
+            with gzip.open(entryPath,"rb") as entryFile:
+                page = entryFile.read().decode("utf-8")
+
+            os.utime(entryPath,(time.time(),fetched)) #mark as recently used
+        except (OSError, EOFError):
+            return(None)
+
+        return(page)
+
+    #Store a page for a key
+    def put(self,key,page):
+        os.makedirs(self.cacheDir,exist_ok=True)
+        entryPath = self.entryPath(key)
+        tempPath = "{0}.{1}.tmp".format(entryPath,threading.get_ident())
+
+        with gzip.open(tempPath,"wb") as entryFile:
+            entryFile.write(page.encode("utf-8"))
+
+        with self.lock:
+            if self.totalBytes is None:
+                self.totalBytes = sum(size for path, used, size in self.entries())
+
+            if os.path.exists(entryPath):
+                self.totalBytes -= os.path.getsize(entryPath)
+
+            os.replace(tempPath,entryPath)
+            self.totalBytes += os.path.getsize(entryPath)
+
+            self.evict()
+
+    #Fetch a page through the cache according to the cache mode
+    def getOrFetch(self,key,fetchFunc):
+        page = None if self.mode == "refresh" else self.get(key)
+
+        with self.lock:
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if page is not None:
+            return(page)
+
+        if self.mode == "offline":
+            raise CacheMiss("{0} is not in the page cache (offline mode)".format(key))
+
+        page = fetchFunc(key)
+        self.put(key,page)
+
+        return(page)
+
+    #(path,lastUsed,size) for every entry in the cache
+    def entries(self):
+        try:
+            fileNames = os.listdir(self.cacheDir)
+        except OSError:
+            return([])
+
+        entries = []
+        for fileName in fileNames:
+            if not fileName.endswith(".html.gz"):
+                continue
+
+            entryPath = os.path.join(self.cacheDir,fileName)
+            try:
+                stat = os.stat(entryPath)
+            except OSError:
+                continue
+            entries.append((entryPath,stat.st_atime,stat.st_size))
+
+        return(entries)
+
+    #Remove least recently used entries until the cache fits in maxBytes (call with the lock held)
+    def evict(self):
+        if (self.maxBytes is None) or (self.totalBytes <= self.maxBytes):
+            return
+
+        for entryPath, used, size in sorted(self.entries(),key=lambda entry: entry[1]):
+            if self.totalBytes <= self.maxBytes:
+                break
+
+            try:
+                os.remove(entryPath)
+            except OSError:
+                continue
+
+            self.totalBytes -= size
+            self.evictions += 1
+
+    #Keys of every cached page
+    def keys(self):
+        return([unquote(os.path.basename(entry[0])[:-len(".html.gz")]) for entry in self.entries()])
+
+    def stats(self):
+        return({"hits":self.hits,
+                "misses":self.misses,
+                "evictions":self.evictions})
+
+###############################################################################
+### PARSED ATTRIBUTE STORE ###
+###############################################################################
+class AttrStore:
+    def __init__(self,dbPath,schemaVersion):
+        self.dbPath = dbPath
+        self.schemaVersion = schemaVersion
+
+        self.hits = 0
+        self.misses = 0
+
+        dbDir = os.path.dirname(dbPath)
+        if dbDir:
+            os.makedirs(dbDir,exist_ok=True)
+
+        self.db = sqlite3.connect(dbPath)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS attrs ("
+                        "partNum TEXT NOT NULL, "
+                        "schemaVersion TEXT NOT NULL, "
+                        "stored REAL NOT NULL, "
+                        "attrs TEXT NOT NULL, "
+                        "PRIMARY KEY (partNum, schemaVersion))")
+
+        with self.db:
+            self.db.execute("DELETE FROM attrs WHERE schemaVersion != ?",(schemaVersion,)) #written by an older parser
+
+    #Stored productAttrDict for a part number, or None if there isn't one
+    def get(self,partNum):
+        row = self.db.execute("SELECT attrs FROM attrs WHERE partNum = ? AND schemaVersion = ?",
+                              (partNum,self.schemaVersion)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return(None)
+
+        self.hits += 1
+        return(json.loads(row[0]))
+
+    #Store a productAttrDict for a part number
+    def put(self,partNum,productAttrDict):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO attrs VALUES (?, ?, ?, ?)",
+                            (partNum,self.schemaVersion,time.time(),json.dumps(productAttrDict,ensure_ascii=False)))
+
+    def close(self):
+        self.db.close()
+
+    def stats(self):
+        return({"hits":self.hits,
+                "misses":self.misses})
+
+###############################################################################
+### IMPORT CHECKPOINT ###
+###############################################################################
+class Checkpoint:
+    def __init__(self,path,key):
+        self.path = path
+        self.key = key #identifies the import (its input); a checkpoint saved for another key is ignored
+
+        self.done = set() #part numbers from the input that have been dealt with
+        self.failed = [] #part numbers that couldn't be fetched, to try again first
+
+    #Read the saved checkpoint if it's for the same import
+    def load(self):
+        try:
+            with open(self.path,"r",encoding="utf-8") as checkpointFile:
+                data = json.load(checkpointFile)
+        except (OSError, ValueError):
+            return(self)
+
+        if (data.get("key") == self.key) and isinstance(data.get("done"),list): #not a checkpoint from before done was a list
+            self.done = set(data["done"])
+            self.failed = data["failed"]
+
+        return(self)
+
+    #Save the checkpoint (temp file then rename, so an interrupted save leaves the old one)
+    def save(self):
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        tempPath = self.path+".tmp"
+
+        with open(tempPath,"w",encoding="utf-8") as checkpointFile:
+            json.dump({"key":self.key,"done":sorted(self.done),"failed":self.failed},checkpointFile)
+
+        os.replace(tempPath,self.path)
+
+    #Remove the checkpoint once the import is finished
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    #Whether there's anything to resume
+    def __bool__(self):
+        return(bool(self.done or self.failed))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Library consistency checks for kicadLibPop.py
+
+scanLibrary reads a .lib file and its .dcm in one pass each and keeps only
+what the checks need: every DEF with its line number, footprint (F2) and pin
+numbers, and every $CMP with its line number. Libraries are scanned in
+separate processes, then checkScan goes through each scan once, with every
+check a dictionary or set lookup, so checking takes time linear in the size
+of the libraries.
+
+Rules (errors fail the check, warnings are only reported):
+duplicate-def          error    two DEFs with the same name in a library
+duplicate-description  error    two $CMPs with the same name in a .dcm
+missing-description    error    a symbol kicadLibPop.py made (one with a supplier
+                                part number) with no $CMP in the library's .dcm;
+                                a warning for symbols drawn by hand
+fix-this-name          error    a symbol name with the [FIX_THIS] placeholder
+                                makeFixedAttrs puts in for missing values
+missing-footprint      error    F2 names a .pretty library in the repository
+                                that doesn't have the footprint
+unknown-footprint      warning  F2 has no library nickname, or names a
+                                library that isn't in the repository
+orphan-description     warning  a $CMP with no symbol
+pin-pad-mismatch       warning  a symbol's pin count isn't its footprint's
+                                pad count (see FootprintGeometry)
+"""
+
+import os
+
+from collections import namedtuple
+
+from kicadLibPopLib import descName, fieldRegex, readText, supplierPartNumField
+
+fixThisMarker = "[FIX_THIS]"
+
+severities = ("error","warning")
+
+#A rule violation; line is the line number in file (starting at 1)
+Violation = namedtuple("Violation",["severity","rule","file","line","symbol","message"])
+
+###############################################################################
+### SCANNING ###
+###############################################################################
+#[(name, line number, footprint, pin numbers, whether it has a supplier part number)] of every symbol in the text
+#of a .lib file
+def scanLib(contents):
+    symbols = []
+    symbol = None
+
+    for lineNum, line in enumerate(contents.splitlines(),1):
+        if line.startswith("DEF "):
+            words = line.split()
+            symbol = [words[1] if len(words) > 1 else "",lineNum,"",set(),False]
+        elif symbol is None:
+            continue
+        elif line.startswith("F"):
+            match = fieldRegex.match(line)
+            if match and (match.group(1) == "2"):
+                symbol[2] = match.group(2)
+            elif match and (match.group(4) == supplierPartNumField) and match.group(2):
+                symbol[4] = True
+        elif line.startswith("X "):
+            words = line.split()
+            if len(words) > 2:
+                symbol[3].add(words[2])
+        elif line.startswith("ENDDEF"):
+            symbols.append(tuple(symbol))
+            symbol = None
+
+    return(symbols)
+
+#[(name, line number)] of every description in the text of a .dcm file
+def scanDcm(contents):
+    return([(line[5:].strip(),lineNum) for lineNum, line in enumerate(contents.splitlines(),1) if line.startswith("$CMP ")])
+
+#Scan a (library path, description path) pair; the description path may be None. Runs in a worker process.
+def scanLibrary(paths):
+    libPath, descPath = paths
+
+    return({"libPath":libPath,
+            "descPath":descPath,
+            "symbols":scanLib(readText(libPath)),
+            "descs":scanDcm(readText(descPath)) if descPath else None})
+
+###############################################################################
+### CHECKING ###
+###############################################################################
+#Violations in a library scan
+#footprintIndex is a FootprintIndex of the repository's .pretty libraries; footprintGeometry (a FootprintGeometry)
+#can be None to skip comparing pin and pad counts
+def checkScan(scan,footprintIndex,footprintGeometry=None):
+    violations = []
+    libFile = os.path.basename(scan["libPath"])
+    descFile = os.path.basename(scan["descPath"]) if scan["descPath"] else None
+    footprintLibs = set(footprintIndex.libNames())
+
+    def report(severity,rule,filename,lineNum,symbol,message):
+        violations.append(Violation(severity,rule,filename,lineNum,symbol,message))
+
+    symbolLines = {} #name -> line of its first DEF
+    generated = set() #names of the symbols with a supplier part number
+    for name, lineNum, footprint, pins, hasPartNum in scan["symbols"]:
+        if name in symbolLines:
+            report("error","duplicate-def",libFile,lineNum,name,"also defined on line {0}".format(symbolLines[name]))
+            continue
+        symbolLines[name] = lineNum
+        if hasPartNum:
+            generated.add(name)
+
+        if fixThisMarker in name:
+            report("error","fix-this-name",libFile,lineNum,name,"name has a {0} placeholder".format(fixThisMarker))
+
+        if footprint:
+            libName, sep, footprintName = footprint.partition(":")
+            footprintPath = footprintIndex.resolve(footprint)
+
+            if (not sep) or (not libName in footprintLibs):
+                report("warning","unknown-footprint",libFile,lineNum,name,
+                       "footprint {0} isn't in a library in this repository".format(footprint))
+            elif footprintPath is None:
+                report("error","missing-footprint",libFile,lineNum,name,"footprint {0} doesn't exist".format(footprint))
+            elif (footprintGeometry is not None) and pins:
+                pads = footprintGeometry.get(footprintPath).padNumbers()
+                if len(pads) != len(pins):
+                    report("warning","pin-pad-mismatch",libFile,lineNum,name,
+                           "{0} pins but footprint {1} has {2} pads".format(len(pins),footprint,len(pads)))
+
+    if scan["descs"] is None:
+        return(violations)
+
+    descLines = {} #name -> line of its first $CMP
+    for name, lineNum in scan["descs"]:
+        if name in descLines:
+            report("error","duplicate-description",descFile,lineNum,name,"also described on line {0}".format(descLines[name]))
+            continue
+        descLines[name] = lineNum
+
+    describedSymbols = {descName(name) for name in symbolLines}
+    for name, lineNum in symbolLines.items():
+        if not descName(name) in descLines:
+            report("error" if name in generated else "warning","missing-description",libFile,lineNum,name,
+                   "no $CMP in {0}".format(descFile))
+    for name, lineNum in descLines.items():
+        if not name in describedSymbols:
+            report("warning","orphan-description",descFile,lineNum,name,"no symbol in {0}".format(libFile))
+
+    return(violations)
+
+#A violation as a line like a compiler's: "SFUSat.lib:12: error: NAME: message [rule]"
+def formatViolation(violation):
+    return("{0}:{1}: {2}: {3}: {4} [{5}]".format(violation.file,violation.line,violation.severity,
+                                                 violation.symbol,violation.message,violation.rule))
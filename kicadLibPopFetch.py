@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+"""
+Fetching helpers for kicadLibPop.py
+
+Product pages are fetched by a bounded thread pool so a batch import only
+waits for the slowest few requests instead of every request in turn. Requests
+to the same host are spaced out by a rate limiter so the supplier doesn't
+start refusing us.
+
+HttpSession keeps connections open between requests (HTTP/1.1 keep-alive) in
+a pool per host, so a batch import pays for DNS, the TCP connect and the TLS
+handshake once per connection instead of once per part. It asks for gzip or
+deflate compressed pages, follows redirects itself (on a pooled connection
+too), and adds up how long each phase of every request took: DNS, connect,
+TLS, time to first byte and transfer.
+
+fetchUrl gives every request a timeout and retries timeouts, dropped
+connections and 429/5xx responses after an exponential backoff with full
+jitter (a random wait between 0 and the capped exponential), so threads that
+failed together don't all retry together. A circuit breaker counts failures in
+a row: past its threshold every request fails straight away with CircuitOpen
+instead of waiting on a supplier that's down, and after resetTime one request
+is let through to see if it has recovered.
+
+FixtureServer is a small local stand-in for the supplier's web server. It
+serves saved product pages so the pipeline can be exercised without touching
+the network, and can delay and fail requests to exercise the retries.
+"""
+
+import collections
+import gzip
+import http.client
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urljoin, urlparse, urlsplit
+
+#HTTP statuses worth trying again; any other error status is final
+retryStatuses = (408,429,500,502,503,504)
+redirectStatuses = (301,302,303,307,308)
+
+###############################################################################
+### RATE LIMITING ###
+###############################################################################
+#Spaces out requests to each host so no more than "rate" requests per second are made
+class RateLimiter:
+    def __init__(self,rate=None):
+        self.interval = (1.0/rate) if rate else 0.0
+        self.nextSlot = {} #host -> earliest time the next request may start
+        self.waited = 0.0 #seconds requests have been held back, added up over every thread
+        self.lock = threading.Lock()
+
+    #Block until a request to the url's host is allowed
+    def wait(self,url):
+        if not self.interval:
+            return
+
+        host = urlparse(url).netloc
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now,self.nextSlot.get(host,now))
+            self.nextSlot[host] = slot+self.interval
+            self.waited += slot-now
+
+        if slot > now:
+            time.sleep(slot-now)
+
+###############################################################################
+### HTTP SESSION ###
+###############################################################################
+#Seconds spent in each phase of a request; dns, connect and tls are 0 when a pooled connection was reused
+RequestTiming = collections.namedtuple("RequestTiming",["dns","connect","tls","ttfb","transfer"])
+
+#Response from HttpSession.get; body is already decompressed, url is the one after any redirects
+Response = collections.namedtuple("Response",["url","status","headers","body","timing"])
+
+#HTTP connection that wraps itself in TLS when given an SSL context and times DNS, connect and TLS separately
+class TimedConnection(http.client.HTTPConnection):
+    def __init__(self,host,port,timeout,sslContext=None):
+        super().__init__(host,port,timeout=timeout)
+        self.sslContext = sslContext
+        self.connectTiming = (0.0,0.0,0.0) #dns, connect and tls of the last connect()
+
+    def connect(self):
+        start = time.perf_counter()
+        addresses = socket.getaddrinfo(self.host,self.port,0,socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+
+        for family, sockType, proto, canonName, address in addresses:
+            try:
+                self.sock = socket.create_connection(address[:2],self.timeout)
+                break
+            except OSError as error:
+                connectError = error
+        else:
+            raise connectError
+
+        self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        connected = time.perf_counter()
+
+        if self.sslContext is not None:
+            self.sock = self.sslContext.wrap_socket(self.sock,server_hostname=self.host)
+
+        self.connectTiming = (resolved-start,connected-resolved,time.perf_counter()-connected)
+
+#Undo the Content-Encoding of a response body
+def decodeBody(body,encoding):
+    encoding = (encoding or "").strip().lower()
+
+    try:
+        if encoding == "gzip":
+            return(gzip.decompress(body))
+        if encoding == "deflate":
+            try:
+                return(zlib.decompress(body))
+            except zlib.error:
+                return(zlib.decompress(body,-zlib.MAX_WBITS)) #raw deflate, which some servers send instead
+    except (OSError, EOFError, zlib.error) as error:
+        raise http.client.HTTPException("Can't decode {0} response: {1}".format(encoding,error))
+
+    return(body)
+
+#Persistent connection pool; use one session for every request to a supplier
+class HttpSession:
+    def __init__(self,poolSize=4,timeout=15.0,maxRedirects=5,userAgent="kicadLibPop"):
+        self.poolSize = max(1,poolSize) #connections open to a host at once; more requests wait for one
+        self.timeout = timeout
+        self.maxRedirects = maxRedirects
+        self.headers = {"User-Agent":userAgent,
+                        "Accept-Encoding":"gzip, deflate",
+                        "Connection":"keep-alive"}
+        self.sslContext = None #made the first time it's needed, since loading the CA certificates takes a while
+
+        self.idle = {} #(scheme, host, port) -> idle connections, most recently used last
+        self.slots = {} #(scheme, host, port) -> semaphore holding the host to poolSize connections
+        self.lock = threading.Lock()
+
+        self.totals = collections.Counter() #requests, connections, reused, redirects, bytes and seconds per phase
+
+    #Semaphore for a host's connections
+    def slot(self,key):
+        with self.lock:
+            return(self.slots.setdefault(key,threading.BoundedSemaphore(self.poolSize)))
+
+    #An idle connection to a host, or a new (not yet connected) one; returns (connection, reused)
+    def checkout(self,key,timeout,new=False):
+        with self.lock:
+            idle = self.idle.get(key)
+            connection = idle.pop() if (idle and not new) else None
+
+        if connection is None:
+            scheme, host, port = key
+            if (scheme == "https") and (self.sslContext is None):
+                self.sslContext = ssl.create_default_context()
+
+            return(TimedConnection(host,port,timeout,self.sslContext if scheme == "https" else None),False)
+
+        connection.timeout = timeout
+        connection.sock.settimeout(timeout)
+        return(connection,True)
+
+    #Return a connection to the pool, or close it if the server won't keep it open
+    def checkin(self,key,connection,keep):
+        if not keep:
+            connection.close()
+            return
+
+        with self.lock:
+            self.idle.setdefault(key,[]).append(connection)
+
+    #One GET request without following redirects; returns (status, reason, headers, body, RequestTiming)
+    def request(self,url,timeout=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        key = (scheme,parts.hostname,parts.port or (443 if scheme == "https" else 80))
+        path = (parts.path or "/")+("?"+parts.query if parts.query else "")
+        timeout = self.timeout if timeout is None else timeout
+
+        with self.slot(key):
+            for attempt in range(2):
+                connection, reused = self.checkout(key,timeout,attempt > 0)
+
+                try:
+                    if not reused:
+                        connection.connect()
+
+                    start = time.perf_counter()
+                    connection.request("GET",path,headers=self.headers)
+                    response = connection.getresponse()
+                    firstByte = time.perf_counter()
+                    body = response.read()
+                    end = time.perf_counter()
+                except Exception as error:
+                    connection.close()
+                    if reused and (attempt == 0) and isinstance(error,ConnectionError):
+                        continue #the server closed the idle connection; try a new one
+
+                    raise
+
+                break
+
+            self.checkin(key,connection,not response.will_close)
+
+        dns, connect, tls = (0.0,0.0,0.0) if reused else connection.connectTiming
+        timing = RequestTiming(dns,connect,tls,firstByte-start,end-firstByte)
+
+        with self.lock:
+            self.totals.update(timing._asdict())
+            self.totals.update({"requests":1,"connections":0 if reused else 1,"reused":1 if reused else 0,"bytes":len(body)})
+
+        return(response.status,response.reason,response.headers,decodeBody(body,response.getheader("Content-Encoding")),timing)
+
+    #GET a url, following redirects; raises HTTPError for error statuses, like urlopen
+    def get(self,url,timeout=None):
+        for redirect in range(self.maxRedirects+1):
+            status, reason, headers, body, timing = self.request(url,timeout)
+
+            if not ((status in redirectStatuses) and headers.get("Location")):
+                break
+
+            url = urljoin(url,headers["Location"])
+            with self.lock:
+                self.totals["redirects"] += 1
+        else:
+            raise HTTPError(url,status,"Too many redirects",headers,None)
+
+        if status >= 400:
+            raise HTTPError(url,status,reason,headers,None)
+
+        return(Response(url,status,headers,body,timing))
+
+    #Request counts and the mean milliseconds per request spent in each phase
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+
+        requests = totals.get("requests",0)
+        stats = {name:totals.get(name,0) for name in ("requests","connections","reused","redirects","bytes")}
+        for phase in RequestTiming._fields:
+            stats[phase] = (1000*totals.get(phase,0.0)/requests) if requests else 0.0
+
+        return(stats)
+
+    #Close the idle connections (the session can still be used afterwards)
+    def close(self):
+        with self.lock:
+            idle = [connection for connections in self.idle.values() for connection in connections]
+            self.idle = {}
+
+        for connection in idle:
+            connection.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,*args):
+        self.close()
+
+###############################################################################
+### RETRIES ###
+###############################################################################
+#Raised when a page can't be fetched, after any retries
+class FetchError(IOError):
+    pass
+
+#Raised without trying when the circuit breaker is open
+class CircuitOpen(FetchError):
+    pass
+
+#Timeouts, retries and backoff for fetchUrl
+class RetryPolicy:
+    def __init__(self,retries=3,timeout=15.0,baseDelay=0.5,maxDelay=10.0,seed=None):
+        self.retries = retries #times a request is tried again after the first attempt
+        self.timeout = timeout #seconds to wait for the server to connect or send anything
+        self.baseDelay = baseDelay #seconds before the first retry; doubles after each one
+        self.maxDelay = maxDelay
+        self.random = random.Random(seed)
+
+        self.retried = 0 #requests retried so far
+        self.lock = threading.Lock()
+
+    #Seconds to wait before retry number "attempt" (0 for the first); at least retryAfter if the server gave one
+    def delay(self,attempt,retryAfter=None):
+        delay = self.random.uniform(0,min(self.maxDelay,self.baseDelay*(2**attempt)))
+
+        if retryAfter is not None:
+            delay = max(delay,min(self.maxDelay,retryAfter))
+
+        return(delay)
+
+#Stops requests to a server that keeps failing
+#Closed: requests go through. Open (threshold failures in a row): requests fail with CircuitOpen.
+#Half open (resetTime after opening): one request goes through; it closes the breaker or opens it again.
+class CircuitBreaker:
+    def __init__(self,threshold=5,resetTime=30.0):
+        self.threshold = threshold
+        self.resetTime = resetTime
+
+        self.failures = 0 #failures in a row
+        self.openedAt = None #time the breaker opened; None while it's closed
+        self.trial = False #a request is being let through to see if the server has recovered
+        self.trips = 0 #times the breaker has opened
+        self.lock = threading.Lock()
+
+    @property
+    def isOpen(self):
+        return(self.openedAt is not None)
+
+    #Raise CircuitOpen unless a request to the url may go ahead
+    def allow(self,url=""):
+        with self.lock:
+            if self.openedAt is None:
+                return
+            if (not self.trial) and (time.monotonic()-self.openedAt >= self.resetTime):
+                self.trial = True
+                return
+
+            failures = self.failures
+
+        raise CircuitOpen("Not fetching {0}: the server failed {1} times in a row".format(url,failures))
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.trial or ((self.openedAt is None) and (self.failures >= self.threshold)):
+                if not self.trial:
+                    self.trips += 1
+                self.openedAt = time.monotonic()
+                self.trial = False
+
+#Whether a request that failed with error might work if it's tried again
+def isTransient(error):
+    if isinstance(error,HTTPError):
+        return(error.code in retryStatuses)
+
+    return(True) #timeouts, refused or dropped connections and broken responses
+
+#Seconds the server asked us to wait in a Retry-After header, if it did
+def retryAfter(error):
+    if not isinstance(error,HTTPError):
+        return(None)
+
+    try:
+        return(float(error.headers.get("Retry-After")))
+    except (TypeError, ValueError): #missing, or given as a date
+        return(None)
+
+#Fetch a url as text, retrying according to the policy
+#Pass a session to reuse its connections; without one, each request gets a connection of its own
+#Raises FetchError (CircuitOpen if the breaker is open) once it gives up
+def fetchUrl(url,policy=None,breaker=None,rateLimiter=None,session=None):
+    policy = policy or RetryPolicy()
+    attempt = 0
+
+    while True:
+        if breaker:
+            breaker.allow(url)
+        if rateLimiter:
+            rateLimiter.wait(url)
+
+        try:
+            if session is not None:
+                page = session.get(url,policy.timeout).body
+            else:
+                with HttpSession(1,policy.timeout) as oneOffSession:
+                    page = oneOffSession.get(url).body
+        except (OSError, http.client.HTTPException) as error: #URLError, HTTPError and timeouts are OSErrors
+            transient = isTransient(error)
+
+            if breaker:
+                if transient:
+                    breaker.failure()
+                else:
+                    breaker.success() #the server is up, it just doesn't have the page
+
+            if (not transient) or (attempt >= policy.retries):
+                raise FetchError("Couldn't fetch {0}: {1}".format(url,error)) from error
+
+            with policy.lock:
+                policy.retried += 1
+
+            time.sleep(policy.delay(attempt,retryAfter(error)))
+            attempt += 1
+            continue
+
+        if breaker:
+            breaker.success()
+
+        return(page.decode("utf-8"))
+
+###############################################################################
+### FETCH POOL ###
+###############################################################################
+#Fetch every key with fetchFunc using at most "concurrency" threads
+#Yields (index,key,result) tuples as each fetch finishes, not in input order
+def fetchAll(keys,fetchFunc,concurrency=4):
+    concurrency = max(1,concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fetchFunc,key):(index,key) for index, key in enumerate(keys)}
+
+        for future in as_completed(futures):
+            index, key = futures[future]
+            yield(index,key,future.result())
+
+#Re-order (index,...) tuples so they come out in index order
+#Items are held back only until every earlier index has been seen
+def inOrder(results):
+    pending = {}
+    nextIndex = 0
+
+    for result in results:
+        pending[result[0]] = result
+
+        while nextIndex in pending:
+            yield(pending.pop(nextIndex))
+            nextIndex += 1
+
+###############################################################################
+### LOCAL STAND-IN SERVER ###
+###############################################################################
+#Serves saved product pages from a dictionary or a directory of "<partNum>.html" files
+#Pages are looked up by the "name" query parameter, the same as the Digi-Key search URL
+#Connections are kept alive (HTTP/1.1), pages are gzipped for clients that accept it if compress is True, and any
+#path starting with /redirect is redirected to the same path without it
+class FixtureServer:
+    def __init__(self,pages=None,pageDir=None,host="127.0.0.1",port=0,latency=0.0,errorRate=0.0,errorStatus=503,
+                 failFirst=None,seed=None,compress=False):
+        self.pages = dict(pages or {})
+        self.pageDir = pageDir
+        self.compress = compress
+        self.requestCount = 0
+        self.connectionCount = 0
+        self.errorCount = 0
+        self.lock = threading.Lock()
+
+        #Fault injection
+        self.latency = latency #seconds before each response, or (min, max) for a random delay
+        self.errorRate = errorRate #fraction of requests answered with errorStatus instead of the page
+        self.errorStatus = errorStatus
+        self.failFirst = dict(failFirst or {}) #partNum -> requests for it that fail before it's served
+        self.random = random.Random(seed)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True #headers and body are written separately
+
+            def setup(self):
+                with server.lock:
+                    server.connectionCount += 1
+                super().setup()
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self,*args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host,port),Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    #URL template that can replace the Digi-Key one (use .format(partNum))
+    @property
+    def urlTemplate(self):
+        host, port = self.httpd.server_address[:2]
+        return("http://{0}:{1}/scripts/DkSearch/dksus.dll?Detail&name={{0}}".format(host,port))
+
+    #URL template that is redirected to urlTemplate
+    @property
+    def redirectUrlTemplate(self):
+        host, port = self.httpd.server_address[:2]
+        return("http://{0}:{1}/redirect/scripts/DkSearch/dksus.dll?Detail&name={{0}}".format(host,port))
+
+    #Find the page for a part number, or None if there isn't one
+    def getPage(self,partNum):
+        if partNum in self.pages:
+            return(self.pages[partNum])
+
+        if self.pageDir:
+            pagePath = os.path.join(self.pageDir,"{0}.html".format(partNum))
+            if os.path.isfile(pagePath):
+                with open(pagePath,"r",encoding="utf-8") as pageFile:
+                    return(pageFile.read())
+
+        return(None)
+
+    #Whether to fail this request for a part, and how long to wait before answering
+    def injectFaults(self,partNum):
+        with self.lock:
+            if isinstance(self.latency,tuple):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency
+
+            fail = self.random.random() < self.errorRate
+            if self.failFirst.get(partNum,0) > 0:
+                self.failFirst[partNum] -= 1
+                fail = True
+
+            if fail:
+                self.errorCount += 1
+
+        return(fail,delay)
+
+    def handle(self,request):
+        with self.lock:
+            self.requestCount += 1
+
+        query = parse_qs(urlparse(request.path).query)
+        partNum = query.get("name",[""])[0]
+        fail, delay = self.injectFaults(partNum)
+
+        try:
+            if delay:
+                time.sleep(delay)
+
+            if request.path.startswith("/redirect/"):
+                request.send_response(301)
+                request.send_header("Location",request.path[len("/redirect"):])
+                request.send_header("Content-Length","0")
+                request.end_headers()
+                return
+
+            if fail:
+                request.send_error(self.errorStatus,"Injected failure for {0}".format(partNum))
+                return
+
+            page = self.getPage(partNum)
+
+            if page is None:
+                request.send_error(404,"No page for {0}".format(partNum))
+                return
+
+            body = page.encode("utf-8")
+            gzipped = self.compress and ("gzip" in request.headers.get("Accept-Encoding",""))
+            if gzipped:
+                body = gzip.compress(body)
+
+            request.send_response(200)
+            request.send_header("Content-Type","text/html; charset=utf-8")
+            if gzipped:
+                request.send_header("Content-Encoding","gzip")
+            request.send_header("Content-Length",str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        except ConnectionError: #the client gave up waiting
+            pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,daemon=True)
+        self.thread.start()
+        return(self)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return(self.start())
+
+    def __exit__(self,*args):
+        self.stop()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Footprint index for kicadLibPop.py
+
+Maps footprint names to .kicad_mod paths across every .pretty library in a
+directory. The index is built once per run and can be kept on disk; a library
+is only listed again when its directory's mtime changes (i.e. footprints were
+added, removed or renamed).
+
+Lookups are exact by default. Names are also indexed under a normalized alias
+(case and separators ignored, imperial and metric chip sizes treated the
+same, so "C_0603" also finds "C_1608Metric"), and close matches can be
+suggested with difflib when nothing matches.
+
+FootprintGeometry reads what's in the footprints: the pad numbers, the
+courtyard bounding box and the 3D models. The S-expression parser is lazy:
+it only builds the pad, model and drawing forms, and every other form
+(text, effects, descriptions, ...) is skipped by counting parentheses. The
+results are kept in a compact JSON index on disk, keyed by footprint path
+and checked against the file's size and mtime, so a library-wide check only
+parses the footprints that changed since the last run.
+"""
+
+import difflib
+import glob
+import json
+import os
+import re
+
+from collections import namedtuple
+
+footprintExt = ".kicad_mod"
+
+#Imperial chip size code -> metric chip size code
+chipSizes = {"01005":"0402",
+             "0201":"0603",
+             "0402":"1005",
+             "0603":"1608",
+             "0805":"2012",
+             "1008":"2520",
+             "1206":"3216",
+             "1210":"3225",
+             "1806":"4516",
+             "1812":"4532",
+             "2010":"5025",
+             "2512":"6332"}
+metricChipSizes = {metric:imperial for imperial, metric in chipSizes.items()}
+
+#Normalized alias of a footprint or package name
+def normalizeName(name):
+    alias = re.sub(r"[^0-9a-z]","",name.lower()).replace("metric","")
+
+    #metric codes collide with imperial ones (0603 is both), so metric codes are only swapped when marked
+    if "metric" in name.lower():
+        alias = re.sub(r"\d{4}",lambda code: metricChipSizes.get(code.group(0),code.group(0)),alias)
+
+    return(alias)
+
+###############################################################################
+### FOOTPRINT INDEX ###
+###############################################################################
+class FootprintIndex:
+    def __init__(self,rootDir,cachePath=None):
+        self.rootDir = rootDir
+        self.cachePath = cachePath
+        self.libs = None #library nickname -> {"mtime": dir mtime, "footprints": [names]}
+
+        self.paths = {} #library nickname -> {footprint name: path}
+        self.aliases = {} #library nickname -> {normalized alias: footprint name}
+
+    #List the .pretty libraries, reusing the cached listing of any whose mtime hasn't changed
+    def load(self):
+        cached = {}
+        if self.cachePath:
+            try:
+                with open(self.cachePath,"r",encoding="utf-8") as cacheFile:
+                    cached = json.load(cacheFile)
+            except (OSError, ValueError):
+                cached = {}
+
+        self.libs = {}
+        changed = False
+
+        for libDir in sorted(glob.glob(os.path.join(self.rootDir,"*.pretty"))):
+            libName = os.path.basename(libDir)[:-len(".pretty")]
+            mtime = os.path.getmtime(libDir)
+
+            if (libName in cached) and (cached[libName]["mtime"] == mtime):
+                self.libs[libName] = cached[libName]
+            else:
+                footprints = sorted(fileName[:-len(footprintExt)] for fileName in os.listdir(libDir)
+                                    if fileName.endswith(footprintExt))
+                self.libs[libName] = {"mtime":mtime,"footprints":footprints}
+                changed = True
+
+        if self.cachePath and (changed or (set(cached) != set(self.libs))):
+            os.makedirs(os.path.dirname(self.cachePath),exist_ok=True)
+            with open(self.cachePath,"w",encoding="utf-8") as cacheFile:
+                json.dump(self.libs,cacheFile)
+
+        for libName, lib in self.libs.items():
+            libDir = os.path.join(self.rootDir,"{0}.pretty".format(libName))
+            self.paths[libName] = {name:os.path.join(libDir,name+footprintExt) for name in lib["footprints"]}
+            self.aliases[libName] = {}
+            for name in lib["footprints"]:
+                self.aliases[libName].setdefault(normalizeName(name),name)
+
+        return(self)
+
+    def ensureLoaded(self):
+        if self.libs is None:
+            self.load()
+
+    #Name of the footprint in a library matching name exactly or by alias, or None
+    def find(self,libName,name):
+        self.ensureLoaded()
+
+        if name in self.paths.get(libName,{}):
+            return(name)
+
+        return(self.aliases.get(libName,{}).get(normalizeName(name)))
+
+    #Path of a "library:footprint" reference, or None if it doesn't exist
+    def resolve(self,footprintRef):
+        self.ensureLoaded()
+
+        if not ":" in footprintRef:
+            return(None)
+
+        libName, name = footprintRef.split(":",1)
+        return(self.paths.get(libName,{}).get(name))
+
+    #Closest footprint names in a library for when nothing matches
+    def fuzzy(self,libName,name,count=3,cutoff=0.6):
+        self.ensureLoaded()
+
+        return(difflib.get_close_matches(name,list(self.paths.get(libName,{})),n=count,cutoff=cutoff))
+
+    def libNames(self):
+        self.ensureLoaded()
+        return(list(self.libs))
+
+    def __len__(self):
+        self.ensureLoaded()
+        return(sum(len(paths) for paths in self.paths.values()))
+
+###############################################################################
+### GEOMETRY ###
+###############################################################################
+#(, ), a quoted string or an atom
+tokenRegex = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+geometryForms = {"pad","model","fp_line","fp_rect","fp_circle","fp_arc","fp_poly"}
+courtyardLayers = {"F.CrtYd","B.CrtYd"}
+
+#The forms inside the footprint's (module ...) or (footprint ...) whose head is in heads, as nested lists of strings
+#Every other form is skipped without being built
+def iterForms(text,heads):
+    tokens = tokenRegex.finditer(text)
+    depth = 0
+    stack = None #lists of the form being built, outermost first
+
+    for match in tokens:
+        token = match.group(0)
+
+        if token == "(":
+            if stack is not None:
+                stack.append([])
+                continue
+
+            depth += 1
+            if depth != 2:
+                continue
+
+            head = next(tokens,None)
+            if head is None: #cut off
+                return
+            if head.group(0) in heads:
+                stack = [[head.group(0)]]
+                continue
+
+            skip = 1 #skip to the end of the form
+            for match in tokens:
+                if match.group(0) == "(":
+                    skip += 1
+                elif match.group(0) == ")":
+                    skip -= 1
+                    if not skip:
+                        break
+            depth -= 1
+        elif token == ")":
+            if stack is None:
+                depth -= 1
+                continue
+
+            form = stack.pop()
+            if stack:
+                stack[-1].append(form)
+            else:
+                yield(form)
+                stack = None
+                depth -= 1
+        elif stack is not None:
+            if token.startswith('"'):
+                token = token[1:-1].replace('\\"','"')
+            stack[-1].append(token)
+
+#First (name ...) in a form, or None
+def subForm(form,name):
+    for item in form:
+        if isinstance(item,list) and item and (item[0] == name):
+            return(item)
+
+    return(None)
+
+#(x, y) of a (name x y) in a form
+def formPoint(form,name):
+    item = subForm(form,name)
+
+    return((float(item[1]),float(item[2])) if item else None)
+
+#Points that bound a drawing form; arcs count as their whole circle, which is never smaller than the arc
+def formPoints(form):
+    head = form[0]
+
+    if head in ("fp_line","fp_rect"):
+        return([point for point in (formPoint(form,"start"),formPoint(form,"end")) if point])
+
+    if head in ("fp_circle","fp_arc"):
+        center = formPoint(form,"center") or formPoint(form,"start") #(fp_arc (start center) (end point) (angle a))
+        end = formPoint(form,"end")
+        if head == "fp_arc" and subForm(form,"mid"): #KiCAD 6 arcs go through start, mid and end
+            return([point for point in (formPoint(form,"start"),formPoint(form,"mid"),end) if point])
+        if not (center and end):
+            return([])
+        radius = ((end[0]-center[0])**2+(end[1]-center[1])**2)**0.5
+        return([(center[0]-radius,center[1]-radius),(center[0]+radius,center[1]+radius)])
+
+    if head == "fp_poly":
+        pts = subForm(form,"pts") or []
+        return([(float(item[1]),float(item[2])) for item in pts if isinstance(item,list) and (item[:1] == ["xy"])])
+
+    return([])
+
+#What's in a footprint: pad numbers in file order ("" for unnumbered pads such as mounting holes),
+#courtyard bounding box (x1, y1, x2, y2) in mm or None, and 3D model paths as written in the file
+class Footprint(namedtuple("Footprint",["pads","courtyard","models"])):
+    #Distinct pad numbers, not counting unnumbered pads
+    def padNumbers(self):
+        return(set(self.pads)-{""})
+
+    #(width, height) of the courtyard in mm, or None
+    def courtyardSize(self):
+        if self.courtyard is None:
+            return(None)
+
+        x1, y1, x2, y2 = self.courtyard
+        return((round(x2-x1,4),round(y2-y1,4)))
+
+#Read a footprint from the text of a .kicad_mod file
+def parseFootprint(text):
+    pads = []
+    models = []
+    points = []
+
+    for form in iterForms(text,geometryForms):
+        head = form[0]
+
+        if head == "pad":
+            pads.append(form[1] if (len(form) > 1) and isinstance(form[1],str) else "")
+        elif head == "model":
+            if (len(form) > 1) and isinstance(form[1],str):
+                models.append(form[1])
+        else:
+            layer = subForm(form,"layer")
+            if layer and (len(layer) > 1) and (layer[1] in courtyardLayers):
+                points += formPoints(form)
+
+    courtyard = None
+    if points:
+        courtyard = [round(min(x for x, y in points),4),round(min(y for x, y in points),4),
+                     round(max(x for x, y in points),4),round(max(y for x, y in points),4)]
+
+    return(Footprint(pads,courtyard,models))
+
+#Where a footprint's 3D model is, or None if it can't be found
+#${VARIABLES} are expanded and relative paths are looked for in KiCAD's KISYS3DMOD as well; a model that isn't
+#where the path says is looked for next to the footprint, which is where the models made for these libraries are kept
+def resolveModel(footprintPath,modelPath):
+    expanded = re.sub(r"\$\{(\w+)\}",lambda var: os.environ.get(var.group(1),var.group(0)),modelPath).replace("\\","/")
+    footprintDir = os.path.dirname(footprintPath)
+    modelName = os.path.basename(expanded)
+
+    if os.path.isabs(expanded):
+        candidates = [expanded]
+    else:
+        candidates = [os.path.join(footprintDir,expanded)]
+        if os.environ.get("KISYS3DMOD"):
+            candidates.append(os.path.join(os.environ["KISYS3DMOD"],expanded))
+
+    candidates.append(os.path.join(footprintDir,modelName))
+    candidates += [os.path.join(footprintDir,os.path.splitext(modelName)[0]+ext) for ext in (".wrl",".step",".stp")]
+
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return(candidate)
+
+    return(None)
+
+class FootprintGeometry:
+    def __init__(self,rootDir,cachePath=None):
+        self.rootDir = rootDir
+        self.cachePath = cachePath
+        self.entries = None #path relative to rootDir -> {"size", "mtime", "pads", "courtyard", "models"}
+
+        self.parsed = 0 #footprints parsed this run (the rest came from the cache)
+        self.changed = False
+
+    def load(self):
+        self.entries = {}
+
+        if self.cachePath:
+            try:
+                with open(self.cachePath,"r",encoding="utf-8") as cacheFile:
+                    self.entries = json.load(cacheFile)
+            except (OSError, ValueError):
+                self.entries = {}
+
+        return(self)
+
+    #Footprint of a .kicad_mod file, parsed only if it changed since it was cached
+    def get(self,footprintPath):
+        if self.entries is None:
+            self.load()
+
+        key = os.path.relpath(footprintPath,self.rootDir).replace(os.sep,"/")
+        stat = os.stat(footprintPath)
+        entry = self.entries.get(key)
+
+        if (entry is None) or (entry["size"] != stat.st_size) or (entry["mtime"] != stat.st_mtime_ns):
+            with open(footprintPath,"r",encoding="utf-8",errors="replace") as footprintFile:
+                footprint = parseFootprint(footprintFile.read())
+
+            entry = dict(footprint._asdict(),size=stat.st_size,mtime=stat.st_mtime_ns)
+            self.entries[key] = entry
+            self.parsed += 1
+            self.changed = True
+
+        return(Footprint(entry["pads"],entry["courtyard"],entry["models"]))
+
+    #Footprint of every .kicad_mod in a FootprintIndex, by "library:footprint"
+    def getAll(self,footprintIndex):
+        footprints = {}
+
+        for libName in footprintIndex.libNames():
+            for name, footprintPath in footprintIndex.paths[libName].items():
+                footprints["{0}:{1}".format(libName,name)] = self.get(footprintPath)
+
+        return(footprints)
+
+    #Save the index if anything was parsed, dropping footprints that no longer exist
+    def save(self):
+        if not (self.cachePath and self.changed):
+            return
+
+        entries = {key:entry for key, entry in self.entries.items() if os.path.isfile(os.path.join(self.rootDir,key))}
+
+        os.makedirs(os.path.dirname(self.cachePath),exist_ok=True)
+        tempPath = self.cachePath+".tmp"
+        with open(tempPath,"w",encoding="utf-8") as cacheFile:
+            json.dump(entries,cacheFile,ensure_ascii=False,separators=(",",":"))
+        os.replace(tempPath,self.cachePath)
+
+        self.changed = False
@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+"""
+KiCAD legacy library model for kicadLibPop.py
+
+Parses .lib symbol libraries (DEF ... F0..Fn ... DRAW ... ENDDRAW ... ENDDEF
+blocks) and .dcm description files ($CMP ... $ENDCMP blocks) into an indexed
+Library, so duplicate checks are dictionary lookups by symbol name, supplier
+part number or manufacturer part number instead of substring scans over the
+whole file.
+
+Libraries are indexed without reading them into memory: MappedLibrary
+memory-maps the file and finds the byte span of every DEF ... ENDDEF block
+(and the part number fields in it) in one regex scan, and a symbol is only
+decoded when it's asked for. Listing names and duplicate checks take memory
+for the index, not for the file, however big the library is. Library keeps
+just the index and one read handle, and reads a symbol's span from the file
+when it needs one, so the file isn't mapped while it's being appended to or
+replaced (the handle is closed before the file is replaced).
+
+New parts are written with appendBlocks, which only rewrites the trailer at
+the end of the file (#End Library / #End Doc Library) instead of the whole
+library. A small journal next to the file records the original trailer before
+anything is written, so a run that dies part way through is rolled back the
+next time the file is read or written (if it's still the file the journal was
+written for).
+
+splitLib and splitDcm cut a file into its header, one block per symbol or
+description (with the comment lines in front of it) and its trailer, keeping
+every byte, so a file can be rebuilt with some blocks replaced and the rest
+left exactly as they were.
+
+See https://en.wikibooks.org/wiki/Kicad/file_formats for the file formats.
+"""
+
+import base64
+import hashlib
+import json
+import mmap
+import os
+import re
+
+from collections.abc import Mapping
+
+#F<n> "<text>" <posx> <posy> <size> <orient> <visible> <hjustify> <vjustify> ["<name>"]
+fieldRegex = re.compile(r'^F(\d+) "((?:[^"\\]|\\.)*)"(.*?)(?: "((?:[^"\\]|\\.)*)")?$')
+
+libHeader = "EESchema-LIBRARY Version 2.3\n#encoding utf-8"
+descHeader = "EESchema-DOCLIB  Version 2.0"
+libTrailer = "#\n#End Library"
+descTrailer = "#\n#End Doc Library"
+
+tailBytes = 4096 #how much of the end of the file is searched for the trailer
+
+supplierPartNumField = "Supplier Part Number 1"
+mfrPartNumField = "Manufacturer Part Number 1"
+
+#Lines the index scan stops at: DEF (group 1 is the name), ENDDEF, and part number fields (group 2 is the value, 3 the field)
+indexRegex = re.compile(rb'^DEF (\S+)|^ENDDEF\b|^F\d+ "((?:[^"\\\n]|\\.)*)"[^\n]* "('
+                        +re.escape(supplierPartNumField.encode("utf-8"))+rb"|"
+                        +re.escape(mfrPartNumField.encode("utf-8"))+rb')"\r?$',re.M)
+
+###############################################################################
+### SYMBOLS ###
+###############################################################################
+class LibSymbol:
+    def __init__(self,name,reference,lines):
+        self.name = name
+        self.reference = reference
+        self.lines = lines #every line from DEF to ENDDEF
+        self.fields = {} #field number -> (text, rest of the line, field name or None)
+
+        for line in lines:
+            if line.startswith("F"):
+                match = fieldRegex.match(line)
+                if match:
+                    self.fields[int(match.group(1))] = (match.group(2),match.group(3),match.group(4))
+
+    #Value of the named (F4 and up) field, or None
+    def getField(self,fieldName):
+        for text, rest, name in self.fields.values():
+            if name == fieldName:
+                return(text)
+
+        return(None)
+
+    #Named fields as a dictionary (the productAttrDict the symbol was made from, minus the description)
+    def namedFields(self):
+        return({name:text for number, (text, rest, name) in sorted(self.fields.items()) if name is not None})
+
+    @property
+    def footprint(self):
+        return(self.fields[2][0] if 2 in self.fields else "")
+
+    @property
+    def supplierPartNum(self):
+        return(self.getField(supplierPartNumField))
+
+    @property
+    def mfrPartNum(self):
+        return(self.getField(mfrPartNumField))
+
+    #Pin numbers of every unit (X <name> <number> ... lines)
+    def pinNumbers(self):
+        return({line.split()[2] for line in self.lines if line.startswith("X ") and (len(line.split()) > 2)})
+
+    def text(self):
+        return("\n".join(self.lines))
+
+#Parse the text of a .lib file into a list of LibSymbol
+def parseLib(contents):
+    symbols = []
+    block = None
+
+    for line in contents.splitlines():
+        if block is None:
+            if line.startswith("DEF "):
+                block = [line]
+        else:
+            block.append(line)
+            if line.startswith("ENDDEF"):
+                words = block[0].split()
+                symbols.append(LibSymbol(words[1],words[2] if len(words) > 2 else "",block))
+                block = None
+
+    return(symbols)
+
+#Name of a symbol's entry in the description file (which leaves out the "~" that hides the value field)
+def descName(symbolName):
+    return(symbolName.lstrip("~"))
+
+#Parse the text of a .dcm file into {name: {"D": description, "K": keywords, "F": datasheet}}
+def parseDcm(contents):
+    descs = {}
+    name = None
+
+    for line in contents.splitlines():
+        if line.startswith("$CMP "):
+            name = line[5:].strip()
+            descs[name] = {}
+        elif line.startswith("$ENDCMP"):
+            name = None
+        elif (name is not None) and (len(line) > 1) and (line[1] == " "):
+            descs[name][line[0]] = line[2:]
+
+    return(descs)
+
+###############################################################################
+### BLOCKS ###
+###############################################################################
+#Split a file into (header lines, [(name, lines)], trailer lines) on blocks from startPrefix to endPrefix
+#Blocks include the comment lines in front of them; joinBlocks puts the pieces back together byte for byte
+def splitBlocks(contents,startPrefix,endPrefix):
+    header = []
+    blocks = []
+    pending = []
+    name = None
+
+    for line in contents.split("\n"):
+        if (not blocks) and (not pending) and (line.startswith("EESchema") or line.startswith("#encoding")):
+            header.append(line)
+            continue
+
+        pending.append(line)
+
+        if (name is None) and line.startswith(startPrefix):
+            name = line.split()[1]
+        elif (name is not None) and line.startswith(endPrefix):
+            blocks.append((name,pending))
+            pending = []
+            name = None
+
+    return(header,blocks,pending)
+
+#Split the text of a .lib file into DEF ... ENDDEF blocks
+def splitLib(contents):
+    return(splitBlocks(contents,"DEF ","ENDDEF"))
+
+#Split the text of a .dcm file into $CMP ... $ENDCMP blocks
+def splitDcm(contents):
+    return(splitBlocks(contents,"$CMP ","$ENDCMP"))
+
+#Text of a file split with splitBlocks
+def joinBlocks(header,blocks,trailer):
+    return("\n".join(header+[line for name, lines in blocks for line in lines]+trailer))
+
+###############################################################################
+### RENDERING ###
+###############################################################################
+#A symbol layout (attribute config and symbol shape) compiled once so rendering a part only joins strings
+#Renders exactly what kicadLibPop.makeLibPart always has
+class LibPartTemplate:
+    def __init__(self,attrConfig,symbolShape):
+        nameConfig = attrConfig["name"]
+        self.defSuffix = " 0 {0} {1} {2} {3} {4} {5}".format(nameConfig["textOffset"],
+                                                             nameConfig["drawPinnumber"],
+                                                             nameConfig["drawPinname"],
+                                                             nameConfig["unitCount"],
+                                                             nameConfig["unitsLocked"],
+                                                             nameConfig["optionFlag"])
+        self.refSuffix = self.fieldSuffix(attrConfig["ref"])
+        self.valSuffix = self.fieldSuffix(attrConfig["val"])
+        self.otherSuffix = self.fieldSuffix(attrConfig["other"])
+        self.symbolShape = symbolShape
+
+        self.keyOrders = {} #attribute names in the order they arrive -> the same names sorted
+
+    #'" <posx> <posy> <size> <orient> <visible> <hjustify> <vjustify>' for a field config
+    @staticmethod
+    def fieldSuffix(fieldConfig):
+        return('" {0} {1} {2} {3} {4} {5} {6}'.format(fieldConfig["posx"],
+                                                     fieldConfig["posy"],
+                                                     fieldConfig["textSize"],
+                                                     fieldConfig["textOrient"],
+                                                     fieldConfig["visible"],
+                                                     fieldConfig["hTextJustify"],
+                                                     fieldConfig["vTextJustify"]))
+
+    #Lines of the part definition (the same list makeLibPart returns)
+    def render(self,productAttrDict,fixedAttrDict):
+        value = fixedAttrDict["Value"]
+        reference = fixedAttrDict["Reference"]
+        otherSuffix = self.otherSuffix
+
+        keys = tuple(productAttrDict)
+        sortedKeys = self.keyOrders.get(keys)
+        if sortedKeys is None:
+            sortedKeys = self.keyOrders[keys] = sorted(keys)
+
+        dataToWrite = ["# \n# "+value+"\n#",
+                       "DEF "+value+" "+reference+self.defSuffix,
+                       'F0 "'+reference+self.refSuffix,
+                       'F1 "'+value+self.valSuffix,
+                       'F2 "'+fixedAttrDict["Footprint"]+otherSuffix,
+                       'F3 "'+fixedAttrDict["Datasheet"]+otherSuffix]
+
+        #F4 is the first optional attribute; the description goes in the description file instead but keeps its number
+        for attributeNum, key in enumerate(sortedKeys,4):
+            if not key == "Description":
+                dataToWrite.append("F"+str(attributeNum)+' "'+str(productAttrDict[key])+otherSuffix+' "'+key+'"')
+
+        dataToWrite.append(self.symbolShape)
+        dataToWrite.append("ENDDEF")
+
+        return(dataToWrite)
+
+###############################################################################
+### MAPPED LIBRARY ###
+###############################################################################
+#Decode a DEF ... ENDDEF span into a LibSymbol the same way parseLib does
+def decodeSymbol(data):
+    lines = data.decode("utf-8",errors="replace").splitlines()
+    words = lines[0].split()
+
+    return(LibSymbol(words[1],words[2] if len(words) > 2 else "",lines))
+
+#Read-only view of a .lib file that's memory-mapped and indexed instead of read
+class MappedLibrary:
+    def __init__(self,libPath):
+        self.libPath = libPath
+        recoverJournal(libPath)
+        self.file = open(libPath,"rb")
+
+        #an empty file can't be mapped (tms570ls0432.lib is empty)
+        if os.fstat(self.file.fileno()).st_size:
+            self.map = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        else:
+            self.map = b""
+
+        self.spans = {} #symbol name -> (start, end) byte offsets of DEF to the end of ENDDEF
+        self.bySupplierPartNum = {} #part number -> symbol name
+        self.byMfrPartNum = {}
+
+        self.scan()
+
+    #Find every symbol and its part numbers in one pass over the file
+    def scan(self):
+        name = None
+
+        for match in indexRegex.finditer(self.map):
+            if match.group(1) is not None:
+                name = match.group(1).decode("utf-8",errors="replace")
+                start = match.start()
+                partNums = []
+            elif name is None:
+                continue
+            elif match.group(2) is not None:
+                partNums.append((match.group(3),match.group(2).decode("utf-8",errors="replace")))
+            else:
+                self.spans[name] = (start,match.end())
+
+                for field, partNum in partNums:
+                    index = self.bySupplierPartNum if field == supplierPartNumField.encode("utf-8") else self.byMfrPartNum
+                    index[partNum] = name
+                name = None
+
+    #The symbol with a name, decoded from its span
+    def symbol(self,name):
+        start, end = self.spans[name]
+
+        return(decodeSymbol(self.map[start:end]))
+
+    def close(self):
+        if isinstance(self.map,mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def __contains__(self,name):
+        return(name in self.spans)
+
+    def __len__(self):
+        return(len(self.spans))
+
+#Symbols of a library by name, read from the file when they're looked up
+#Symbols added during a run are kept in memory on top of the file's
+#The file is opened on the first lookup and kept open until close (it's opened again if a symbol is looked up after)
+class LazySymbols(Mapping):
+    def __init__(self,libPath,spans):
+        self.libPath = libPath
+        self.spans = spans
+        self.added = {}
+        self.file = None
+
+    def __getitem__(self,name):
+        if name in self.added:
+            return(self.added[name])
+
+        start, end = self.spans[name]
+        if self.file is None:
+            self.file = open(self.libPath,"rb")
+        self.file.seek(start)
+
+        return(decodeSymbol(self.file.read(end-start)))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __contains__(self,name):
+        return((name in self.added) or (name in self.spans))
+
+    def __iter__(self):
+        yield from self.spans
+        yield from (name for name in self.added if not name in self.spans)
+
+    def __len__(self):
+        return(len(self.spans)+sum(1 for name in self.added if not name in self.spans))
+
+###############################################################################
+### INDEXED LIBRARY ###
+###############################################################################
+class Library:
+    def __init__(self,libPath,descPath=None):
+        self.libPath = libPath
+        self.descPath = descPath
+
+        self.symbols = LazySymbols(libPath,{}) #symbol name -> LibSymbol
+        self.bySupplierPartNum = {} #part number -> symbol name
+        self.byMfrPartNum = {}
+        self.descs = {}
+
+    #Index the library and read the description file
+    def load(self):
+        self.close()
+        with MappedLibrary(self.libPath) as mapped:
+            self.symbols = LazySymbols(self.libPath,mapped.spans)
+            self.bySupplierPartNum = mapped.bySupplierPartNum
+            self.byMfrPartNum = mapped.byMfrPartNum
+
+        if self.descPath:
+            self.descs = parseDcm(readText(self.descPath))
+
+        return(self)
+
+    #Add a symbol to the indexes
+    def add(self,symbol,description=None):
+        self.symbols.added[symbol.name] = symbol
+
+        if symbol.supplierPartNum:
+            self.bySupplierPartNum[symbol.supplierPartNum] = symbol.name
+        if symbol.mfrPartNum:
+            self.byMfrPartNum[symbol.mfrPartNum] = symbol.name
+        if description is not None:
+            self.descs[symbol.name] = {"D":description}
+
+    def hasName(self,name):
+        return(name in self.symbols)
+
+    def hasSupplierPartNum(self,partNum):
+        return(partNum in self.bySupplierPartNum)
+
+    def hasMfrPartNum(self,partNum):
+        return(partNum in self.byMfrPartNum)
+
+    def close(self):
+        self.symbols.close()
+
+    def __contains__(self,name):
+        return(name in self.symbols)
+
+    def __len__(self):
+        return(len(self.symbols))
+
+#Read a library file the same way kicadLibPop.readFile does
+def readText(filepath):
+    recoverJournal(filepath)
+
+    with open(filepath,"r",encoding="utf-8",errors="replace") as libfile:
+        return(libfile.read())
+
+#Replace a file's contents in one write; the old file is only replaced once the new one is complete
+def writeText(filepath,contents):
+    recoverJournal(filepath) #the journal is for the file being replaced
+    if filepath in loadedLibs:
+        loadedLibs[filepath].close() #an open file can't be replaced on Windows
+    tempPath = filepath+".tmp"
+
+    with open(tempPath,"wb") as libfile:
+        libfile.write(contents.encode("utf-8"))
+        libfile.flush()
+        os.fsync(libfile.fileno())
+
+    os.replace(tempPath,filepath)
+
+#Libraries are loaded at most once per run and shared by everything that asks for them
+loadedLibs = {}
+
+def getLibrary(libPath,descPath=None):
+    if libPath not in loadedLibs:
+        loadedLibs[libPath] = Library(libPath,descPath).load()
+
+    return(loadedLibs[libPath])
+
+#Forget a loaded library (after it was changed) so it's loaded again the next time it's asked for
+def unloadLibrary(libPath):
+    library = loadedLibs.pop(libPath,None)
+    if library is not None:
+        library.close()
+
+###############################################################################
+### RENAMING ###
+###############################################################################
+#A .lib line with the symbol name in it (comment, DEF or F1) renamed, or the line as is
+def renameLibLine(line,renames):
+    if line.startswith("DEF ") or line.startswith("# "):
+        words = line.split(" ")
+        if words[1] in renames:
+            words[1] = renames[words[1]]
+            return(" ".join(words))
+    elif line.startswith("F1 "):
+        match = fieldRegex.match(line)
+        if match and (match.group(2) in renames):
+            return('F1 "{0}"{1}'.format(renames[match.group(2)],line[match.end(2)+1:]))
+
+    return(line)
+
+#A .dcm $CMP line renamed, or the line as is
+def renameDcmLine(line,renames):
+    if line.startswith("$CMP ") and (line[5:].strip() in renames):
+        return("$CMP {0}".format(renames[line[5:].strip()]))
+
+    return(line)
+
+#Rename symbols ({old name: new name}) in a library and its description file, one pass over each file
+def renameSymbols(libPath,descPath,renames):
+    lines = readText(libPath).split("\n")
+    writeText(libPath,"\n".join(renameLibLine(line,renames) for line in lines))
+
+    if descPath:
+        lines = readText(descPath).split("\n")
+        writeText(descPath,"\n".join(renameDcmLine(line,renames) for line in lines))
+
+    unloadLibrary(libPath) #reload with the new names next time
+
+###############################################################################
+### APPENDING ###
+###############################################################################
+def journalPath(filepath):
+    return(filepath+".journal")
+
+#Hash of the tailBytes bytes in front of offset, which an append doesn't touch
+def headHash(libfile,offset):
+    start = max(0,offset-tailBytes)
+    libfile.seek(start)
+
+    return(hashlib.sha1(libfile.read(offset-start)).hexdigest())
+
+#Whether a file is still the one a journal was written for, part way through that append: unchanged up to the
+#journal's offset, then the start of the data being written and the rest of the old tail
+def journalMatches(libfile,journal,tail,data):
+    size = libfile.seek(0,os.SEEK_END)
+    offset = journal["offset"]
+    if (size < offset) or (journal["size"] != offset+len(tail)) or (headHash(libfile,offset) != journal["head"]):
+        return(False)
+
+    libfile.seek(offset)
+    rest = libfile.read()
+    written = len(os.path.commonprefix([rest,data])) #how much of the data got written
+
+    return(rest[written:] == tail[written:])
+
+#Roll back an append that didn't finish; returns whether anything was rolled back
+#Every read and write of a library goes through here (readText, MappedLibrary, writeText and appendBlocks), so nothing
+#sees a half written tail. A journal for a file that has been replaced since (or that doesn't match it) is discarded.
+def recoverJournal(filepath):
+    try:
+        with open(journalPath(filepath),"r") as journalFile:
+            journal = json.load(journalFile)
+    except FileNotFoundError:
+        return(False)
+    except ValueError:
+        os.remove(journalPath(filepath)) #the journal itself wasn't finished, so the file wasn't touched
+        return(False)
+
+    tail = base64.b64decode(journal["tail"])
+    data = base64.b64decode(journal["data"])
+    recovered = False
+
+    try:
+        with open(filepath,"r+b") as libfile:
+            if journalMatches(libfile,journal,tail,data):
+                libfile.seek(journal["offset"])
+                libfile.write(tail)
+                libfile.truncate()
+                libfile.flush()
+                os.fsync(libfile.fileno())
+                recovered = True
+    except FileNotFoundError:
+        pass
+
+    os.remove(journalPath(filepath))
+    return(recovered)
+
+#Write a journal atomically (temp file then rename)
+#It has the offset the data is written at, the old tail from there, the file's size and a hash of the bytes in front
+#of the offset, so recoverJournal can tell whether the file is still the one it was written for
+def writeJournal(libfile,filepath,offset,tail,data):
+    tempPath = journalPath(filepath)+".tmp"
+    journal = {"offset":offset,
+               "size":offset+len(tail),
+               "head":headHash(libfile,offset),
+               "tail":base64.b64encode(tail).decode("ascii"),
+               "data":base64.b64encode(data).decode("ascii")}
+
+    with open(tempPath,"w") as journalFile:
+        json.dump(journal,journalFile)
+        journalFile.flush()
+        os.fsync(journalFile.fileno())
+
+    os.replace(tempPath,journalPath(filepath))
+
+#Append blocks of lines (lists of strings, like makeLibPart makes) before the trailer of a library file
+#Only the end of the file is read and written, in a single write, with the line endings the file already has
+def appendBlocks(filepath,blocks,trailer):
+    recoverJournal(filepath)
+
+    data = "".join("{0}\n".format(line) for block in blocks for line in block)
+    data = "\n{0}{1}\n".format(data,trailer)
+
+    with open(filepath,"r+b") as libfile:
+        size = libfile.seek(0,os.SEEK_END)
+        tailStart = max(0,size-tailBytes)
+
+        while True:
+            libfile.seek(tailStart)
+            tail = libfile.read()
+            stripped = tail.rstrip((trailer+"\r").encode("utf-8")) #same as the old text mode libContents.rstrip(trailer)
+            if stripped or (tailStart == 0):
+                break
+            tailStart = max(0,tailStart-tailBytes)
+
+        if b"\r\n" in tail: #a CRLF checkout
+            data = data.replace("\n","\r\n")
+        data = data.encode("utf-8")
+
+        offset = tailStart+len(stripped)
+        writeJournal(libfile,filepath,offset,tail[len(stripped):],data)
+
+        libfile.seek(offset)
+        libfile.write(data)
+        libfile.truncate()
+        libfile.flush()
+        os.fsync(libfile.fileno())
+
+    os.remove(journalPath(filepath))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Symbol manifests, diffs and merges for kicadLibPop.py
+
+A manifest lists the blocks of a .lib or .dcm file (one per symbol or
+description, see kicadLibPopLib.splitLib) with a hash of each block's text.
+kicadLibPop.py saves one next to each file it regenerates or merges
+("SFUSat-cap.lib.manifest"), together with the file's size and mtime, so the
+manifest records the file as the script last left it.
+
+Two versions of a library are compared by their hashes alone, one dictionary
+lookup per symbol, so finding the symbols that changed (edited in KiCAD since
+the last regenerate, or different on another branch) takes time linear in the
+number of symbols. If a file hasn't changed since its manifest was saved, the
+file isn't even read.
+
+mergeBlocks merges two versions of a file symbol by symbol, three-way when the
+common base is known. Blocks whose hashes are the same are kept byte for byte
+and only the ones that differ are taken from the other side, so the merged
+file's git diff only shows the symbols that really changed.
+"""
+
+import hashlib
+import json
+import os
+
+from kicadLibPopLib import readText, splitDcm, splitLib
+
+manifestExt = ".manifest"
+
+#Hash of a block's text
+def blockHash(lines):
+    return(hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()[:16])
+
+#"lib" or "dcm" going by the header line of a file's text, or by its extension if the text has no header (git's
+#temporary merge files have none); None if neither tells
+def fileFormat(filepath,contents):
+    firstLine = contents.lstrip("\ufeff").split("\n",1)[0]
+
+    if firstLine.startswith("EESchema-DOCLIB"):
+        return("dcm")
+    if firstLine.startswith("EESchema-LIBRARY"):
+        return("lib")
+    if filepath.endswith(".dcm"):
+        return("dcm")
+    if filepath.endswith(".lib"):
+        return("lib")
+
+    return(None)
+
+#Split a .lib or .dcm file into (header lines, [(name, lines)], trailer lines)
+#The format is fileFormat's unless it's given; a file that's neither is split as a .lib
+def splitFile(filepath,contents=None,fileType=None):
+    if contents is None:
+        contents = readText(filepath)
+
+    if (fileType or fileFormat(filepath,contents)) == "dcm":
+        return(splitDcm(contents))
+
+    return(splitLib(contents))
+
+def manifestPath(filepath):
+    return(filepath+manifestExt)
+
+###############################################################################
+### MANIFESTS ###
+###############################################################################
+class Manifest:
+    def __init__(self,blocks,size=None,mtime=None):
+        self.blocks = blocks #[(name, hash)] in file order
+        self.hashes = dict(blocks)
+        self.size = size
+        self.mtime = mtime
+
+    #Manifest of a file as it is now (contents can be given if they're already in memory)
+    @classmethod
+    def fromFile(cls,filepath,contents=None):
+        stat = os.stat(filepath)
+        header, blocks, trailer = splitFile(filepath,contents)
+
+        return(cls([(name,blockHash(lines)) for name, lines in blocks],stat.st_size,stat.st_mtime_ns))
+
+    #Saved manifest of a file, or None if there isn't one
+    @classmethod
+    def load(cls,filepath):
+        try:
+            with open(manifestPath(filepath),"r",encoding="utf-8") as manifestFile:
+                data = json.load(manifestFile)
+        except (OSError, ValueError):
+            return(None)
+
+        return(cls([tuple(block) for block in data["blocks"]],data["size"],data["mtime"]))
+
+    #Whether the file is still the way it was when the manifest was made
+    def matches(self,filepath):
+        stat = os.stat(filepath)
+
+        return((stat.st_size == self.size) and (stat.st_mtime_ns == self.mtime))
+
+    #Save the manifest next to its file (temp file then rename)
+    def save(self,filepath):
+        tempPath = manifestPath(filepath)+".tmp"
+
+        with open(tempPath,"w",encoding="utf-8") as manifestFile:
+            json.dump({"size":self.size,"mtime":self.mtime,"blocks":self.blocks},manifestFile,ensure_ascii=False,indent=0)
+
+        os.replace(tempPath,manifestPath(filepath))
+
+    def __len__(self):
+        return(len(self.blocks))
+
+#Manifest of a file as it is now, without reading the file if the saved manifest is still up to date
+def currentManifest(filepath):
+    manifest = Manifest.load(filepath)
+    if (manifest is not None) and manifest.matches(filepath):
+        return(manifest)
+
+    return(Manifest.fromFile(filepath))
+
+#Save the manifest of a file that was just written
+def updateManifest(filepath,contents=None):
+    manifest = Manifest.fromFile(filepath,contents)
+    manifest.save(filepath)
+
+    return(manifest)
+
+###############################################################################
+### DIFFING ###
+###############################################################################
+#Symbols added, removed and changed between two manifests; returns a dictionary of name lists and the unchanged count
+def diffManifests(old,new):
+    added = [name for name, hash in new.blocks if not name in old.hashes]
+    removed = [name for name, hash in old.blocks if not name in new.hashes]
+    changed = [name for name, hash in new.blocks if (name in old.hashes) and (old.hashes[name] != hash)]
+
+    return({"added":added,
+            "removed":removed,
+            "changed":changed,
+            "unchanged":len(new.hashes)-len(added)-len(changed)})
+
+###############################################################################
+### MERGING ###
+###############################################################################
+#Merge two versions of a file's blocks ([(name, lines)], e.g. from splitFile) symbol by symbol
+#With the base version, a symbol changed or removed on one side only takes that side's version, and one changed
+#differently on both sides is a conflict (ours is kept). Without it, every symbol that differs is taken from theirs
+#and symbols only on one side are kept. Blocks are in our order, then the ones only theirs has in their order.
+#Returns (merged blocks, names of the symbols in conflict, number of blocks taken from theirs)
+def mergeBlocks(ours,theirs,base=None):
+    oursHashes = {name:blockHash(lines) for name, lines in ours}
+    theirsHashes = {name:blockHash(lines) for name, lines in theirs}
+    baseHashes = {name:blockHash(lines) for name, lines in base} if base is not None else None
+    theirsBlocks = dict(theirs)
+
+    merged = []
+    conflicts = []
+    taken = 0
+
+    for name, lines in ours:
+        oursHash = oursHashes[name]
+        theirsHash = theirsHashes.get(name)
+        baseHash = baseHashes.get(name) if baseHashes is not None else None
+
+        if theirsHash is None:
+            if (baseHash is not None) and (baseHash == oursHash):
+                continue #removed on their side
+            if baseHash is not None:
+                conflicts.append(name) #changed on ours, removed on theirs
+            merged.append((name,lines))
+        elif (theirsHash == oursHash) or (theirsHash == baseHash):
+            merged.append((name,lines))
+        elif (baseHashes is None) or (baseHash == oursHash):
+            merged.append((name,theirsBlocks[name]))
+            taken += 1
+        else:
+            conflicts.append(name)
+            merged.append((name,lines))
+
+    for name, lines in theirs:
+        if name in oursHashes:
+            continue
+
+        if (baseHashes is not None) and (name in baseHashes):
+            if baseHashes[name] == theirsHashes[name]:
+                continue #removed on our side
+            conflicts.append(name) #removed on ours, changed on theirs
+
+        merged.append((name,lines))
+        taken += 1
+
+    return(merged,conflicts,taken)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Product page parsers for kicadLibPop.py
+
+Only two tables on a Digi-Key product page are used: "product-details" and
+"prod-att-table". The backend used to pull them out can be chosen at run time:
+
+"html5lib"  - builds the whole page with BeautifulSoup and html5lib (slowest,
+              most forgiving)
+"strainer"  - BeautifulSoup limited to the two tables with a SoupStrainer
+              (lxml if it's installed, html.parser otherwise)
+"tokenizer" - streams the page through html.parser's tokenizer and keeps only
+              the rows of the two tables, stopping as soon as both are read.
+              Doesn't need bs4 at all.
+
+Whatever the backend, getTableRows returns the rows of a table as
+(rowAttrs,headerTexts,cellTexts) tuples, so the attribute parsing in
+kicadLibPop.py doesn't depend on the backend. A page without the table (a
+search or listing page, like Digi-Key gives for an MPN with several matches)
+has no rows.
+"""
+
+from html.parser import HTMLParser
+
+parserBackends = ("html5lib","strainer","tokenizer")
+productTableIds = ("product-details","prod-att-table")
+
+chunkSize = 64*1024 #characters fed to the tokenizer at a time
+
+#A page whose tables couldn't be made sense of
+class PageParseError(Exception):
+    pass
+
+###############################################################################
+### PARSING ###
+###############################################################################
+#Parse a product page with the chosen backend
+def parsePage(webpage,backend="tokenizer"):
+    if backend == "html5lib":
+        import bs4
+        return(bs4.BeautifulSoup(webpage,"html5lib"))
+
+    if backend == "strainer":
+        import bs4
+        strainer = bs4.SoupStrainer("table",id=list(productTableIds))
+        return(bs4.BeautifulSoup(webpage,strainerFeature(),parse_only=strainer))
+
+    if backend == "tokenizer":
+        tableParser = TableParser(productTableIds)
+        for start in range(0,len(webpage),chunkSize):
+            tableParser.feed(webpage[start:start+chunkSize])
+            if tableParser.isDone():
+                break
+        tableParser.close()
+        return(tableParser.tables)
+
+    raise ValueError("Unknown parser backend '{0}'".format(backend))
+
+#Fastest parser bs4 can use with a SoupStrainer
+def strainerFeature():
+    try:
+        import lxml
+        return("lxml")
+    except ImportError:
+        return("html.parser")
+
+#Rows of a table as (rowAttrs,headerTexts,cellTexts) tuples, or [] if the page doesn't have the table
+#Only the body rows are returned, the same as table.find("tbody").find_all("tr")
+def getTableRows(doc,tableId):
+    if isinstance(doc,dict):
+        return(doc.get(tableId,[]))
+
+    table = doc.find("table",{"id":tableId})
+    if table is None:
+        return([])
+    tbody = table.find("tbody")
+    rows = (tbody or table).find_all("tr")
+
+    return([(row.attrs,
+             [header.get_text() for header in row.find_all("th")],
+             [cell.get_text() for cell in row.find_all("td")]) for row in rows])
+
+###############################################################################
+### STREAMING TABLE PARSER ###
+###############################################################################
+#Collects the rows of the tables with the given ids, ignoring everything else
+#tables maps each table id to its list of (rowAttrs,headerTexts,cellTexts)
+class TableParser(HTMLParser):
+    def __init__(self,tableIds):
+        super().__init__(convert_charrefs=True)
+        self.tableIds = set(tableIds)
+        self.tables = {}
+
+        self.tableId = None #id of the table being read
+        self.depth = 0 #table nesting depth inside the table being read
+        self.sectionDepth = 0 #thead/tfoot nesting; those rows aren't body rows
+        self.row = None
+        self.cell = None #[tag,text pieces] of the open cell
+
+    def isDone(self):
+        return(len(self.tables) == len(self.tableIds) and self.tableId is None)
+
+    def handle_starttag(self,tag,attrs):
+        if self.tableId is None:
+            if tag == "table":
+                tableId = dict(attrs).get("id")
+                if (tableId in self.tableIds) and not (tableId in self.tables):
+                    self.tableId = tableId
+                    self.depth = 1
+                    self.tables[tableId] = []
+            return
+
+        if tag == "table":
+            self.depth += 1
+        elif self.depth > 1:
+            return #nested tables only add text to the cell they're in
+        elif tag in ("thead","tfoot"):
+            self.sectionDepth += 1
+        elif tag == "tr":
+            self.closeRow()
+            if self.sectionDepth == 0:
+                self.row = (dict(attrs),[],[])
+        elif tag in ("th","td"):
+            self.closeCell()
+            if self.row is not None:
+                self.cell = [tag,[]]
+
+    def handle_endtag(self,tag):
+        if self.tableId is None:
+            return
+
+        if tag == "table":
+            self.depth -= 1
+            if self.depth == 0:
+                self.closeRow()
+                self.tableId = None
+        elif self.depth > 1:
+            return
+        elif tag in ("thead","tfoot"):
+            self.sectionDepth = max(0,self.sectionDepth-1)
+        elif tag in ("tr","tbody"):
+            self.closeRow()
+        elif tag in ("th","td"):
+            self.closeCell()
+
+    def handle_data(self,data):
+        if self.cell is not None:
+            self.cell[1].append(data)
+
+    def closeCell(self):
+        if self.cell is None:
+            return
+
+        tag, pieces = self.cell
+        self.row[1 if tag == "th" else 2].append("".join(pieces))
+        self.cell = None
+
+    def closeRow(self):
+        self.closeCell()
+        if self.row is not None:
+            self.tables[self.tableId].append(self.row)
+            self.row = None
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Part category rules for kicadLibPop.py
+
+Each part family (capacitors, inductors, resistors, ...) is described by a
+rule in a table instead of a hand-written branch. A rule is a dictionary:
+
+"name"              - rule name
+"match"             - regex that must be found in the part's Categories
+"exclude"           - regex that must not be found (optional)
+"library"           - key of the library the part is written to
+"nameTemplate"      - str.format template for the symbol name
+"footprintLib"      - footprint library nickname
+"footprintTemplate" - str.format template for the footprint name
+"reference"         - reference designator, or a list of (regex, designator)
+                      pairs tried in order against the Categories
+plus anything the parameter functions or the caller need (value field,
+attribute config, symbol shape, ...).
+
+Template fields are looked up first in the parameter functions
+(func(productAttrDict,rule)) and then in the product attributes, so
+"{value}" is worked out and "{Voltage - Rated}" is copied as is.
+
+RuleSet compiles the table once: every matcher goes into a single regex of
+ordered lookaheads, so classifying a part is one regex match no matter how
+many rules there are, and the first rule in the table that matches wins.
+Templates are split into literal and field pieces up front, and name
+templates also into a regex that tells whether a symbol name could have been
+made from the template (so a name that was edited by hand isn't replaced).
+"""
+
+import re
+import string
+
+###############################################################################
+### COMPILING ###
+###############################################################################
+#Regex that matches at the start of the Categories if the pattern is found (and exclude isn't)
+def lookahead(pattern,exclude=None):
+    regex = "(?=.*?(?:{0}))".format(pattern) if pattern else ""
+    if exclude:
+        regex += "(?!.*?(?:{0}))".format(exclude)
+
+    return(regex)
+
+#One regex for a list of (pattern,exclude) pairs; the matched group is "r<index>" of the first pair that matches
+def compileAlternation(matchers):
+    alternatives = ["{0}(?P<r{1}>)".format(lookahead(pattern,exclude),index)
+                    for index, (pattern, exclude) in enumerate(matchers)]
+
+    return(re.compile("^(?:{0})".format("|".join(alternatives)),re.S))
+
+#Split a str.format template into (literal, field name or None) pieces
+def compileTemplate(template):
+    return([(literal,field) for literal, field, spec, conversion in string.Formatter().parse(template)])
+
+#Regex for the strings a template can give: the literals as they are, and any text for a field that doesn't have the
+#character that separates it from the next field (or the last one) in it
+#e.g. "C_{value}_{package}" matches "C_4u7_0603" but not "C_4u7_HIQ_0603"
+def compileTemplatePattern(pieces):
+    literals = [literal for literal, field in pieces]
+    regex = ""
+
+    for index, (literal, field) in enumerate(pieces):
+        regex += re.escape(literal)
+        if field is None:
+            continue
+
+        following = "".join(literals[index+1:])
+        separator = following[:1] or literal[-1:]
+        regex += "[^{0}]*".format(re.escape(separator)) if separator else ".*"
+
+    return(re.compile(regex+r"\Z",re.S))
+
+class RuleSet:
+    def __init__(self,rules,paramFuncs={}):
+        self.rules = rules
+        self.paramFuncs = paramFuncs
+        self.byName = {rule["name"]:rule for rule in rules}
+
+        self.matcher = compileAlternation([(rule["match"],rule.get("exclude")) for rule in rules])
+        self.templates = {}
+        self.namePatterns = {}
+        self.refMatchers = {}
+
+        for rule in rules:
+            for key in ("nameTemplate","footprintTemplate"):
+                if key in rule:
+                    self.templates[(rule["name"],key)] = compileTemplate(rule[key])
+            if "nameTemplate" in rule:
+                self.namePatterns[rule["name"]] = compileTemplatePattern(self.templates[(rule["name"],"nameTemplate")])
+
+            if not isinstance(rule["reference"],str):
+                self.refMatchers[rule["name"]] = compileAlternation([(pattern,None) for pattern, ref in rule["reference"]])
+
+    #Rule for a part's Categories; None if no rule matches (add a catch-all rule with match "" to avoid that)
+    def classify(self,categories):
+        match = self.matcher.match(categories)
+        if match is None:
+            return(None)
+
+        return(self.rules[int(match.lastgroup[1:])])
+
+    #Fill in one of a rule's templates for a part
+    def render(self,rule,key,productAttrDict):
+        pieces = []
+
+        for literal, field in self.templates[(rule["name"],key)]:
+            pieces.append(literal)
+
+            if field is None:
+                continue
+            if field in self.paramFuncs:
+                pieces.append(str(self.paramFuncs[field](productAttrDict,rule)))
+            else:
+                pieces.append(str(productAttrDict[field]))
+
+        return("".join(pieces))
+
+    #Whether the rule's name template could have given the name (with any field values)
+    def isTemplateName(self,rule,name):
+        return(self.namePatterns[rule["name"]].match(name) is not None)
+
+    #Reference designator of a part under a rule
+    def reference(self,rule,categories):
+        if isinstance(rule["reference"],str):
+            return(rule["reference"])
+
+        match = self.refMatchers[rule["name"]].match(categories)
+        if match is None:
+            return("U")
+
+        return(rule["reference"][int(match.lastgroup[1:])][1])
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Parametric part search for kicadLibPop.py
+
+Indexes the attribute fields (F4 and up) of the symbols in the part libraries
+so parts can be found by their parameters, e.g. every 0603 capacitor of at
+least 10µF and 16V:
+
+python kicadLibPop.py search --lib cap "package=0603" "capacitance>=10u" "voltage>=16V"
+
+Attribute values are read as a number with an SI prefix and a unit where they
+have one ("0.1µF" is 1e-07 F, "10 kOhms" is 10000 Ohm, "±10%" is 10 %). Only
+the first number counts, so "0.1W, 1/10W" is 0.1 W and "0603 (1608 Metric)"
+is 603. Numbers go in one sorted column per field and unit, so a range
+condition is two bisections and a query is the intersection of the parts its
+conditions match. A condition with a unit ("voltage>=16V") only looks at
+values with that unit. Values that aren't numbers are matched as text, case
+ignored: "=" against the whole value or its first word, "~" anywhere in it.
+
+Field names can be shortened to anything that picks out one field
+("capacitance", "voltage", "package"). The fields pulled out of each library
+are cached by the file's size and mtime, so a library is only read again
+after it changes.
+"""
+
+import bisect
+import json
+import os
+import re
+
+from kicadLibPopConst import siUnitToValDict
+from kicadLibPopLib import Library
+
+#Number, SI prefix and unit at the start of a value; U+FFFD is a µ that was mangled before V0.0.5
+valueRegex = re.compile(r"([-+]?\d*\.?\d+)\s?([yzafpnumkMGTPEZYµ�]?)([A-Za-z%Ω°]*)")
+valueLeadChars = "±�~<>≤≥ " #skipped in front of a number
+
+#Units an SI prefix can go in front of; anything else starting with a prefix letter is a unit on its own
+prefixedUnits = ["","F","H","V","A","W","Ohm","Ohms","Ω","Hz","s","m","g"]
+unitNames = {"Ohms":"Ohm","Ω":"Ohm"}
+
+#Short names for fields that a substring doesn't pick out
+fieldAliases = {"package":"Package / Case",
+                "voltage":"Voltage - Rated",
+                "power":"Power (Watts)",
+                "current":"Current Rating",
+                "category":"Categories",
+                "mpn":"Manufacturer Part Number 1",
+                "pn":"Supplier Part Number 1"}
+
+#"field op value"
+conditionRegex = re.compile(r"^\s*(.+?)\s*(>=|<=|=|<|>|~|≥|≤)\s*(.*?)\s*$")
+conditionOps = {"≥":">=","≤":"<="}
+
+###############################################################################
+### VALUES ###
+###############################################################################
+#Read the number at the start of a value as (value in base units, unit), or None if it doesn't start with one
+def parseQuantity(text):
+    match = valueRegex.match(text.lstrip(valueLeadChars))
+    if match is None:
+        return(None)
+
+    number, prefix, unit = match.groups()
+
+    if prefix and not unit in prefixedUnits:
+        prefix, unit = "", prefix+unit
+
+    if prefix in ("µ","�"):
+        prefix = "u"
+
+    value = float(number)*siUnitToValDict.get(prefix,1)
+    value = float("{0:.12g}".format(value)) #so 0.1µF and 100nF are the same number
+
+    return(value,unitNames.get(unit,unit))
+
+#Parse a condition like "capacitance>=10u" into (field, op, value)
+def parseCondition(condition):
+    match = conditionRegex.match(condition)
+    if match is None:
+        raise ValueError("Can't read the condition '{0}' (try something like capacitance>=10u)".format(condition))
+
+    field, op, value = match.groups()
+
+    return(field,conditionOps.get(op,op),value)
+
+#The fields of a symbol that are searched: its attributes plus its name and footprint
+def symbolFields(symbol):
+    fields = symbol.namedFields()
+    fields["Name"] = symbol.name
+    fields["Footprint"] = symbol.footprint
+
+    return(fields)
+
+#[(symbol name, fields)] of every symbol in a library
+def libraryParts(libPath):
+    library = Library(libPath).load()
+    parts = [(name,symbolFields(library.symbols[name])) for name in library.symbols]
+    library.close()
+
+    return(parts)
+
+###############################################################################
+### SEARCH INDEX ###
+###############################################################################
+class SearchIndex:
+    def __init__(self,cachePath=None):
+        self.cachePath = cachePath
+
+        self.parts = [] #(library key, symbol name, fields); a part's id is its position
+        self.fields = {} #lower case field name -> field name
+        self.columns = {} #field -> {unit: ([values], [part ids])}, sorted by value
+        self.unsorted = set() #(field, unit) of the columns loaded in bulk and not sorted yet
+
+    #Index the parts in the libraries ({library key: library path})
+    #Libraries that haven't changed since they were cached aren't read
+    def load(self,libraries):
+        cached = {}
+        if self.cachePath:
+            try:
+                with open(self.cachePath,"r",encoding="utf-8") as cacheFile:
+                    cached = json.load(cacheFile)
+            except (OSError, ValueError):
+                cached = {}
+
+        entries = {}
+        changed = False
+
+        for libKey, libPath in libraries.items():
+            stat = os.stat(libPath)
+            entry = cached.get(libPath)
+
+            if (entry is None) or (entry["size"] != stat.st_size) or (entry["mtime"] != stat.st_mtime_ns):
+                entry = {"size":stat.st_size,"mtime":stat.st_mtime_ns,"parts":libraryParts(libPath)}
+                changed = True
+
+            entries[libPath] = entry
+            for name, fields in entry["parts"]:
+                self.add(libKey,name,fields,keepSorted=False)
+
+        if self.cachePath and (changed or (set(cached) != set(entries))):
+            os.makedirs(os.path.dirname(self.cachePath),exist_ok=True)
+            with open(self.cachePath,"w",encoding="utf-8") as cacheFile:
+                json.dump(entries,cacheFile,ensure_ascii=False)
+
+        return(self)
+
+    #Add a part to the index
+    #With keepSorted, each value is inserted where it goes in its column, so a search right after (as an import does for
+    #every part) doesn't sort anything; without it values are appended and their columns sorted at the next search,
+    #which is faster for loading many parts at once
+    def add(self,libKey,name,fields,keepSorted=True):
+        partId = len(self.parts)
+        self.parts.append((libKey,name,fields))
+
+        for field, text in fields.items():
+            self.fields.setdefault(field.lower(),field)
+
+            quantity = parseQuantity(text)
+            if quantity is None:
+                continue
+
+            values, ids = self.columns.setdefault(field,{}).setdefault(quantity[1],([],[]))
+            if keepSorted and not ((field,quantity[1]) in self.unsorted):
+                index = bisect.bisect_right(values,quantity[0]) #after equal values, so ids stay in order among them
+                values.insert(index,quantity[0])
+                ids.insert(index,partId)
+            else:
+                values.append(quantity[0])
+                ids.append(partId)
+                self.unsorted.add((field,quantity[1]))
+
+    #Sort the columns that were loaded in bulk by value (once after they're loaded rather than on every add)
+    def sortColumns(self):
+        for field, unit in self.unsorted:
+            values, ids = self.columns[field][unit]
+            order = sorted(range(len(values)),key=values.__getitem__)
+            self.columns[field][unit] = ([values[index] for index in order],[ids[index] for index in order])
+
+        self.unsorted = set()
+
+    #The field a (possibly shortened) field name means
+    def resolveField(self,name):
+        key = name.lower()
+        key = fieldAliases.get(key,key).lower()
+
+        if key in self.fields:
+            return(self.fields[key])
+
+        matches = sorted(field for lowerField, field in self.fields.items() if key in lowerField)
+        if len(matches) == 1:
+            return(matches[0])
+        if not matches:
+            raise ValueError("No part has a field like '{0}'".format(name))
+
+        raise ValueError("'{0}' could be any of: {1}".format(name,", ".join(matches)))
+
+    #Ids of the parts whose field compares with value
+    def matchCondition(self,field,op,value):
+        quantity = parseQuantity(value) if op != "~" else None
+
+        if (quantity is not None) and (field in self.columns):
+            number, unit = quantity
+            units = self.columns[field]
+            ids = set()
+
+            for columnUnit in ([unit] if unit else list(units)):
+                if not columnUnit in units:
+                    continue
+
+                values, columnIds = units[columnUnit]
+                start, end = {">=":(bisect.bisect_left(values,number),len(values)),
+                              ">":(bisect.bisect_right(values,number),len(values)),
+                              "<=":(0,bisect.bisect_right(values,number)),
+                              "<":(0,bisect.bisect_left(values,number)),
+                              "=":(bisect.bisect_left(values,number),bisect.bisect_right(values,number))}[op]
+                ids.update(columnIds[start:end])
+
+            return(ids)
+
+        if not op in ("=","~"):
+            raise ValueError("'{0}' isn't a number, so it can only be matched with = or ~".format(value))
+
+        text = value.lower()
+        ids = set()
+
+        for partId, (libKey, name, fields) in enumerate(self.parts):
+            fieldValue = fields.get(field)
+            if fieldValue is None:
+                continue
+
+            fieldValue = fieldValue.lower()
+            if op == "~":
+                if text in fieldValue:
+                    ids.add(partId)
+            elif (fieldValue == text) or (re.split(r"[\s,]",fieldValue)[0] == text):
+                ids.add(partId)
+
+        return(ids)
+
+    #Parts matching every condition ((field, op, value) or "field op value"), optionally only in some libraries
+    #Returns [(library key, symbol name, fields)] in library order
+    def search(self,conditions,libKeys=None):
+        if self.unsorted:
+            self.sortColumns()
+
+        ids = None
+
+        for condition in conditions:
+            if isinstance(condition,str):
+                condition = parseCondition(condition)
+
+            field, op, value = condition
+            matches = self.matchCondition(self.resolveField(field),op,value)
+            ids = matches if ids is None else (ids & matches)
+
+        if ids is None:
+            ids = range(len(self.parts))
+
+        return([self.parts[partId] for partId in sorted(ids) if (libKeys is None) or (self.parts[partId][0] in libKeys)])
+
+    def __len__(self):
+        return(len(self.parts))
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Run instrumentation for kicadLibPop.py
+
+RunStats records where a batch import spends its time and what it did:
+
+stages   - seconds and calls per pipeline stage ("fetch", "parse", "classify",
+           "fixedAttrs", "duplicates", "write", ...), timed with
+           "with runStats.stage(name):". Stages can nest ("lookup" includes
+           "fetch" and "parse"), and stages run in the fetch threads add up
+           their time in every thread, so they can add up to more than the
+           run took.
+counters - how often something happened ("duplicates", "missingFootprints",
+           "fetchRetries", ...).
+parts    - each part's outcome (added, duplicate, failed), library and the
+           seconds it spent in each stage.
+
+report() puts these together with the wall time (and anything the caller adds,
+like cache stats) into a dictionary that save() writes as JSON.
+
+With profile=True every thread that runs a function wrapped by profiled(), and
+the thread that called start(), gets its own cProfile profiler; the results
+are merged into one .prof file and the slowest functions go in the report.
+With traceMemory=True tracemalloc records the peak memory and the lines that
+allocated the most.
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+class RunStats:
+    def __init__(self,profile=False,traceMemory=False):
+        self.profile = profile
+        self.traceMemory = traceMemory
+
+        self.stages = {} #name -> [seconds, calls]
+        self.counters = {}
+        self.parts = {} #partNum -> {"outcome":..., "library":..., "stages":{name: seconds}}
+        self.lock = threading.Lock()
+
+        self.started = None
+        self.finished = None
+        self.profilers = [] #one per thread that has been profiled
+        self.threadProfiler = threading.local()
+        self.memory = None
+
+    ###########################################################################
+    ### RECORDING ###
+    ###########################################################################
+    #Time a stage, optionally for a part: with runStats.stage("parse",partNum): ...
+    @contextlib.contextmanager
+    def stage(self,name,part=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name,time.perf_counter()-start,part)
+
+    def addTime(self,name,seconds,part=None):
+        with self.lock:
+            totals = self.stages.setdefault(name,[0.0,0])
+            totals[0] += seconds
+            totals[1] += 1
+
+            if part is not None:
+                partStages = self.partRecord(part)["stages"]
+                partStages[name] = partStages.get(name,0.0)+seconds
+
+    def count(self,name,amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0)+amount
+
+    #Record what happened to a part
+    def part(self,partNum,outcome,**details):
+        with self.lock:
+            record = self.partRecord(partNum)
+            record["outcome"] = outcome
+            record.update(details)
+
+    def partRecord(self,partNum):
+        if not partNum in self.parts:
+            self.parts[partNum] = {"outcome":None,"stages":{}}
+
+        return(self.parts[partNum])
+
+    ###########################################################################
+    ### PROFILING ###
+    ###########################################################################
+    def start(self):
+        self.started = time.time()
+        self.startClock = time.perf_counter()
+
+        if self.traceMemory:
+            tracemalloc.start()
+        if self.profile:
+            self.enableProfiler()
+
+        return(self)
+
+    def stop(self):
+        self.wallSeconds = time.perf_counter()-self.startClock
+        self.finished = time.time()
+
+        if self.profile:
+            self.threadProfiler.profiler.disable()
+        if self.traceMemory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.memory = {"currentBytes":current,
+                           "peakBytes":peak,
+                           "topLines":[{"line":"{0}:{1}".format(stat.traceback[0].filename,stat.traceback[0].lineno),
+                                        "bytes":stat.size,
+                                        "blocks":stat.count} for stat in snapshot.statistics("lineno")[:10]]}
+
+        return(self)
+
+    #Start profiling the current thread (once per thread)
+    def enableProfiler(self):
+        profiler = getattr(self.threadProfiler,"profiler",None)
+
+        if profiler is not None:
+            profiler.enable()
+            return(profiler)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        self.threadProfiler.profiler = profiler
+        with self.lock:
+            self.profilers.append(profiler)
+
+        return(profiler)
+
+    #Wrap a function run in worker threads so it's profiled too
+    def profiled(self,func):
+        if not self.profile:
+            return(func)
+
+        def profiledFunc(*args,**kwargs):
+            try:
+                profiler = self.enableProfiler()
+            except ValueError: #Python 3.12+ allows one active profiler, which already sees every thread
+                return(func(*args,**kwargs))
+
+            try:
+                return(func(*args,**kwargs))
+            finally:
+                profiler.disable()
+
+        return(profiledFunc)
+
+    #Merged profile of every thread, or None if profiling is off
+    def profileStats(self):
+        if not self.profilers:
+            return(None)
+
+        stats = pstats.Stats(self.profilers[0],stream=io.StringIO())
+        for profiler in self.profilers[1:]:
+            stats.add(profiler)
+
+        return(stats)
+
+    ###########################################################################
+    ### REPORTING ###
+    ###########################################################################
+    #Stage names, slowest first
+    def slowestStages(self):
+        return(sorted(self.stages,key=lambda name:-self.stages[name][0]))
+
+    #One line summary of the slowest stages
+    def summary(self,count=6):
+        return(", ".join("{0} {1:.2f} s".format(name,self.stages[name][0]) for name in self.slowestStages()[:count]))
+
+    #The run as a dictionary that can be written as JSON; extra is added as is
+    def report(self,extra=None,profileTop=25):
+        with self.lock:
+            report = {"started":time.strftime("%Y-%m-%dT%H:%M:%S",time.localtime(self.started)) if self.started else None,
+                      "wallSeconds":getattr(self,"wallSeconds",None),
+                      "stages":{name:{"seconds":self.stages[name][0],
+                                      "calls":self.stages[name][1],
+                                      "meanMs":1000*self.stages[name][0]/self.stages[name][1]}
+                                for name in self.slowestStages()},
+                      "counters":dict(sorted(self.counters.items())),
+                      "parts":[dict(record,part=partNum) for partNum, record in self.parts.items()]}
+
+        report.update(extra or {})
+
+        if self.memory is not None:
+            report["memory"] = self.memory
+
+        stats = self.profileStats()
+        if stats is not None:
+            functions = sorted(stats.stats.items(),key=lambda item:-item[1][3])[:profileTop] #by cumulative time
+            report["profile"] = [{"function":"{0}:{1}({2})".format(*function),
+                                  "calls":calls,
+                                  "totalSeconds":totalTime,
+                                  "cumulativeSeconds":cumulativeTime}
+                                 for function, (primitiveCalls, calls, totalTime, cumulativeTime, callers) in functions]
+
+        return(report)
+
+    #Write the report as JSON (and the merged profile next to it as <name>.prof if profiling); returns the report
+    def save(self,path,extra=None):
+        report = self.report(extra)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        with open(path,"w",encoding="utf-8") as reportFile:
+            json.dump(report,reportFile,ensure_ascii=False,indent=1)
+
+        stats = self.profileStats()
+        if stats is not None:
+            stats.dump_stats(os.path.splitext(path)[0]+".prof")
+
+        return(report)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Part store for kicadLibPop.py
+
+PartStore keeps every part kicadLibPop.py manages in SQLite: its supplier
+attributes (the productAttrDict), the fixed attributes makeFixedAttrs worked
+out (symbol name, reference, footprint, datasheet), the rule and library it
+belongs to, the drawing if it was drawn from a pin table, and a revision
+stamp. Parts are indexed by supplier part number, manufacturer part number,
+library and name, and by library and revision.
+
+Every batch (put, remove) is one transaction and gets the next revision
+number; parts the batch doesn't change keep their revision. Each part also
+records where and as what it was last written (syncedLibrary, syncedName,
+syncedRevision), so the parts that need writing are the ones whose revision
+is newer than that, found with an index range per library instead of by
+reading the libraries.
+
+For each library the store also keeps the revision it was last synced at,
+the size and mtime of its .lib and .dcm, and the names of every symbol in it
+(including the ones drawn by hand that aren't in the store). As long as the
+files haven't changed since, the names are known without reading the
+library; if someone edited it, the library is indexed again (see
+kicadLibPopLib.Library) before anything is written to it.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+from collections import namedtuple
+
+#A stored part; attrs is the productAttrDict, drawing (attribute config, symbol shape) or None
+StoredPart = namedtuple("StoredPart",["partNum","mpn","library","rule","name","reference","footprint","datasheet","attrs",
+                                      "drawing","deleted","revision","syncedLibrary","syncedName","syncedRevision"])
+
+#Columns a batch compares to decide whether a part changed
+contentColumns = ("mpn","library","rule","name","reference","footprint","datasheet","attrs","drawing","deleted")
+
+#What the store knows about a library file: the revision it was synced at, (size, mtime) of the .lib and .dcm
+#when it was last read or written, and the names of the symbols in it
+LibraryState = namedtuple("LibraryState",["library","revision","files","names"])
+
+#(size, mtime) of a file, or None if it doesn't exist
+def fileStamp(filepath):
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return(None)
+
+    return([stat.st_size,stat.st_mtime_ns])
+
+class PartStore:
+    def __init__(self,dbPath):
+        self.dbPath = dbPath
+
+        dbDir = os.path.dirname(dbPath)
+        if dbDir:
+            os.makedirs(dbDir,exist_ok=True)
+
+        self.db = sqlite3.connect(dbPath,isolation_level=None) #transactions are begun explicitly
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+        with self.transaction():
+            self.db.execute("CREATE TABLE IF NOT EXISTS parts ("
+                            "partNum TEXT PRIMARY KEY, "
+                            "mpn TEXT, "
+                            "library TEXT NOT NULL, "
+                            "rule TEXT NOT NULL, "
+                            "name TEXT NOT NULL, "
+                            "reference TEXT NOT NULL, "
+                            "footprint TEXT NOT NULL, "
+                            "datasheet TEXT NOT NULL, "
+                            "attrs TEXT NOT NULL, "
+                            "drawing TEXT, "
+                            "deleted INTEGER NOT NULL DEFAULT 0, "
+                            "revision INTEGER NOT NULL, "
+                            "updated REAL NOT NULL, "
+                            "syncedLibrary TEXT, "
+                            "syncedName TEXT, "
+                            "syncedRevision INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS partsByMpn ON parts (mpn COLLATE NOCASE)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS partsByName ON parts (library, name)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS partsByRevision ON parts (library, revision)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS partsBySyncedRevision ON parts (syncedLibrary, revision)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS libraries ("
+                            "library TEXT PRIMARY KEY, "
+                            "revision INTEGER NOT NULL, "
+                            "files TEXT NOT NULL, "
+                            "names TEXT NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES ('revision', 0)")
+
+    #One transaction: with store.transaction(): ... commits, or rolls back if anything raises
+    #BEGIN IMMEDIATE takes the write lock up front, so two imports can't hand out the same revision
+    @contextlib.contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    @property
+    def revision(self):
+        return(self.db.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0])
+
+    #Turn a row of the parts table into a StoredPart
+    @staticmethod
+    def readRow(row):
+        values = dict(zip(StoredPart._fields,row))
+        values["attrs"] = json.loads(values["attrs"])
+        values["drawing"] = tuple(json.loads(values["drawing"])) if values["drawing"] else None
+        values["deleted"] = bool(values["deleted"])
+
+        return(StoredPart(**values))
+
+    def select(self,where="",params=()):
+        rows = self.db.execute("SELECT {0} FROM parts {1}".format(", ".join(StoredPart._fields),where),params)
+
+        return([self.readRow(row) for row in rows])
+
+    ###########################################################################
+    ### BATCHES ###
+    ###########################################################################
+    #Add or update parts (StoredPart; revision and the synced columns are ignored) in one transaction
+    #Parts that are the same as what's stored are left alone; the rest get the next revision
+    #With synced, the parts are recorded as already written to their library as their name (imports write them
+    #straight away), and always get the new revision
+    #Returns the number of parts that changed
+    def put(self,parts,synced=False):
+        if not parts:
+            return(0)
+
+        with self.transaction():
+            revision = self.revision+1
+            now = time.time()
+            changes = self.db.total_changes
+
+            self.db.executemany("INSERT INTO parts ({0}, revision, updated, syncedLibrary, syncedName, syncedRevision) "
+                                "VALUES ({1}, :revision, :updated, :syncedLibrary, :syncedName, :syncedRevision) "
+                                "ON CONFLICT (partNum) DO UPDATE SET {2}, revision = excluded.revision, "
+                                "updated = excluded.updated, "
+                                "syncedLibrary = coalesce(excluded.syncedLibrary,syncedLibrary), "
+                                "syncedName = coalesce(excluded.syncedName,syncedName), "
+                                "syncedRevision = coalesce(excluded.syncedRevision,syncedRevision) "
+                                "WHERE ({3}) IS NOT ({4}) OR excluded.syncedName IS NOT NULL".format("partNum, "+", ".join(contentColumns),
+                                                                 ", ".join(":"+column for column in ("partNum",)+contentColumns),
+                                                                 ", ".join("{0} = excluded.{0}".format(column) for column in contentColumns),
+                                                                 ", ".join("parts."+column for column in contentColumns),
+                                                                 ", ".join("excluded."+column for column in contentColumns)),
+                                [{"partNum":part.partNum,
+                                  "mpn":part.mpn,
+                                  "library":part.library,
+                                  "rule":part.rule,
+                                  "name":part.name,
+                                  "reference":part.reference,
+                                  "footprint":part.footprint,
+                                  "datasheet":part.datasheet,
+                                  "attrs":json.dumps(part.attrs,ensure_ascii=False,sort_keys=True),
+                                  "drawing":json.dumps(part.drawing,ensure_ascii=False,sort_keys=True) if part.drawing else None,
+                                  "deleted":int(bool(part.deleted)),
+                                  "revision":revision,
+                                  "updated":now,
+                                  "syncedLibrary":part.library if synced else None,
+                                  "syncedName":part.name if synced else None,
+                                  "syncedRevision":revision if synced else None} for part in parts])
+
+            changed = self.db.total_changes-changes
+            if changed:
+                self.db.execute("UPDATE meta SET value = ? WHERE key = 'revision'",(revision,))
+
+        return(changed)
+
+    #Mark parts (supplier part numbers) as removed; the next sync takes them out of their libraries
+    #Returns the number of parts removed
+    def remove(self,partNums):
+        with self.transaction():
+            revision = self.revision+1
+            removed = 0
+
+            for partNum in partNums:
+                removed += self.db.execute("UPDATE parts SET deleted = 1, revision = ?, updated = ? WHERE partNum = ? AND NOT deleted",
+                                           (revision,time.time(),partNum)).rowcount
+
+            if removed:
+                self.db.execute("UPDATE meta SET value = ? WHERE key = 'revision'",(revision,))
+
+        return(removed)
+
+    ###########################################################################
+    ### QUERIES ###
+    ###########################################################################
+    #The part with a supplier part number, or None
+    def get(self,partNum):
+        parts = self.select("WHERE partNum = ?",(partNum,))
+
+        return(parts[0] if parts else None)
+
+    #Parts with a manufacturer part number (case ignored)
+    def findMpn(self,mpn):
+        return(self.select("WHERE mpn = ? COLLATE NOCASE",(mpn.strip(),)))
+
+    #The part with a symbol name in a library, or None
+    def findName(self,library,name):
+        parts = self.select("WHERE library = ? AND name = ? AND NOT deleted",(library,name))
+
+        return(parts[0] if parts else None)
+
+    #Parts in a library (or every library) changed after a revision, oldest change first
+    def changedSince(self,revision=0,library=None):
+        if library is None:
+            return(self.select("WHERE revision > ? ORDER BY revision, partNum",(revision,)))
+
+        return(self.select("WHERE library = ? AND revision > ? ORDER BY revision, partNum",(library,revision)))
+
+    #Parts whose library doesn't have their current revision yet: (parts to write to the library, parts to take out of
+    #it because they were removed or moved to another library), oldest change first
+    #Only parts changed since the library was last synced are looked at
+    def pending(self,library):
+        state = self.libraryState(library)
+        since = state.revision if state is not None else 0
+
+        incoming = [part for part in self.select("WHERE library = ? AND revision > ? ORDER BY revision, partNum",(library,since))
+                    if (not part.deleted) and ((part.syncedRevision is None) or (part.syncedRevision < part.revision)
+                                               or (part.syncedLibrary != library))]
+        outgoing = [part for part in self.select("WHERE syncedLibrary = ? AND revision > ? ORDER BY revision, partNum",(library,since))
+                    if (part.syncedName is not None) and (part.deleted or (part.library != library))
+                    and ((part.syncedRevision is None) or (part.syncedRevision < part.revision))]
+
+        return(incoming,outgoing)
+
+    #Record that parts were written to their libraries (and that removed ones were taken out) in one transaction
+    def markSynced(self,written,takenOut=()):
+        with self.transaction():
+            for part in written:
+                self.db.execute("UPDATE parts SET syncedLibrary = ?, syncedName = ?, syncedRevision = ? WHERE partNum = ?",
+                                (part.library,part.name,part.revision,part.partNum))
+            for part in takenOut:
+                if part.deleted:
+                    self.db.execute("DELETE FROM parts WHERE partNum = ? AND revision = ?",(part.partNum,part.revision))
+                else: #moved; it's written to its new library separately
+                    self.db.execute("UPDATE parts SET syncedLibrary = NULL, syncedName = NULL WHERE partNum = ? AND syncedLibrary = ?",
+                                    (part.partNum,part.syncedLibrary))
+
+    ###########################################################################
+    ### LIBRARIES ###
+    ###########################################################################
+    #The LibraryState of a library, or None if it hasn't been synced
+    def libraryState(self,library):
+        row = self.db.execute("SELECT library, revision, files, names FROM libraries WHERE library = ?",(library,)).fetchone()
+        if row is None:
+            return(None)
+
+        return(LibraryState(row[0],row[1],json.loads(row[2]),json.loads(row[3])))
+
+    #Record a library's files and symbol names; revision is the store revision it's up to date with
+    def setLibraryState(self,library,revision,filepaths,names):
+        with self.transaction():
+            self.db.execute("INSERT OR REPLACE INTO libraries VALUES (?, ?, ?, ?)",
+                            (library,revision,json.dumps([fileStamp(filepath) for filepath in filepaths]),
+                             json.dumps(sorted(names),ensure_ascii=False)))
+
+    #Whether a library's files are as they were when its state was recorded
+    def isUnchanged(self,library,filepaths):
+        state = self.libraryState(library)
+
+        return((state is not None) and (state.files == [fileStamp(filepath) for filepath in filepaths]))
+
+    def stats(self):
+        parts, deleted, pending = self.db.execute("SELECT count(*), coalesce(sum(deleted),0), "
+                                                  "coalesce(sum(syncedRevision IS NULL OR syncedRevision < revision),0) "
+                                                  "FROM parts").fetchone()
+
+        return({"parts":parts-deleted,
+                "removed":deleted,
+                "pending":pending,
+                "revision":self.revision})
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Supplier backends for kicadLibPop.py
+
+A backend looks a part up by supplier part number or by manufacturer part
+number (MPN) and returns it as a productAttrDict with the same fields the
+Digi-Key product page gives: "Supplier 1", "Supplier Part Number 1",
+"Manufacturer 1", "Manufacturer Part Number 1", "Description", "Categories"
+and the part's parameters ("Capacitance", "Package / Case", ...). It returns
+None if it doesn't have the part, and raises FetchError (or CacheMiss, or
+PageParseError for a page it couldn't read) if it couldn't find out.
+
+Suppliers asks several backends for the same part at once. With the "first"
+strategy the first backend to have the part wins; local catalogs are asked
+before the network backends, since they answer straight away. With
+"complete", every backend is asked and the answer with the most fields wins.
+
+DigiKeySupplier wraps the product page fetching and parsing in kicadLibPop.py.
+LocalCatalog answers from a CSV/TSV file or an SQLite database with one row
+per part and a column per field. Put it in front of Digi-Key (and use the
+"offline" page cache mode) to resolve a whole BOM without the network.
+
+Mouser isn't supported yet; a backend for it only needs lookup and lookupMpn.
+"""
+
+import abc
+import csv
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+#Fields that come from the product details table; the others have their quotation marks escaped (see getProdAttrs)
+detailFields = ("Supplier 1","Supplier Part Number 1","Manufacturer 1","Manufacturer Part Number 1","Description")
+
+strategies = ("first","complete")
+
+###############################################################################
+### BACKENDS ###
+###############################################################################
+#Base of the backends; one that doesn't have both lookups can't be made
+class Supplier(abc.ABC):
+    name = "supplier"
+    remote = True #whether the backend goes over the network
+    keepAttrs = False #whether its answers can be kept in the attribute store (only versioned page parsing, see parserVersion)
+
+    #productAttrDict for a supplier part number, or None if the supplier doesn't have it
+    @abc.abstractmethod
+    def lookup(self,partNum):
+        pass
+
+    #productAttrDict for a manufacturer part number, or None if the supplier doesn't have it
+    @abc.abstractmethod
+    def lookupMpn(self,mpn):
+        pass
+
+#Whether a part is the one an MPN asked for
+def matchesMpn(productAttrDict,mpn):
+    return(productAttrDict.get("Manufacturer Part Number 1","").strip().lower() == mpn.strip().lower())
+
+#Digi-Key product pages; getAttrs(key) fetches and parses the page Digi-Key gives for a part number or MPN
+class DigiKeySupplier(Supplier):
+    name = "Digi-Key"
+    keepAttrs = True
+
+    def __init__(self,getAttrs):
+        self.getAttrs = getAttrs
+
+    def lookup(self,partNum):
+        productAttrDict = self.getAttrs(partNum)
+
+        return(productAttrDict if "Categories" in productAttrDict else None) #a search page instead of a product
+
+    #Digi-Key shows the product page for an MPN when only one product has it, and a search page otherwise
+    def lookupMpn(self,mpn):
+        productAttrDict = self.getAttrs(mpn)
+
+        return(productAttrDict if matchesMpn(productAttrDict,mpn) else None)
+
+#Parts from a CSV/TSV file or SQLite database (table "parts", or its only table) with a column per field
+class LocalCatalog(Supplier):
+    remote = False
+
+    def __init__(self,path,supplier="Digi-Key",ignoreFields=(),table="parts"):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.supplier = supplier #"Supplier 1" of rows that don't say
+        self.ignoreFields = set(ignoreFields)
+        self.table = table
+
+        self.isSqlite = os.path.splitext(path)[1].lower() in (".sqlite",".sqlite3",".db")
+        self.byPartNum = None #CSV rows by part number and lower case MPN, read the first time they're needed
+        self.byMpn = None
+        self.db = None
+        self.lock = threading.Lock()
+
+    #Turn a row into a productAttrDict: empty and ignored fields dropped, quotation marks escaped like Digi-Key's
+    def normalize(self,row):
+        productAttrDict = {}
+
+        for field, value in row.items():
+            if (field is None) or (value is None):
+                continue
+
+            field = field.strip()
+            value = str(value).strip()
+            if (not value) or (field in self.ignoreFields):
+                continue
+
+            if (not field in detailFields) and ('"' in value) and (not '\\"' in value):
+                value = value.replace('"','\\"')
+
+            productAttrDict[field] = value
+
+        productAttrDict.setdefault("Supplier 1",self.supplier)
+
+        return(productAttrDict)
+
+    def loadCsv(self):
+        with self.lock:
+            if self.byPartNum is None:
+                self.readCsv()
+
+    def readCsv(self):
+        byPartNum = {}
+        byMpn = {}
+
+        with open(self.path,"r",encoding="utf-8-sig",newline="") as catalogFile:
+            firstLine = catalogFile.readline()
+            catalogFile.seek(0)
+
+            for row in csv.DictReader(catalogFile,delimiter="\t" if "\t" in firstLine else ","):
+                productAttrDict = self.normalize(row)
+
+                if "Supplier Part Number 1" in productAttrDict:
+                    byPartNum.setdefault(productAttrDict["Supplier Part Number 1"],productAttrDict)
+                if "Manufacturer Part Number 1" in productAttrDict:
+                    byMpn.setdefault(productAttrDict["Manufacturer Part Number 1"].lower(),productAttrDict)
+
+        self.byPartNum, self.byMpn = byPartNum, byMpn
+
+    #First row of the SQLite table where column = value (case ignored for MPNs)
+    def queryRow(self,column,value,noCase=False):
+        with self.lock:
+            if self.db is None:
+                self.db = sqlite3.connect("file:{0}?mode=ro".format(quote(os.path.abspath(self.path))),uri=True,
+                                          check_same_thread=False)
+                self.db.row_factory = sqlite3.Row
+
+                tables = [row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                if (not self.table in tables) and (len(tables) == 1):
+                    self.table = tables[0]
+
+            row = self.db.execute('SELECT * FROM "{0}" WHERE "{1}" = ?{2} LIMIT 1'.format(self.table.replace('"','""'),
+                                                                                          column,
+                                                                                          " COLLATE NOCASE" if noCase else ""),
+                                  (value,)).fetchone()
+
+        return(None if row is None else self.normalize(dict(zip(row.keys(),row))))
+
+    def lookup(self,partNum):
+        if self.isSqlite:
+            return(self.queryRow("Supplier Part Number 1",partNum))
+
+        if self.byPartNum is None:
+            self.loadCsv()
+        return(self.byPartNum.get(partNum))
+
+    def lookupMpn(self,mpn):
+        if self.isSqlite:
+            return(self.queryRow("Manufacturer Part Number 1",mpn.strip(),noCase=True))
+
+        if self.byMpn is None:
+            self.loadCsv()
+        return(self.byMpn.get(mpn.strip().lower()))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+###############################################################################
+### FAN-OUT ###
+###############################################################################
+class Suppliers:
+    def __init__(self,backends,strategy="first",concurrency=4):
+        if not strategy in strategies:
+            raise ValueError("Unknown supplier strategy '{0}'".format(strategy))
+
+        self.backends = backends
+        self.strategy = strategy
+        self.pool = ThreadPoolExecutor(max_workers=max(1,concurrency)*len(backends))
+        self.resolved = {} #parts found by MPN, by supplier part number, so looking them up again is free
+        self.answers = {backend.name:0 for backend in backends} #parts each backend supplied
+
+    #Call backend.<method>(key) on the backends at once; returns (the backend that answered, its productAttrDict), or
+    #(None, None) if no backend has the part
+    #With the "first" strategy, local backends are asked before the rest since they answer straight away, so the
+    #network is only used for parts none of them have
+    #If no backend has the part and any of them failed, the first failure is raised
+    def ask(self,method,key):
+        backends = self.backends
+        results = [] #(backend, productAttrDict)
+
+        if self.strategy == "first":
+            for backend in [backend for backend in backends if not backend.remote]:
+                results.append((backend,getattr(backend,method)(key)))
+                if results[-1][1]:
+                    return(self.choose(results))
+
+            backends = [backend for backend in backends if backend.remote]
+
+        if len(backends) == 1:
+            results.append((backends[0],getattr(backends[0],method)(key)))
+            return(self.choose(results))
+
+        futures = {self.pool.submit(getattr(backend,method),key):backend for backend in backends}
+        pending = set(futures)
+        errors = []
+
+        while pending:
+            done, pending = wait(pending,return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    results.append((futures[future],future.result()))
+                except Exception as error:
+                    errors.append(error)
+
+            if (self.strategy == "first") and any(productAttrDict for backend, productAttrDict in results):
+                break
+
+        if errors and not any(productAttrDict for backend, productAttrDict in results):
+            raise errors[0]
+
+        return(self.choose(results))
+
+    #The answer to use out of [(backend, productAttrDict or None)] as (backend, productAttrDict), or (None, None) if no
+    #backend has the part
+    def choose(self,results):
+        found = [(backend,productAttrDict) for backend, productAttrDict in results if productAttrDict]
+        if not found:
+            return(None,None)
+
+        if self.strategy == "complete":
+            order = {backend.name:index for index, backend in enumerate(self.backends)} #ties go to the earlier backend
+            found.sort(key=lambda result:(-len(result[1]),order[result[0].name]))
+
+        backend, productAttrDict = found[0]
+        self.answers[backend.name] += 1
+
+        return(backend,productAttrDict)
+
+    #(backend, productAttrDict) for a supplier part number, or (None, None) if no backend has it
+    def lookup(self,partNum):
+        answer = self.resolved.pop(partNum,None)
+        if answer is not None:
+            return(answer)
+
+        return(self.ask("lookup",partNum))
+
+    #(backend, productAttrDict) for a manufacturer part number, or (None, None) if no backend has it
+    def lookupMpn(self,mpn):
+        backend, productAttrDict = self.ask("lookupMpn",mpn)
+
+        if (productAttrDict is not None) and ("Supplier Part Number 1" in productAttrDict):
+            self.resolved[productAttrDict["Supplier Part Number 1"]] = (backend,productAttrDict)
+
+        return(backend,productAttrDict)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+        for backend in self.backends:
+            if hasattr(backend,"close"):
+                backend.close()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Symbol generation from pin tables for kicadLibPop.py
+
+Parts that don't fit a rule's fixed shape (everything in SFUSat.lib) used to
+get an empty symbol that had to be drawn by hand. generateSymbol draws one
+from a pin table instead: a CSV/TSV file with a row per pin and columns for
+
+Number - pin or ball number (also "Pin", "Pin Number", "Ball", "Pad")
+Name   - pin name (also "Pin Name", "Signal")
+Type   - electrical type (optional): input, output, bidirectional, tristate,
+         passive, power, power out, open collector, open emitter, nc,
+         unspecified, or KiCAD's letter (I, O, B, T, P, W, w, C, E, N, U)
+Group  - unit the pin goes in (optional; also "Bank", "Unit", "Port",
+         "Function")
+Side   - left or right (optional)
+
+Pins go in one unit per group. Without a group column they're grouped by
+function: supply pins ("Power"), ground pins ("GND"), no-connects ("NC") and
+signals by port, the start of their name without the trailing number
+("GIOA0" and "GIOA7" go in "GIOA", "N2HET1_12" in "N2HET"). Ports with fewer
+than minGroupPins pins go together in "Misc". A group with more than maxPins
+pins is split over several units, so packages with hundreds of pins end up
+as a few readable units. A symbol can have up to maxUnits units.
+
+In each unit inputs go on the left, outputs on the right and the rest on
+whichever side keeps the two even, in natural name order, 100 mil apart with
+the names inside a box wide enough for the longest one. Pins without a type
+are passive, or power if their name looks like a supply or ground.
+
+The generated symbol replaces the empty DRAW section of a part imported into
+SFUSat.lib when its manufacturer part number has a pin table (see
+findPinTable), and "kicadLibPop.py symgen" writes symbols from pin tables
+straight into a library.
+"""
+
+import copy
+import csv
+import os
+import re
+
+from collections import namedtuple
+
+#Column names for each pin table column, tried in order (case ignored)
+pinColumns = {"number":("Number","Pin","Pin Number","Pin #","Ball","Pad","No"),
+              "name":("Name","Pin Name","Signal","Signal Name"),
+              "type":("Type","Electrical Type","Direction","I/O"),
+              "group":("Group","Bank","Unit","Port","Function"),
+              "side":("Side",)}
+
+#Electrical types by name; single letters are KiCAD's own and are used as they are
+pinTypeNames = {"input":"I","in":"I",
+                "output":"O","out":"O",
+                "bidirectional":"B","bidir":"B","bidi":"B","io":"B","i/o":"B","inout":"B",
+                "tristate":"T","tri-state":"T","3-state":"T",
+                "passive":"P",
+                "power":"W","power in":"W","power input":"W","supply":"W","ground":"W","gnd":"W","pwr":"W",
+                "power out":"w","power output":"w",
+                "open collector":"C","open drain":"C","oc":"C","od":"C",
+                "open emitter":"E","open source":"E",
+                "nc":"N","no connect":"N","not connected":"N",
+                "unspecified":"U"}
+pinTypeLetters = "IOBTPWwCENU"
+
+sideNames = {"left":"L","l":"L","right":"R","r":"R"}
+
+#Pin names that are supplies or grounds when the table doesn't give a type
+groundRegex = re.compile(r"^(?:[ADP]?(?:GND|VSS|VEE)\w*|\w*GND)$",re.I)
+supplyRegex = re.compile(r"^(?:[ADP]|IO)?V(?:CC|DD|BAT|IN)\w*$",re.I)
+ncRegex = re.compile(r"^(?:NC|N/C|DNC)$",re.I)
+
+minGroupPins = 4 #ports with fewer pins go in "Misc"
+maxPins = 48 #pins per unit before a group is split
+maxUnits = 26 #units a symbol can have
+
+#Drawing sizes (mils)
+pinSpacing = 100
+pinLength = 200
+pinTextSize = 50
+charWidth = 50 #rough width of a character of pinTextSize text
+labelSize = 60
+
+#A row of a pin table; type is KiCAD's letter, group and side are "" if the table doesn't say
+Pin = namedtuple("Pin",["number","name","type","group","side"])
+
+#A generated symbol: units is [(label, [Pin])] in unit order, shape the DRAW ... ENDDRAW text, and top and bottom the
+#highest and lowest y of any unit's box
+GeneratedSymbol = namedtuple("GeneratedSymbol",["units","shape","top","bottom"])
+
+###############################################################################
+### PIN TABLES ###
+###############################################################################
+#Sort key that puts PA2 before PA10
+def naturalKey(text):
+    return([int(piece) if piece.isdigit() else piece.lower() for piece in re.split(r"(\d+)",text)])
+
+#KiCAD's letter for an electrical type, or None if it isn't one
+def pinType(text):
+    text = text.strip()
+    if (len(text) == 1) and (text in pinTypeLetters):
+        return(text)
+
+    return(pinTypeNames.get(text.lower()))
+
+#Electrical type of a pin the table doesn't give one for
+def guessPinType(name):
+    if groundRegex.match(name) or supplyRegex.match(name):
+        return("W")
+    if ncRegex.match(name):
+        return("N")
+
+    return("P")
+
+#Map each pin table column to the first header that names it
+def findColumns(header):
+    headers = {name.strip().lower():index for index, name in reversed(list(enumerate(header)))}
+    columns = {}
+
+    for column, names in pinColumns.items():
+        for name in names:
+            if name.lower() in headers:
+                columns[column] = headers[name.lower()]
+                break
+
+    return(columns)
+
+#Read a pin table (CSV or TSV with a header) into a list of Pin
+#Raises ValueError if there's no pin number column, a type or side can't be read, or a pin number is used twice
+def readPinTable(path):
+    pins = []
+
+    with open(path,"r",encoding="utf-8-sig",newline="") as tableFile:
+        firstLine = tableFile.readline()
+        tableFile.seek(0)
+        rows = csv.reader(tableFile,delimiter="\t" if "\t" in firstLine else ",")
+
+        columns = findColumns(next(rows,[]))
+        if not "number" in columns:
+            raise ValueError("{0} has no pin number column (one of: {1})".format(path,", ".join(pinColumns["number"])))
+
+        def cell(row,column):
+            index = columns.get(column)
+            return(row[index].strip() if (index is not None) and (index < len(row)) else "")
+
+        for lineNum, row in enumerate(rows,2):
+            number = cell(row,"number")
+            if not number:
+                continue
+
+            name = cell(row,"name")
+            typeText = cell(row,"type")
+            sideText = cell(row,"side")
+
+            electricalType = pinType(typeText) if typeText else guessPinType(name)
+            if electricalType is None:
+                raise ValueError("{0}:{1}: unknown pin type '{2}'".format(path,lineNum,typeText))
+
+            side = sideNames.get(sideText.lower(),None) if sideText else ""
+            if side is None:
+                raise ValueError("{0}:{1}: unknown side '{2}' (left or right)".format(path,lineNum,sideText))
+
+            pins.append(Pin(number,name,electricalType,cell(row,"group"),side))
+
+    seen = set()
+    duplicates = sorted({pin.number for pin in pins if (pin.number in seen) or seen.add(pin.number)},key=naturalKey)
+    if duplicates:
+        raise ValueError("{0} has more than one row for pin {1}".format(path,", ".join(duplicates)))
+
+    return(pins)
+
+#Path of the pin table for a manufacturer part number in a directory (<MPN>.csv, .tsv or .txt), or None
+def findPinTable(directory,mpn):
+    if not (directory and mpn):
+        return(None)
+
+    stem = re.sub(r'[\\/:*?"<>|]',"_",mpn.strip())
+    for extension in (".csv",".tsv",".txt"):
+        path = os.path.join(directory,stem+extension)
+        if os.path.isfile(path):
+            return(path)
+
+    return(None)
+
+###############################################################################
+### GROUPING ###
+###############################################################################
+#Port a signal belongs to: the first name of the pin, up to any "_", without its trailing number
+def portName(name):
+    first = re.split(r"[/_ ]",name,maxsplit=1)[0]
+
+    return(first.rstrip("0123456789") or first)
+
+#Group name of a pin in a table without a group column
+def functionGroup(pin):
+    if pin.type in ("W","w"):
+        return("GND" if groundRegex.match(pin.name) else "Power")
+    if pin.type == "N":
+        return("NC")
+
+    return(portName(pin.name))
+
+#Split pins into units: [(label, [Pin])]
+#Raises ValueError if that takes more than unitLimit units
+def groupPins(pins,pinLimit=maxPins,unitLimit=maxUnits):
+    groups = {} #group name -> pins, in the order groups first appear
+    byFunction = not any(pin.group for pin in pins)
+
+    for pin in pins:
+        groups.setdefault(functionGroup(pin) if byFunction else (pin.group or "Misc"),[]).append(pin)
+
+    if byFunction:
+        lastGroups = ("Misc","Power","GND","NC")
+        misc = []
+        for name in list(groups):
+            if ((len(groups[name]) < minGroupPins) and not name in lastGroups) or (name == "Misc"):
+                misc += groups.pop(name)
+
+        for name in lastGroups:
+            members = misc if name == "Misc" else groups.pop(name,[])
+            if members:
+                groups[name] = members
+
+    units = []
+    for name, members in groups.items():
+        members = sorted(members,key=lambda pin:(naturalKey(pin.name),naturalKey(pin.number)))
+        label = re.sub(r"\s+","_",name.strip()) or "Misc"
+        chunks = [members[start:start+pinLimit] for start in range(0,len(members),max(1,pinLimit))]
+
+        for chunkNum, chunk in enumerate(chunks,1):
+            units.append((label if len(chunks) == 1 else "{0}_{1}".format(label,chunkNum),chunk))
+
+    if len(units) > unitLimit:
+        raise ValueError("{0} pins need {1} units, but a symbol can have {2}; allow more pins per unit or group "
+                         "the pins in the table".format(len(pins),len(units),unitLimit))
+
+    return(units)
+
+###############################################################################
+### DRAWING ###
+###############################################################################
+#(left pins, right pins) of a unit: inputs left, outputs right, the rest split to keep the sides even
+def splitSides(pins):
+    left = [pin for pin in pins if (pin.side == "L") or ((not pin.side) and (pin.type == "I"))]
+    right = [pin for pin in pins if (pin.side == "R") or ((not pin.side) and (pin.type in "OTwCE"))]
+    rest = [pin for pin in pins if (not pin.side) and (not pin.type in "IOTwCE")]
+
+    toLeft = max(0,min(len(rest),(len(pins)+1)//2-len(left)))
+
+    return(left+rest[:toLeft],right+rest[toLeft:])
+
+#Pin name as a single word ("~" for no name)
+def pinLabel(name):
+    return(re.sub(r"\s+","_",name.strip()) or "~")
+
+#DRAW lines of a unit, centred near the origin; returns (lines, top of its box, bottom of its box)
+def drawUnit(unit,label,pins):
+    left, right = splitSides(pins)
+    rows = max(len(left),len(right),1)
+
+    nameWidth = max([len(pinLabel(pin.name)) for pin in pins]+[len(label)//2])*charWidth
+    halfWidth = max(300,-(-(nameWidth+pinSpacing)//pinSpacing)*pinSpacing) #whole multiple of the pin spacing
+    top = pinSpacing*(rows//2) #y of the first row
+    boxTop = top+pinSpacing
+    boxBottom = top-rows*pinSpacing
+
+    lines = ["S {0} {1} {2} {3} {4} 1 10 f".format(-halfWidth,boxTop,halfWidth,boxBottom,unit),
+             "T 0 0 {0} {1} 0 {2} 1 {3} Normal 0 C C".format(boxTop+pinSpacing//2+labelSize//2,labelSize,unit,label)]
+
+    for side, sidePins in (("L",left),("R",right)):
+        x = -(halfWidth+pinLength) if side == "L" else halfWidth+pinLength
+        for row, pin in enumerate(sidePins):
+            lines.append("X {0} {1} {2} {3} {4} {5} {6} {6} {7} 1 {8}".format(pinLabel(pin.name),pin.number,x,top-row*pinSpacing,
+                                                                         pinLength,"R" if side == "L" else "L",
+                                                                         pinTextSize,unit,pin.type))
+
+    return(lines,boxTop,boxBottom)
+
+#Draw a symbol with a unit per group of pins (see groupPins)
+def generateSymbol(pins,pinLimit=maxPins,unitLimit=maxUnits):
+    if not pins:
+        raise ValueError("no pins to draw")
+
+    units = groupPins(pins,pinLimit,unitLimit)
+    lines = ["DRAW"]
+    tops = []
+    bottoms = []
+
+    for unit, (label, unitPins) in enumerate(units,1):
+        unitLines, boxTop, boxBottom = drawUnit(unit,label,unitPins)
+        lines += unitLines
+        tops.append(boxTop)
+        bottoms.append(boxBottom)
+
+    lines.append("ENDDRAW")
+
+    return(GeneratedSymbol(units,"\n".join(lines),max(tops),min(bottoms)))
+
+#Attribute config (see kicadLibPop.py) for a generated symbol: attrConfig with the unit count, pin names and numbers
+#shown, and the reference above and the value below every unit
+def symbolAttrConfig(attrConfig,symbol):
+    attrConfig = copy.deepcopy(attrConfig)
+
+    attrConfig["name"].update({"textOffset":40,
+                               "drawPinnumber":"Y",
+                               "drawPinname":"Y",
+                               "unitCount":len(symbol.units),
+                               "unitsLocked":"L" if len(symbol.units) > 1 else "F"}) #units are different banks, not copies
+    attrConfig["ref"].update({"posx":0,"posy":symbol.top+pinSpacing+labelSize+pinSpacing//2})
+    attrConfig["val"].update({"posx":0,"posy":symbol.bottom-pinSpacing//2})
+
+    return(attrConfig)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+SI value normalization for kicadLibPop.py
+
+Symbol names carry their value in KiCAD's "4u7" style: the SI prefix takes the
+place of the decimal point, and values are shifted to the prefix that keeps
+them between 1 and 1000 (0.1µF becomes 100n0, 4700Ω becomes 4k7).
+
+Prefixes are looked up by their integer power of ten, built once from
+kicadLibPopConst.siUnitToValDict, so no floats are ever compared. Single values
+are scaled with Decimal and are exact. normalizeValues handles whole arrays at
+once with NumPy when it's installed (falling back to a loop when it isn't);
+canonicalizeNames uses it to re-canonicalize every symbol name in a library
+in one pass.
+"""
+
+import math
+import re
+
+from decimal import Decimal
+from kicadLibPopConst import siUnitToValDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#SI prefix -> power of ten, and back
+siUnitToExpDict = {unit:int(round(math.log10(value))) for unit, value in siUnitToValDict.items()}
+siExpToUnitDict = {exp:unit for unit, exp in siUnitToExpDict.items()}
+
+#Value part of a symbol name, e.g. "4u7" or "100n0"
+nameValueRegex = re.compile(r"^(\d+)([a-zA-Z])(\d+)$")
+
+###############################################################################
+### SINGLE VALUES ###
+###############################################################################
+#Power of ten of an SI prefix ("R" or "" for none)
+def getSiExp(unit):
+    return(siUnitToExpDict.get(unit or "R"))
+
+#SI prefix for a power of ten, or None if there isn't one
+def getSiUnit(exp):
+    return(siExpToUnitDict.get(exp))
+
+#SI prefix from the character of an attribute value where it should be (e.g. "µ" in "4.7µF")
+def parseUnit(char,defaultUnit=""):
+    if char.isdigit() or char == " ":
+        return(defaultUnit)
+    if char == "µ":
+        return("u")
+
+    return(char)
+
+#Shift a value to the prefix that keeps it in [1, 1000); returns (Decimal value, unit)
+#Values stay where they are if there's no prefix to shift to
+def normalizeValue(value,unit):
+    value = Decimal(str(value))
+    exp = getSiExp(unit)
+
+    if (exp is None) or (value == 0):
+        return(value,unit)
+
+    while (value < 1) and (getSiUnit(exp-3) is not None):
+        value *= 1000 #avoid values with decimals; move them to the previous unit
+        exp -= 3
+    while (value >= 1000) and (getSiUnit(exp+3) is not None):
+        value /= 1000 #avoid values larger than 1000; move them to the next unit
+        exp += 3
+
+    return(value,getSiUnit(exp))
+
+#Value in symbol name form: the unit replaces the decimal point ("4.7", "u" -> "4u7")
+def formatValue(value,unit):
+    return(str(float(value)).replace(".",unit))
+
+#Normalize the number in an attribute value and format it for a symbol name
+def makeValueStr(numberText,unit):
+    value, unit = normalizeValue(numberText,unit)
+
+    return(formatValue(value,unit))
+
+###############################################################################
+### BATCHES ###
+###############################################################################
+#Normalize arrays of values and units; returns (list of floats, list of units)
+def normalizeValues(values,units):
+    if numpy is None:
+        normalized = [normalizeValue(value,unit) for value, unit in zip(values,units)]
+        return([float(value) for value, unit in normalized],[unit for value, unit in normalized])
+
+    values = numpy.asarray(values,dtype=float)
+    exps = numpy.array([getSiExp(unit) for unit in units],dtype=float) #NaN for unknown prefixes
+
+    minExp = min(exp for exp in siExpToUnitDict if exp % 3 == 0)
+    maxExp = max(exp for exp in siExpToUnitDict if exp % 3 == 0)
+
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        shifts = numpy.floor(numpy.log10(numpy.abs(values))/3)
+    shifts[~numpy.isfinite(shifts) | numpy.isnan(exps) | (numpy.nan_to_num(exps) % 3 != 0)] = 0 #zeros and odd prefixes stay put
+    shifts = numpy.clip(shifts,(minExp-numpy.nan_to_num(exps))/3,(maxExp-numpy.nan_to_num(exps))/3)
+
+    #multiplying or dividing by an exact power of ten keeps the result correctly rounded
+    scales = 10.0**(3*numpy.abs(shifts))
+    values = numpy.where(shifts > 0,values/scales,values*scales)
+    values = [float("{0:.12g}".format(value)) for value in values] #drop binary rounding noise
+
+    newUnits = [unit if numpy.isnan(exp) else getSiUnit(int(exp+3*shift))
+                for unit, exp, shift in zip(units,exps,shifts)]
+
+    return(values,newUnits)
+
+#Split the value out of a symbol name ("C_100n0_10%_..." -> ("100.0","n")), or None
+def splitNameValue(name):
+    words = name.split("_")
+    if len(words) < 2:
+        return(None)
+
+    match = nameValueRegex.match(words[1])
+    if (match is None) or (getSiExp(match.group(2)) is None):
+        return(None)
+
+    return("{0}.{1}".format(match.group(1),match.group(3)),match.group(2))
+
+#Canonical form of many symbol names at once; returns {old name: new name} for the names that change
+def canonicalizeNames(names):
+    parsed = [(name,splitNameValue(name)) for name in names]
+    parsed = [(name,value) for name, value in parsed if value is not None]
+
+    if not parsed:
+        return({})
+
+    values, units = normalizeValues([float(value[0]) for name, value in parsed],[value[1] for name, value in parsed])
+
+    renames = {}
+    for (name, value), newValue, newUnit in zip(parsed,values,units):
+        words = name.split("_")
+        words[1] = formatValue(newValue,newUnit)
+        newName = "_".join(words)
+
+        if newName != name:
+            renames[name] = newName
+
+    return(renames)
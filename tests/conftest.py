@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+#The scripts aren't a package; put the repository on the path so the tests can import them
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#Tests for kicadLibPopFetch.py against the local FixtureServer
+import time
+
+import pytest
+
+from kicadLibPopFetch import CircuitBreaker, CircuitOpen, FetchError, FixtureServer, HttpSession, RetryPolicy
+from kicadLibPopFetch import fetchAll, fetchUrl, inOrder
+
+pages = {"PART{0}-ND".format(index):"<html>page {0}</html>".format(index) for index in range(12)}
+
+###############################################################################
+### FETCH POOL ###
+###############################################################################
+#Later keys finish first, so the pool's results come out of order and inOrder has to put them back
+def test_inOrderRestoresInputOrder():
+    keys = list(range(8))
+
+    def fetch(key):
+        time.sleep(0.02*(len(keys)-key))
+        return(key*10)
+
+    results = list(fetchAll(keys,fetch,len(keys)))
+    assert [index for index, key, result in results] != keys
+    assert sorted(results) == [(key,key,key*10) for key in keys]
+
+    assert list(inOrder(iter(results))) == [(key,key,key*10) for key in keys]
+
+#inOrder yields each result as soon as every earlier one has been seen, not at the end
+def test_inOrderDoesNotWaitForEverything():
+    seen = []
+
+    def results():
+        for index in (1,0,3,2):
+            seen.append(index)
+            yield(index,index)
+
+    ordered = inOrder(results())
+    assert next(ordered) == (0,0)
+    assert seen == [1,0]
+
+#Pages from a server with random latency come back in the order they were asked for
+def test_fetchAllFromServerInOrder():
+    policy = RetryPolicy(0,timeout=5.0)
+
+    with FixtureServer(pages,latency=(0.0,0.05),seed=1) as server, HttpSession(4,5.0) as session:
+        def fetch(partNum):
+            return(fetchUrl(server.urlTemplate.format(partNum),policy,session=session))
+
+        results = list(inOrder(fetchAll(list(pages),fetch,4)))
+
+    assert [(key,result) for index, key, result in results] == list(pages.items())
+    assert [index for index, key, result in results] == list(range(len(pages)))
+
+###############################################################################
+### RETRIES ###
+###############################################################################
+def fastPolicy(retries,timeout=5.0):
+    return(RetryPolicy(retries,timeout,baseDelay=0.001,maxDelay=0.01,seed=1))
+
+#5xx responses are retried until the page comes through
+def test_retriesServerErrors():
+    policy = fastPolicy(3)
+
+    with FixtureServer(pages,failFirst={"PART1-ND":2}) as server:
+        page = fetchUrl(server.urlTemplate.format("PART1-ND"),policy)
+
+        assert page == pages["PART1-ND"]
+        assert server.requestCount == 3
+    assert policy.retried == 2
+
+#Once the retries run out the last error is raised
+def test_givesUpAfterRetries():
+    policy = fastPolicy(2)
+
+    with FixtureServer(pages,failFirst={"PART1-ND":10},errorStatus=502) as server:
+        with pytest.raises(FetchError) as error:
+            fetchUrl(server.urlTemplate.format("PART1-ND"),policy)
+
+        assert "502" in str(error.value)
+        assert server.requestCount == 3
+
+#A page the server doesn't have (404) isn't worth asking for again
+def test_doesNotRetryMissingPages():
+    policy = fastPolicy(3)
+
+    with FixtureServer(pages) as server:
+        with pytest.raises(FetchError):
+            fetchUrl(server.urlTemplate.format("NOPE-ND"),policy)
+
+        assert server.requestCount == 1
+    assert policy.retried == 0
+
+#A server slower than the timeout counts as a failure and is retried
+def test_retriesTimeouts():
+    policy = fastPolicy(1,timeout=0.1)
+
+    with FixtureServer(pages,latency=0.5) as server:
+        start = time.perf_counter()
+        with pytest.raises(FetchError):
+            fetchUrl(server.urlTemplate.format("PART1-ND"),policy)
+
+        assert time.perf_counter()-start < 0.5*2
+    assert policy.retried == 1
+
+#Full jitter: each wait is between 0 and the capped exponential, and at least what Retry-After asks for
+def test_backoffDelays():
+    policy = RetryPolicy(5,baseDelay=0.5,maxDelay=4.0,seed=1)
+
+    for attempt in range(8):
+        for repeat in range(50):
+            assert 0 <= policy.delay(attempt) <= min(4.0,0.5*(2**attempt))
+
+    assert len({policy.delay(3) for repeat in range(20)}) > 1 #random, so threads don't retry together
+    assert policy.delay(0,retryAfter=2.0) >= 2.0
+    assert policy.delay(0,retryAfter=60.0) == 4.0 #capped at maxDelay
+
+###############################################################################
+### CIRCUIT BREAKER ###
+###############################################################################
+#After threshold failures in a row requests fail straight away; after resetTime one is let through, and when it
+#works the breaker closes again
+def test_breakerTripsAndRecovers():
+    policy = fastPolicy(0)
+    breaker = CircuitBreaker(threshold=3,resetTime=0.2)
+
+    with FixtureServer(pages,errorRate=1.0) as server:
+        url = server.urlTemplate.format("PART1-ND")
+
+        for attempt in range(3):
+            with pytest.raises(FetchError):
+                fetchUrl(url,policy,breaker)
+        assert breaker.isOpen
+        assert breaker.trips == 1
+
+        requests = server.requestCount
+        with pytest.raises(CircuitOpen):
+            fetchUrl(url,policy,breaker)
+        assert server.requestCount == requests #not even tried
+
+        server.errorRate = 0.0 #the server recovers
+        time.sleep(0.25)
+        assert fetchUrl(url,policy,breaker) == pages["PART1-ND"]
+
+    assert not breaker.isOpen
+    assert breaker.failures == 0
+
+#If the request let through after resetTime fails, the breaker opens again without counting another trip
+def test_breakerReopensWhenTrialFails():
+    policy = fastPolicy(0)
+    breaker = CircuitBreaker(threshold=2,resetTime=0.2)
+
+    with FixtureServer(pages,errorRate=1.0) as server:
+        url = server.urlTemplate.format("PART1-ND")
+
+        for attempt in range(2):
+            with pytest.raises(FetchError):
+                fetchUrl(url,policy,breaker)
+
+        time.sleep(0.25)
+        requests = server.requestCount
+        with pytest.raises(FetchError) as error:
+            fetchUrl(url,policy,breaker)
+        assert not isinstance(error.value,CircuitOpen)
+        assert server.requestCount == requests+1
+
+        with pytest.raises(CircuitOpen):
+            fetchUrl(url,policy,breaker)
+
+    assert breaker.isOpen
+    assert breaker.trips == 1
+
+#The breaker only counts failures in a row; a page that works in between resets the count
+def test_breakerCountsFailuresInARow():
+    policy = fastPolicy(0)
+    breaker = CircuitBreaker(threshold=2,resetTime=30.0)
+
+    with FixtureServer(pages,failFirst={"PART1-ND":1,"PART2-ND":1}) as server:
+        for partNum in ("PART1-ND","PART3-ND","PART2-ND"):
+            try:
+                fetchUrl(server.urlTemplate.format(partNum),policy,breaker)
+            except FetchError:
+                pass
+
+    assert not breaker.isOpen
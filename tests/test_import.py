@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#Imports run against FixtureServer in a temporary copy of the scripts and libraries (see kicadLibPopBench.makeRunDir)
+import csv
+import json
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from kicadLibPopBench import fixtureCap, makeProductPage, makeRunDir
+from kicadLibPopFetch import FixtureServer
+
+#Product pages for capacitors that aren't in the libraries yet; returns {part number: webpage}
+def capPages(count):
+    pages = {}
+
+    for index in range(count):
+        partNum = "TEST-CAP{0:04d}-ND".format(index)
+        productAttrDict = fixtureCap(index)
+        productAttrDict.update({"Supplier Part Number 1":partNum,"Manufacturer 1":"Test Components"})
+        pages[partNum] = makeProductPage(productAttrDict,filler=2)
+
+    return(pages)
+
+@pytest.fixture
+def runDir(tmp_path):
+    makeRunDir(str(tmp_path))
+    return(tmp_path)
+
+#Run "kicadLibPop.py import" on the part numbers, one request at a time and without retries
+#The part list is only written if it's different, since the checkpoint is for the file as it was (see importKey)
+#Returns (exit code, output, run report)
+def runImport(runDir,server,partNums,*options):
+    partsPath = runDir/"parts.txt"
+    partsText = "\n".join(partNums)+"\n"
+    if not (partsPath.exists() and (partsPath.read_text(encoding="utf-8") == partsText)):
+        partsPath.write_text(partsText,encoding="utf-8")
+    reportPath = runDir/"report.json"
+    command = [sys.executable,"kicadLibPop.py","import","parts.txt","--url-template",server.urlTemplate,"--rate-limit","0",
+               "--concurrency","1","--retries","0","--report",str(reportPath)]+list(options)
+
+    result = subprocess.run(command,cwd=str(runDir),capture_output=True,text=True,encoding="utf-8",timeout=120)
+    report = json.loads(reportPath.read_text(encoding="utf-8")) if reportPath.exists() else None
+
+    return(result.returncode,result.stdout+result.stderr,report)
+
+def readCheckpoint(runDir):
+    return(json.loads((runDir/".cache"/"import.checkpoint").read_text(encoding="utf-8")))
+
+#Part numbers of the test parts in the capacitor library, in order
+def libraryPartNums(runDir):
+    text = (runDir/"SFUSat-cap.lib").read_text(encoding="utf-8")
+    return([line.split('"')[1] for line in text.split("\n")
+            if line.endswith('"Supplier Part Number 1"') and line.split('"')[1].startswith("TEST-")])
+
+###############################################################################
+### CHECKPOINTS ###
+###############################################################################
+#The server fails enough requests in a row to trip the breaker partway through a chunk; the next run retries the
+#parts that failed, carries on after the last chunk written and never fetches a part it already added
+def test_resumesAfterInterruptedChunk(runDir):
+    pages = capPages(10)
+    partNums = list(pages)
+    failing = partNums[2:7] #five failures in a row trip the breaker on the fourth chunk
+
+    with FixtureServer(pages,failFirst={partNum:1 for partNum in failing}) as server:
+        exitCode, output, report = runImport(runDir,server,partNums,"--chunk-size","2")
+
+        assert exitCode == 1, output
+        assert "Stopped after" in output
+        assert libraryPartNums(runDir) == partNums[:2]
+        checkpoint = readCheckpoint(runDir)
+        assert sorted(checkpoint["done"]) == sorted(partNums[:8])
+        assert checkpoint["failed"] == partNums[2:8] #the last one was stopped by the breaker
+        assert report["counters"]["breakerTrips"] == 1
+
+        exitCode, output, report = runImport(runDir,server,partNums,"--chunk-size","2")
+
+    assert exitCode == 0, output
+    assert "Resuming the last import: skipping 8 parts, retrying 6 that failed." in output
+    assert sorted(part["part"] for part in report["parts"]) == sorted(partNums[2:])
+    assert libraryPartNums(runDir) == partNums[:2]+partNums[2:]
+    assert not (runDir/".cache"/"import.checkpoint").exists()
+
+#An MPN that resolved on the first run but doesn't on the next doesn't shift the input, so the resumed import
+#neither skips parts that weren't imported nor imports parts again
+def test_resumeWithMpnThatNoLongerResolves(runDir):
+    pages = capPages(8)
+    partNums = list(pages)
+    mpnPartNum = partNums[0]
+    mpn = "GRMF0000" #fixtureCap(0)'s MPN
+    pages[mpn] = pages[mpnPartNum]
+    fileParts = partNums[1:]
+    failing = fileParts[:5] #trip the breaker after the MPN's part and five failures
+
+    with FixtureServer(pages,failFirst={partNum:1 for partNum in failing}) as server:
+        exitCode, output, report = runImport(runDir,server,fileParts,"--chunk-size","1","--mpn",mpn)
+        assert exitCode == 1, output
+        assert "Stopped after" in output
+        assert libraryPartNums(runDir) == [mpnPartNum]
+
+        del(server.pages[mpn]) #Digi-Key doesn't know the MPN any more
+        exitCode, output, report = runImport(runDir,server,fileParts,"--chunk-size","1","--mpn",mpn,"--cache-mode","refresh")
+
+    assert "Couldn't resolve {0}".format(mpn) in output
+    assert exitCode == 0, output
+    assert sorted(libraryPartNums(runDir)) == sorted(partNums)
+
+#--restart ignores the checkpoint and goes through the whole input again
+def test_restartIgnoresCheckpoint(runDir):
+    pages = capPages(4)
+    partNums = list(pages)
+
+    with FixtureServer(pages,failFirst={partNums[1]:1}) as server:
+        exitCode, output, report = runImport(runDir,server,partNums,"--chunk-size","2")
+        assert exitCode == 1, output
+        assert readCheckpoint(runDir)["failed"] == [partNums[1]]
+
+        exitCode, output, report = runImport(runDir,server,partNums,"--chunk-size","2","--restart")
+
+    assert exitCode == 0, output
+    assert not "Resuming" in output
+    assert sorted(part["part"] for part in report["parts"]) == sorted(partNums)
+    assert {part["part"]:part["outcome"] for part in report["parts"]}[partNums[0]] == "duplicate"
+    assert sorted(libraryPartNums(runDir)) == sorted(partNums)
+
+###############################################################################
+### UNREADABLE PAGES ###
+###############################################################################
+#A search page (no product tables) or a page that can't be parsed fails its part; the rest of the import carries on,
+#the report and checkpoint are written, and running again doesn't fail any differently
+def test_pagesWithoutProductTablesFailTheirPart(runDir):
+    pages = capPages(3)
+    partNums = list(pages)
+    pages["SEARCH-ND"] = '<html><body><table id="productTable"><tbody><tr><td>several parts</td></tr></tbody></table></body></html>'
+    pages["BROKEN-ND"] = '<html><body><table id="product-details"><tbody><tr><td>no header</td></tr></tbody></table></body></html>'
+    inputParts = [partNums[0],"SEARCH-ND",partNums[1],"BROKEN-ND",partNums[2]]
+
+    with FixtureServer(pages) as server:
+        for run in range(2):
+            exitCode, output, report = runImport(runDir,server,inputParts,"--chunk-size","2")
+
+            assert exitCode == 1, output
+            assert not "Traceback" in output
+            outcomes = {part["part"]:part["outcome"] for part in report["parts"]}
+            assert outcomes["SEARCH-ND"] == "failed"
+            assert outcomes["BROKEN-ND"] == "failed"
+            assert sorted(readCheckpoint(runDir)["failed"]) == ["BROKEN-ND","SEARCH-ND"]
+
+    assert "no supplier has SEARCH-ND" in output
+    assert "couldn't parse the page for BROKEN-ND" in output
+    assert libraryPartNums(runDir) == partNums
+
+###############################################################################
+### SUPPLIERS ###
+###############################################################################
+#Only parts parsed from Digi-Key pages go in the attribute store; a local catalog's rows would be returned from the
+#store after the catalog was edited
+def test_catalogPartsAreNotStored(runDir):
+    pages = capPages(2)
+    pagePart, catalogPart = list(pages)
+    del(pages[catalogPart])
+
+    row = fixtureCap(1)
+    row.update({"Supplier Part Number 1":catalogPart,"Manufacturer 1":"Test Components"})
+    with open(str(runDir/"catalog.csv"),"w",encoding="utf-8",newline="") as catalogFile:
+        writer = csv.DictWriter(catalogFile,fieldnames=list(row))
+        writer.writeheader()
+        writer.writerow(row)
+
+    with FixtureServer(pages) as server:
+        exitCode, output, report = runImport(runDir,server,[pagePart,catalogPart],"--catalog","catalog.csv")
+
+    assert exitCode == 0, output
+    assert sorted(libraryPartNums(runDir)) == sorted([pagePart,catalogPart])
+    db = sqlite3.connect(str(runDir/".cache"/"attrs.sqlite"))
+    assert [partNum for (partNum,) in db.execute("SELECT partNum FROM attrs")] == [pagePart]
+    db.close()
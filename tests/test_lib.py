@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#Tests for appending to libraries and rolling back appends that didn't finish (kicadLibPopLib.py)
+import base64
+import json
+import os
+
+import pytest
+
+import kicadLibPopLib
+
+from kicadLibPopLib import Library, appendBlocks, getLibrary, journalPath, libTrailer, loadedLibs, readText, unloadLibrary
+from kicadLibPopLib import writeText
+
+libText = ("EESchema-LIBRARY Version 2.3\n#encoding utf-8\n#\n# A\n#\nDEF A U 0 40 Y Y 1 F N\nF0 \"U\" 0 0 50 H V C CNN\n"
+           "F1 \"A\" 0 0 50 H V C CNN\nDRAW\nENDDRAW\nENDDEF\n#\n#End Library\n")
+
+block = ["#\n# B\n#","DEF B U 0 40 Y Y 1 F N",'F0 "U" 0 0 50 H V C CNN','F1 "B" 0 0 50 H V C CNN',"DRAW","ENDDRAW","ENDDEF"]
+
+class Crash(Exception):
+    pass
+
+@pytest.fixture
+def libPath(tmp_path):
+    path = tmp_path/"test.lib"
+    path.write_bytes(libText.encode("utf-8"))
+    return(str(path))
+
+#Append, dying after the journal is written and "written" bytes of the new tail are in the file (None for all of it
+#without the truncate)
+def crashedAppend(libPath,monkeypatch,written):
+    realWriteJournal = kicadLibPopLib.writeJournal
+
+    def writeJournalThenCrash(libfile,filepath,offset,tail,data):
+        realWriteJournal(libfile,filepath,offset,tail,data)
+        libfile.seek(offset)
+        libfile.write(data if written is None else data[:written])
+        libfile.flush()
+        raise Crash()
+
+    monkeypatch.setattr(kicadLibPopLib,"writeJournal",writeJournalThenCrash)
+    with pytest.raises(Crash):
+        appendBlocks(libPath,[block],libTrailer)
+    monkeypatch.undo()
+
+    assert os.path.exists(journalPath(libPath))
+
+###############################################################################
+### APPENDING ###
+###############################################################################
+def test_appendsBeforeTrailer(libPath):
+    appendBlocks(libPath,[block],libTrailer)
+
+    text = readText(libPath)
+    assert text.endswith("ENDDEF\n#\n# B\n#\nDEF B U 0 40 Y Y 1 F N\n"+'F0 "U" 0 0 50 H V C CNN\nF1 "B" 0 0 50 H V C CNN\n'
+                         "DRAW\nENDDRAW\nENDDEF\n#\n#End Library\n")
+    assert text.count("#End Library") == 1
+    assert not os.path.exists(journalPath(libPath))
+
+#A CRLF checkout: the trailer is found through the \r and the new lines get CRLF too
+def test_appendsToCrlfFile(libPath):
+    with open(libPath,"wb") as libfile:
+        libfile.write(libText.replace("\n","\r\n").encode("utf-8"))
+
+    appendBlocks(libPath,[block],libTrailer)
+
+    with open(libPath,"rb") as libfile:
+        data = libfile.read()
+    assert data.count(b"#End Library") == 1
+    assert data.endswith(b"ENDDEF\r\n#\r\n#End Library\r\n")
+    assert not b"\n" in data.replace(b"\r\n",b"")
+    assert data.index(b"DEF B ") < data.index(b"#End Library")
+
+###############################################################################
+### LOADED LIBRARIES ###
+###############################################################################
+#Symbols are read through one handle that stays open until the library is closed
+def test_symbolsShareOneHandle(libPath):
+    appendBlocks(libPath,[block],libTrailer)
+    library = Library(libPath).load()
+    assert library.symbols.file is None #nothing read yet
+
+    assert library.symbols["A"].name == "A"
+    handle = library.symbols.file
+    assert library.symbols["B"].name == "B"
+    assert library.symbols.file is handle
+
+    library.close()
+    assert handle.closed
+    assert library.symbols["B"].name == "B" #opened again
+    library.close()
+
+#Replacing a loaded library closes its handle first (Windows can't replace an open file); unloading closes it too
+def test_replacingClosesLoadedLibrary(libPath):
+    library = getLibrary(libPath)
+    try:
+        library.symbols["A"]
+        handle = library.symbols.file
+
+        writeText(libPath,libText.replace("DEF A ","DEF C "))
+        assert handle.closed
+
+        library.symbols["A"]
+        handle = library.symbols.file
+    finally:
+        unloadLibrary(libPath)
+
+    assert handle.closed
+    assert not libPath in loadedLibs
+
+###############################################################################
+### RECOVERY ###
+###############################################################################
+#However much of the new tail got written, reading the file rolls it back to what it was
+@pytest.mark.parametrize("written",[0,7,40,None])
+def test_readingRollsBackCrashedAppend(libPath,monkeypatch,written):
+    crashedAppend(libPath,monkeypatch,written)
+
+    assert readText(libPath) == libText
+    assert not os.path.exists(journalPath(libPath))
+
+#Indexing the library rolls back too, so it never sees a tail without #End Library
+def test_loadingRollsBackCrashedAppend(libPath,monkeypatch):
+    crashedAppend(libPath,monkeypatch,40)
+
+    library = Library(libPath).load()
+    assert list(library.symbols) == ["A"]
+    library.close()
+    with open(libPath,"rb") as libfile:
+        assert libfile.read() == libText.encode("utf-8")
+
+#The next append rolls back the last one and then adds its own parts once
+def test_appendAfterCrashedAppend(libPath,monkeypatch):
+    crashedAppend(libPath,monkeypatch,None)
+
+    appendBlocks(libPath,[block],libTrailer)
+
+    text = readText(libPath)
+    assert text.count("DEF B ") == 1
+    assert text.count("#End Library") == 1
+
+#A file replaced after the crash (by another program, or another version from git) isn't the one the journal is
+#for; the journal is thrown away instead of cutting the new file at its offset
+def test_journalForReplacedFileIsDiscarded(libPath,monkeypatch):
+    crashedAppend(libPath,monkeypatch,40)
+
+    replaced = libText.replace("# A\n#\nDEF A U 0 40 Y Y 1 F N","# AA\n#\nDEF AA U 0 40 Y Y 1 F N")
+    with open(libPath,"wb") as libfile:
+        libfile.write(replaced.encode("utf-8"))
+
+    appendBlocks(libPath,[block],libTrailer)
+
+    text = readText(libPath)
+    assert "DEF AA U 0 40 Y Y 1 F N\n" in text
+    assert text.startswith(replaced[:-len("#\n#End Library\n")])
+    assert text.count("#End Library") == 1
+    assert not os.path.exists(journalPath(libPath))
+
+#A file whose content after the offset isn't the append that was going on is left alone
+def test_journalForChangedTailIsDiscarded(libPath,monkeypatch):
+    crashedAppend(libPath,monkeypatch,None)
+
+    with open(journalPath(libPath),"r") as journalFile:
+        journal = json.load(journalFile)
+    journal["data"] = base64.b64encode(b"something else").decode("ascii")
+    with open(journalPath(libPath),"w") as journalFile:
+        json.dump(journal,journalFile)
+
+    with open(libPath,"rb") as libfile:
+        before = libfile.read()
+    assert not kicadLibPopLib.recoverJournal(libPath)
+    with open(libPath,"rb") as libfile:
+        assert libfile.read() == before
+
+#Replacing a file goes through the journal too, so the new contents are kept
+def test_writeTextAfterCrashedAppend(libPath,monkeypatch):
+    crashedAppend(libPath,monkeypatch,7)
+
+    writeText(libPath,libText.replace("DEF A ","DEF C "))
+
+    assert readText(libPath) == libText.replace("DEF A ","DEF C ")
+    assert not os.path.exists(journalPath(libPath))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#Tests for merging libraries symbol by symbol (kicadLibPopManifest.py and "kicadLibPop.py merge")
+import subprocess
+import sys
+
+import pytest
+
+from kicadLibPopBench import makeRunDir
+from kicadLibPopManifest import fileFormat, mergeBlocks
+
+#A block for a symbol, with version standing in for whatever was changed in it
+def makeBlock(name,version):
+    return((name,["#","# {0}".format(name),"#","DEF {0} U 0 40 Y Y 1 F N".format(name),
+                  'F1 "{0}" 0 0 50 H V C CNN'.format(name),"# {0}".format(version),"ENDDEF"]))
+
+def makeBlocks(versions):
+    return([makeBlock(name,version) for name, version in versions])
+
+###############################################################################
+### MERGING BLOCKS ###
+###############################################################################
+#(ours, theirs, base or None, merged, conflicts, blocks taken from theirs); each side is [(name, version)]
+mergeCases = {
+    "unchanged":([("A",1),("B",1)],[("A",1),("B",1)],[("A",1),("B",1)],[("A",1),("B",1)],[],0),
+    "changed on theirs":([("A",1),("B",1)],[("A",1),("B",2)],[("A",1),("B",1)],[("A",1),("B",2)],[],1),
+    "changed on ours":([("A",1),("B",2)],[("A",1),("B",1)],[("A",1),("B",1)],[("A",1),("B",2)],[],0),
+    "same change on both":([("A",2)],[("A",2)],[("A",1)],[("A",2)],[],0),
+    "different changes on both":([("A",2),("B",1)],[("A",3),("B",1)],[("A",1),("B",1)],[("A",2),("B",1)],["A"],0),
+    "removed on theirs":([("A",1),("B",1)],[("B",1)],[("A",1),("B",1)],[("B",1)],[],0),
+    "removed on ours":([("B",1)],[("A",1),("B",1)],[("A",1),("B",1)],[("B",1)],[],0),
+    "changed on ours, removed on theirs":([("A",2),("B",1)],[("B",1)],[("A",1),("B",1)],[("A",2),("B",1)],["A"],0),
+    "removed on ours, changed on theirs":([("B",1)],[("A",2),("B",1)],[("A",1),("B",1)],[("B",1),("A",2)],["A"],1),
+    "added on theirs":([("A",1)],[("A",1),("B",1)],[("A",1)],[("A",1),("B",1)],[],1),
+    "same block added on both":([("A",1),("B",1)],[("A",1),("B",1)],[("A",1)],[("A",1),("B",1)],[],0),
+    "different blocks added on both":([("A",1),("B",1)],[("A",1),("B",2)],[("A",1)],[("A",1),("B",1)],["B"],0),
+    "no base, changed":([("A",1),("B",1)],[("A",1),("B",2)],None,[("A",1),("B",2)],[],1),
+    "no base, added on each side":([("A",1),("B",1)],[("A",1),("C",1)],None,[("A",1),("B",1),("C",1)],[],1),
+}
+
+@pytest.mark.parametrize("case",list(mergeCases))
+def test_mergeBlocks(case):
+    ours, theirs, base, merged, conflicts, taken = mergeCases[case]
+
+    result = mergeBlocks(makeBlocks(ours),makeBlocks(theirs),makeBlocks(base) if base is not None else None)
+
+    assert result == (makeBlocks(merged),conflicts,taken)
+
+###############################################################################
+### FILE FORMATS ###
+###############################################################################
+libText = "EESchema-LIBRARY Version 2.3\n#encoding utf-8\n{0}#\n#End Library\n"
+dcmText = "EESchema-DOCLIB  Version 2.0\n{0}#\n#End Doc Library\n"
+
+def libBlocks(versions):
+    return("".join("\n".join(lines)+"\n" for name, lines in makeBlocks(versions)))
+
+def dcmBlocks(versions):
+    return("".join("#\n$CMP {0}\nD version {1}\n$ENDCMP\n".format(name,version) for name, version in versions))
+
+#The header line decides the format; the extension is only used when there's no header
+def test_fileFormat():
+    assert fileFormat(".merge_file_a1b2c3",libText.format("")) == "lib"
+    assert fileFormat(".merge_file_a1b2c3",dcmText.format("")) == "dcm"
+    assert fileFormat("parts.lib",dcmText.format("")) == "dcm"
+    assert fileFormat("parts.dcm","") == "dcm"
+    assert fileFormat(".merge_file_a1b2c3","") is None
+
+@pytest.fixture
+def runDir(tmp_path):
+    makeRunDir(str(tmp_path))
+    return(tmp_path)
+
+#Run "kicadLibPop.py merge" the way git runs a merge driver (on its temporary files, without extensions)
+#Returns (exit code, output)
+def runMerge(runDir,ours,theirs,base):
+    paths = []
+    for suffix, text in (("ours",ours),("theirs",theirs),("base",base)):
+        path = runDir/".merge_file_{0}".format(suffix)
+        path.write_text(text,encoding="utf-8")
+        paths.append(path.name)
+
+    result = subprocess.run([sys.executable,"kicadLibPop.py","merge",paths[0],paths[1],"--base",paths[2]],cwd=str(runDir),
+                            capture_output=True,text=True,encoding="utf-8",timeout=120)
+    return(result.returncode,result.stdout+result.stderr)
+
+def test_mergesLibTempFiles(runDir):
+    exitCode, output = runMerge(runDir,libText.format(libBlocks([("A",2),("B",1)])),
+                                libText.format(libBlocks([("A",1),("B",2),("C",1)])),libText.format(libBlocks([("A",1),("B",1)])))
+
+    assert exitCode == 0, output
+    assert (runDir/".merge_file_ours").read_text(encoding="utf-8") == libText.format(libBlocks([("A",2),("B",2),("C",1)]))
+
+#.dcm blocks are cut at $CMP, not DEF; merged as a .lib, the whole file would be one block and conflict
+def test_mergesDcmTempFiles(runDir):
+    exitCode, output = runMerge(runDir,dcmText.format(dcmBlocks([("A",2),("B",1)])),dcmText.format(dcmBlocks([("A",1),("B",2)])),
+                                dcmText.format(dcmBlocks([("A",1),("B",1)])))
+
+    assert exitCode == 0, output
+    assert (runDir/".merge_file_ours").read_text(encoding="utf-8") == dcmText.format(dcmBlocks([("A",2),("B",2)]))
+
+def test_mergeConflictExitCode(runDir):
+    exitCode, output = runMerge(runDir,libText.format(libBlocks([("A",2)])),libText.format(libBlocks([("A",3)])),
+                                libText.format(libBlocks([("A",1)])))
+
+    assert exitCode == 1, output
+    assert "Conflict: A was changed" in output
+
+#A .lib can't be merged with a .dcm; the file is left alone for git to report
+def test_mergeRefusesMixedFormats(runDir):
+    ours = libText.format(libBlocks([("A",1)]))
+    exitCode, output = runMerge(runDir,ours,dcmText.format(dcmBlocks([("A",1)])),libText.format(""))
+
+    assert exitCode == 2, output
+    assert "aren't both .lib or both .dcm files" in output
+    assert (runDir/".merge_file_ours").read_text(encoding="utf-8") == ours
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#Tests for kicadLibPopParse.py
+import pytest
+
+from kicadLibPopBench import makeProductPage
+from kicadLibPopParse import getTableRows, parsePage, parserBackends, productTableIds
+
+#What Digi-Key shows for an MPN with several matches: a listing, with none of the product tables
+searchPage = ('<html><body><h1>Results</h1><table id="productTable"><thead><tr><th>Part</th></tr></thead>'
+              '<tbody><tr><td>GRM188R71E104KA01D</td></tr><tr><td>GRM188R71E104KA01J</td></tr></tbody></table></body></html>')
+
+productPage = makeProductPage({"Supplier Part Number 1":"490-1524-1-ND",
+                               "Manufacturer 1":"Murata Electronics North America",
+                               "Manufacturer Part Number 1":"GRM188R71E104KA01D",
+                               "Description":"CAP CER 0.1UF 25V X7R 0603",
+                               "Capacitance":"0.1µF",
+                               "Categories":"Capacitors - Ceramic Capacitors"},filler=2)
+
+#Parse with a backend, skipping the ones whose packages aren't installed
+def parseWith(webpage,backend):
+    if backend != "tokenizer":
+        pytest.importorskip("bs4")
+    if backend == "html5lib":
+        pytest.importorskip("html5lib")
+
+    return(parsePage(webpage,backend))
+
+@pytest.mark.parametrize("backend",parserBackends)
+def test_pageWithoutTablesHasNoRows(backend):
+    doc = parseWith(searchPage,backend)
+
+    for tableId in productTableIds:
+        assert getTableRows(doc,tableId) == []
+
+@pytest.mark.parametrize("backend",parserBackends)
+def test_productPageRows(backend):
+    rows = getTableRows(parseWith(productPage,backend),"product-details")
+
+    assert [(headers[0].strip(),cells[0].strip()) for rowAttrs, headers, cells in rows][0] == ("Digi-Key Part Number","490-1524-1-ND")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#"regenerate" and "store refresh" run in a temporary copy of the scripts and libraries (see kicadLibPopBench.makeRunDir)
+import subprocess
+import sys
+
+import pytest
+
+from kicadLibPopBench import makeRunDir
+
+hiqNames = ["C_10p0_5%_50V_NP0_HIQ_0402","C_12p0_5%_50V_NP0_HIQ_0402","C_5p6_0.25pF_50V_NP0_HIQ_0402"]
+
+@pytest.fixture
+def runDir(tmp_path):
+    makeRunDir(str(tmp_path))
+    return(tmp_path)
+
+#Run kicadLibPop.py with the arguments; returns (exit code, output)
+def runCommand(runDir,*arguments):
+    result = subprocess.run([sys.executable,"kicadLibPop.py"]+list(arguments),cwd=str(runDir),capture_output=True,text=True,
+                            encoding="utf-8",timeout=120)
+    return(result.returncode,result.stdout+result.stderr)
+
+def symbolNames(runDir,libFile):
+    text = (runDir/libFile).read_text(encoding="utf-8")
+    return([line.split(" ")[1] for line in text.split("\n") if line.startswith("DEF ")])
+
+###############################################################################
+### NAMES ###
+###############################################################################
+#A qualifier added to a name by hand (HIQ) isn't one the naming rules could give, so the name is kept
+def test_regenerateKeepsHandEditedNames(runDir):
+    exitCode, output = runCommand(runDir,"regenerate")
+
+    assert exitCode == 0, output
+    names = symbolNames(runDir,"SFUSat-cap.lib")
+    for name in hiqNames:
+        assert name in names
+        assert not "{0} ->".format(name) in output
+
+    exitCode, output = runCommand(runDir,"regenerate")
+    assert exitCode == 0, output
+    assert symbolNames(runDir,"SFUSat-cap.lib") == names
+
+#Names the rules gave are still renamed when the rules give another one
+def test_regenerateRenamesRuleNames(runDir):
+    libPath = runDir/"SFUSat-cap.lib"
+    text = libPath.read_text(encoding="utf-8")
+    oldName = next(name for name in symbolNames(runDir,"SFUSat-cap.lib") if name.endswith("_X7R_0402"))
+    libPath.write_text(text.replace(oldName,oldName.replace("_X7R_","_X9R_")),encoding="utf-8")
+    descPath = runDir/"SFUSat-cap.dcm"
+    descPath.write_text(descPath.read_text(encoding="utf-8").replace(oldName,oldName.replace("_X7R_","_X9R_")),encoding="utf-8")
+
+    exitCode, output = runCommand(runDir,"regenerate","--keep-names")
+    assert exitCode == 0, output
+    assert oldName.replace("_X7R_","_X9R_") in symbolNames(runDir,"SFUSat-cap.lib")
+
+    exitCode, output = runCommand(runDir,"regenerate")
+    assert exitCode == 0, output
+    assert "{0} -> {1}".format(oldName.replace("_X7R_","_X9R_"),oldName) in output
+    assert oldName in symbolNames(runDir,"SFUSat-cap.lib")
+
+#"store refresh" works names out the same way
+def test_storeRefreshKeepsHandEditedNames(runDir):
+    exitCode, output = runCommand(runDir,"store","adopt")
+    assert exitCode == 0, output
+
+    exitCode, output = runCommand(runDir,"store","refresh")
+    assert exitCode == 0, output
+    for name in hiqNames:
+        assert not "{0} ->".format(name) in output
+
+    exitCode, output = runCommand(runDir,"store","sync")
+    assert exitCode == 0, output
+    names = symbolNames(runDir,"SFUSat-cap.lib")
+    for name in hiqNames:
+        assert name in names
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#Tests for the parametric search index (kicadLibPopSearch.py)
+import random
+
+from kicadLibPopSearch import SearchIndex
+
+conditions = [[("Capacitance",">=","100n")],[("Capacitance","<","1u"),("Voltage - Rated",">=","16V")],
+              [("Voltage - Rated","=","50V"),("Package / Case","=","0603")]]
+
+def capFields(rand):
+    return({"Capacitance":"{0}nF".format(rand.randint(1,2000)),"Voltage - Rated":"{0}V".format(rand.choice([6.3,10,16,25,50])),
+            "Package / Case":rand.choice(["0402","0603","0805"])})
+
+###############################################################################
+### ADDING PARTS ###
+###############################################################################
+#Parts added one at a time between searches (as an import does) are found the same as in an index built in one go
+def test_addBetweenSearchesMatchesBulkLoad():
+    rand = random.Random(1)
+    parts = [("cap","C{0}".format(index),capFields(rand)) for index in range(300)]
+    index = SearchIndex()
+    for libKey, name, fields in parts[:200]:
+        index.add(libKey,name,fields,keepSorted=False)
+    index.search(conditions[0]) #sorts the columns loaded in bulk
+
+    for libKey, name, fields in parts[200:]:
+        index.add(libKey,name,fields)
+        assert not index.unsorted #nothing left to sort before the next search
+        index.search(conditions[0])
+
+    bulk = SearchIndex()
+    for libKey, name, fields in parts:
+        bulk.add(libKey,name,fields,keepSorted=False)
+    for condition in conditions:
+        assert index.search(condition) == bulk.search(condition)
+        assert index.search(condition)
+
+#Every column stays sorted by value after adds
+def test_addKeepsColumnsSorted():
+    rand = random.Random(2)
+    index = SearchIndex()
+    for partId in range(100):
+        index.add("cap","C{0}".format(partId),capFields(rand))
+
+    assert not index.unsorted
+    for units in index.columns.values():
+        for values, ids in units.values():
+            assert values == sorted(values)
+            assert sorted(ids) == list(range(100))
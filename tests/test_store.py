@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#"store" commands run in a temporary copy of the scripts and libraries (see kicadLibPopBench.makeRunDir)
+import json
+import subprocess
+import sys
+
+import pytest
+
+from kicadLibPopBench import makeRunDir
+
+@pytest.fixture
+def runDir(tmp_path):
+    makeRunDir(str(tmp_path))
+    return(tmp_path)
+
+#Run "kicadLibPop.py store" with the arguments; returns (exit code, output)
+def runStore(runDir,*arguments):
+    result = subprocess.run([sys.executable,"kicadLibPop.py","store"]+list(arguments),cwd=str(runDir),capture_output=True,
+                            text=True,encoding="utf-8",timeout=120)
+    return(result.returncode,result.stdout+result.stderr)
+
+def symbolNames(runDir,libFile="SFUSat-cap.lib"):
+    text = (runDir/libFile).read_text(encoding="utf-8")
+    return([line.split(" ")[1] for line in text.split("\n") if line.startswith("DEF ")])
+
+def descNames(runDir,descFile="SFUSat-cap.dcm"):
+    text = (runDir/descFile).read_text(encoding="utf-8")
+    return([line[5:].strip() for line in text.split("\n") if line.startswith("$CMP ")])
+
+#{file name: (bytes, mtime)} of the libraries, to tell whether a sync touched them
+def libraryFiles(runDir):
+    return({path.name:(path.read_bytes(),path.stat().st_mtime_ns) for path in sorted(runDir.glob("SFUSat*.lib"))+
+            sorted(runDir.glob("SFUSat*.dcm"))})
+
+#Rename a symbol in the capacitor library and its description file by hand
+def renameByHand(runDir,oldName,newName):
+    for fileName in ("SFUSat-cap.lib","SFUSat-cap.dcm"):
+        path = runDir/fileName
+        path.write_text(path.read_text(encoding="utf-8").replace(oldName,newName),encoding="utf-8")
+
+#A capacitor whose name the rules gave, and the same name with a different temperature coefficient (that the rules
+#would rename back)
+def renamedCap(runDir):
+    name = next(name for name in symbolNames(runDir) if name.endswith("_X7R_0402"))
+    return(name,name.replace("_X7R_","_X9R_"))
+
+def storedParts(runDir):
+    exitCode, output = runStore(runDir,"list","--json")
+    assert exitCode == 0, output
+    return(json.loads(output[:output.rindex("]")+1]))
+
+###############################################################################
+### SYNCING ###
+###############################################################################
+#Adopting records every part as written, so the sync right after has nothing to do and doesn't touch the libraries
+def test_adoptThenSyncWritesNothing(runDir):
+    before = libraryFiles(runDir)
+
+    exitCode, output = runStore(runDir,"adopt")
+    assert exitCode == 0, output
+    parts = storedParts(runDir)
+    assert parts
+    assert all(part["syncedRevision"] == part["revision"] for part in parts)
+
+    exitCode, output = runStore(runDir,"sync")
+    assert exitCode == 0, output
+    assert "Wrote 0 parts and took out 0." in output
+    assert libraryFiles(runDir) == before
+
+#A refresh renames a part whose name the rules would give differently; sync writes the parts that changed in place,
+#and a second sync has nothing left to do
+def test_refreshThenSync(runDir):
+    ruleName, oldName = renamedCap(runDir)
+    renameByHand(runDir,ruleName,oldName)
+    names = symbolNames(runDir)
+
+    assert runStore(runDir,"adopt")[0] == 0
+    exitCode, output = runStore(runDir,"refresh")
+    assert exitCode == 0, output
+    assert "{0} -> {1}".format(oldName,ruleName) in output
+    pending = [part for part in storedParts(runDir) if part["syncedRevision"] != part["revision"]]
+    assert ruleName in [part["name"] for part in pending]
+
+    exitCode, output = runStore(runDir,"sync")
+    assert exitCode == 0, output
+    assert "Wrote {0} parts".format(len(pending)) in output
+    assert "SFUSat-cap.lib: updated {0} (was {1})".format(ruleName,oldName) in output
+    assert symbolNames(runDir) == [ruleName if name == oldName else name for name in names]
+    assert ruleName in descNames(runDir)
+    assert not oldName in descNames(runDir)
+
+    synced = libraryFiles(runDir)
+    exitCode, output = runStore(runDir,"sync")
+    assert exitCode == 0, output
+    assert "Wrote 0 parts and took out 0." in output
+    assert libraryFiles(runDir) == synced
+
+    exitCode, output = runStore(runDir,"refresh")
+    assert "0 parts changed" in output
+
+#A removed part is taken out of its library and description file by the next sync, and stays out
+def test_removeThenSync(runDir):
+    assert runStore(runDir,"adopt")[0] == 0
+    part = next(part for part in storedParts(runDir) if part["library"] == "cap")
+    others = [name for name in symbolNames(runDir) if name != part["name"]]
+
+    exitCode, output = runStore(runDir,"remove",part["partNum"])
+    assert exitCode == 0, output
+    assert "Removed 1 parts" in output
+    assert [stored["deleted"] for stored in storedParts(runDir) if stored["partNum"] == part["partNum"]] == [1]
+
+    exitCode, output = runStore(runDir,"sync")
+    assert exitCode == 0, output
+    assert "Wrote 0 parts and took out 1." in output
+    assert symbolNames(runDir) == others
+    assert not part["name"] in descNames(runDir)
+    assert not part["partNum"] in [stored["partNum"] for stored in storedParts(runDir)] #forgotten once it's taken out
+
+    exitCode, output = runStore(runDir,"sync")
+    assert "Wrote 0 parts and took out 0." in output
+
+    exitCode, output = runStore(runDir,"remove","NOT-STORED-ND")
+    assert exitCode == 1, output
+
+#A part can't be renamed to a name another symbol (here one drawn by hand, not in the store) already has; the sync
+#reports the conflict, leaves the part as it is and tries again next time
+def test_renameCollision(runDir):
+    ruleName, oldName = renamedCap(runDir)
+    renameByHand(runDir,ruleName,oldName)
+    libPath = runDir/"SFUSat-cap.lib"
+    handMade = ("#\n# {0}\n#\nDEF {0} C 0 10 N N 1 F N\nF0 \"C\" 0 50 50 H V L BNN\nF1 \"{0}\" 0 -50 50 H V L TNN\n"
+                "DRAW\nENDDRAW\nENDDEF\n").format(ruleName)
+    text = libPath.read_text(encoding="utf-8")
+    libPath.write_text(text.replace("#\n#End Library",handMade+"#\n#End Library"),encoding="utf-8")
+
+    assert runStore(runDir,"adopt")[0] == 0
+    exitCode, output = runStore(runDir,"refresh")
+    assert "{0} -> {1}".format(oldName,ruleName) in output
+
+    before = libraryFiles(runDir)
+    for run in range(2):
+        exitCode, output = runStore(runDir,"sync")
+
+        assert exitCode == 1, output
+        assert "{0} can't be renamed to {1}, which already exists".format(oldName,ruleName) in output
+        assert "1 conflicts" in output
+        assert symbolNames(runDir).count(ruleName) == 1
+        assert oldName in symbolNames(runDir)
+    assert libraryFiles(runDir)["SFUSat-cap.lib"][0] == before["SFUSat-cap.lib"][0]